@@ -1,30 +1,68 @@
-import requests
 import random
+import atexit
+import functools
+import base64
 import string
 import time
 import json
+import threading
 import uuid
 from datetime import datetime, timedelta, timezone
-from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, make_response
 from flask_cors import CORS
+from order_store import OrderStore
+from metrics import LatencyHistogram, REGISTRY, HTTP_REQUEST_DURATION, PROMETHEUS_CONTENT_TYPE
+from cache import CachedValue, LRUCache
+from events import EventHub, format_sse
+from quota import QuotaCounter, ShardedSupabaseQuota, CLAIM_OK, CLAIM_ALREADY_CLAIMED, CLAIM_NOT_ELIGIBLE, CLAIM_SOLD_OUT
+from verification_store import MemoryVerificationCodeStore, SupabaseVerificationCodeStore, VerificationCodeSweeper
+from invite_stats import MemoryInviteSummaryStore, SupabaseInviteSummaryStore, format_invite_stats, format_invite_progress
+from signup import MemorySignupEngine, SupabaseSignup, SIGNUP_OK, SIGNUP_INVALID_CODE, SIGNUP_ALREADY_REGISTERED
+from logs import configure_logging, get_logger, stats as log_stats
+from order_numbers import OrderNumberAllocator, supabase_reserver
+from records import OrderRecord
+from idempotency import MemoryIdempotencyStore, SQLiteIdempotencyStore, IDEMPOTENCY_NEW, IDEMPOTENCY_REPLAY, IDEMPOTENCY_MESSAGES, MAX_KEY_LENGTH, request_fingerprint
+from write_behind import WriteBehindBuffer, SQLiteJournal
+from rate_limit import RateLimit, RateLimiter, MemoryRateLimitStore, SQLiteRateLimitStore, rejection_response, client_address
+from sqlite_backend import SQLiteDatabase, SQLiteVerificationCodeStore, SQLiteOrderStore, SQLiteSignupEngine, SQLiteInviteSummaryStore, SQLiteQuota
 
 app = Flask(__name__)
 
+# 浏览器跨域请求可以携带的请求头和可以读取的响应头（asgi_app.py 共用）
+CORS_ALLOW_HEADERS = ["Content-Type", "Authorization", "Idempotency-Key", "If-None-Match"]
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed", "ETag", "Retry-After"]
+
 # 更详细的CORS配置，支持开发环境
 CORS(app, resources={
     r"/*": {
         "origins": ["http://localhost:8081", "http://localhost:3000", "http://localhost:19006"],
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": CORS_ALLOW_HEADERS,
+        "expose_headers": CORS_EXPOSE_HEADERS,
         "supports_credentials": True
     }
 })
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    """按路由模板、方法和状态码记录接口耗时（/metrics 导出）"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_DURATION.observe((time.perf_counter() - started) * 1000, request.method, route, response.status_code)
+    return response
+
 load_dotenv()
 
+# 日志在后台线程写出，级别/采样率/格式由 LOG_LEVEL、LOG_SAMPLE_RATE、LOG_FORMAT 控制（start_background_services 中配置）
+logger = get_logger('api')
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SPUG_URL = os.getenv("SPUG_URL")
@@ -35,49 +73,120 @@ DEVELOPMENT_MODE = not SUPABASE_URL or SUPABASE_URL == "your_supabase_project_ur
 # 强制开发模式用于测试（可以通过环境变量覆盖）
 if os.getenv("FORCE_DEV_MODE", "false").lower() == "true":
     DEVELOPMENT_MODE = True
-    print("🔧 强制开发模式已启用")
+    logger.info("🔧 强制开发模式已启用")
 
-if DEVELOPMENT_MODE:
-    print("⚠️  开发模式：未配置真实的Supabase，将使用模拟数据")
-    supabase = None
+# 服务进程数（start_api.sh 以 gunicorn/uvicorn 多进程启动），多进程时本地状态需要放在进程间共享的存储中
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# 本地存储：memory（进程内，重启后丢失）或 sqlite（本地数据库文件，启动时应用 migrations/ 和 jwt/migrations_sqlite/ 下的迁移）
+# 使用 sqlite 时不连接Supabase，其余行为与开发模式相同；开发模式多进程部署时默认使用 sqlite，各进程共享同一个数据库文件
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite" if DEVELOPMENT_MODE and WORKERS > 1 else "memory").lower()
+if STORAGE_BACKEND == "sqlite":
+    DEVELOPMENT_MODE = True
+elif DEVELOPMENT_MODE and WORKERS > 1:
+    logger.warning("⚠️  多进程部署(WORKERS=%s)使用内存存储，验证码、用户和订单不在进程间共享", WORKERS)
+
+# 生产模式的客户端：Supabase客户端池（每次数据库操作借出一个客户端）和短信网关HTTP会话
+# 客户端在第一次使用时才导入和创建（见 create_app 的后台预热），冷启动不必等待
+supabase_pool = None
+http_session = None
+# 短信后台发送队列（生产模式，第一次发送时创建），接口存储验证码后立即返回
+sms_dispatcher = None
+_sms_dispatcher_lock = threading.Lock()
+# 本地SQLite数据库（STORAGE_BACKEND=sqlite）
+sqlite_db = None
+
+if DEVELOPMENT_MODE and STORAGE_BACKEND == "sqlite":
+    sqlite_db = SQLiteDatabase(os.getenv("SQLITE_PATH", "omnilaze.db")).migrate()
+    logger.info("🗄️  本地SQLite存储: %s", sqlite_db.path, extra=sqlite_db.stats())
+elif DEVELOPMENT_MODE:
+    logger.warning("⚠️  开发模式：未配置真实的Supabase，将使用模拟数据")
 else:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    from clients import create_supabase_pool
+    supabase_pool = create_supabase_pool(
+        SUPABASE_URL, SUPABASE_KEY,
+        size=int(os.getenv("SUPABASE_POOL_SIZE", "8")),
+        timeout=float(os.getenv("SUPABASE_TIMEOUT", "5")),
+        acquire_timeout=float(os.getenv("SUPABASE_POOL_TIMEOUT", "5")),
+    )
+
+def get_sms_dispatcher():
+    """生产模式的短信发送队列，第一次调用时导入 requests、创建HTTP会话并启动工作线程"""
+    global sms_dispatcher, http_session
+    if sms_dispatcher is None:
+        with _sms_dispatcher_lock:
+            if sms_dispatcher is None:
+                from sms_dispatch import SmsDispatcher, TimeoutSession
+                http_session = TimeoutSession(
+                    timeout=float(os.getenv("SMS_TIMEOUT", "5")),
+                    pool_size=int(os.getenv("SMS_MAX_CONCURRENCY", "4")),
+                )
+                sms_dispatcher = SmsDispatcher(
+                    SPUG_URL,
+                    workers=int(os.getenv("SMS_WORKERS", "4")),
+                    queue_size=int(os.getenv("SMS_QUEUE_SIZE", "1000")),
+                    max_concurrency=int(os.getenv("SMS_MAX_CONCURRENCY", "4")),
+                    max_retries=int(os.getenv("SMS_MAX_RETRIES", "3")),
+                    timeout=float(os.getenv("SMS_TIMEOUT", "5")),
+                    session=http_session,
+                ).start()
+    return sms_dispatcher
 
 def generate_verification_code():
     return ''.join(random.choices(string.digits, k=6))
 
+# 验证码存储：开发模式用内存或本地SQLite，生产模式用Supabase；后台线程定期分批清理过期验证码（start_background_services 中启动）
+VERIFICATION_CODE_TTL = int(os.getenv("VERIFICATION_CODE_TTL", "600"))
+if sqlite_db is not None:
+    verification_store = SQLiteVerificationCodeStore(sqlite_db, ttl_seconds=VERIFICATION_CODE_TTL)
+elif DEVELOPMENT_MODE:
+    verification_store = MemoryVerificationCodeStore(
+        ttl_seconds=VERIFICATION_CODE_TTL,
+        max_entries=int(os.getenv("VERIFICATION_CODE_MAX_ENTRIES", "100000")),
+    )
+else:
+    verification_store = SupabaseVerificationCodeStore(supabase_pool, ttl_seconds=VERIFICATION_CODE_TTL)
+verification_sweeper = VerificationCodeSweeper(
+    verification_store,
+    interval=float(os.getenv("VERIFICATION_SWEEP_INTERVAL", "60")),
+    batch_size=int(os.getenv("VERIFICATION_SWEEP_BATCH", "1000")),
+)
+
+# 实时事件推送中心：订单状态按用户推送（主题 user:<user_id>），免单名额推送到主题 quota
+event_hub = EventHub(
+    buffer_size=int(os.getenv("SSE_BUFFER_SIZE", "64")),
+    max_subscribers=int(os.getenv("SSE_MAX_SUBSCRIBERS", "1000")),
+)
+
+def publish_order_event(event_type, order):
+    """推送订单变化给该订单的用户"""
+    event_hub.publish(f"user:{order['user_id']}", event_type, {
+        'order_id': order['id'],
+        'order_number': order['order_number'],
+        'status': order['status'],
+        'user_rating': order.get('user_rating')
+    })
+
 # 开发模式的内存存储
-dev_verification_codes = {}
-dev_users = {}
-dev_invite_codes = {'1234': True, 'WELCOME': True, 'LANDE': True, 'OMNILAZE': True, 'ADVX2025': True}  # 有效的邀请码
-# 开发模式订单存储
-dev_orders = {}
-# 开发模式用户序号计数器
-dev_user_sequence_counter = 0
+dev_invite_codes = {'1234': None, 'WELCOME': None, 'LANDE': None, 'OMNILAZE': None, 'ADVX2025': None}  # 有效的邀请码 -> 最大使用次数（None 不限）
+# 开发模式订单存储（带按日计数、用户序号和用户索引）
+dev_orders = SQLiteOrderStore(sqlite_db) if sqlite_db is not None else OrderStore()
+
+# 邀请统计：开发模式在内存中汇总，生产模式读取由触发器维护的 user_invite_summaries 表
+# 邀请码注册：开发模式为进程内注册引擎，生产模式为数据库函数 signup_with_invite
+# 本地SQLite存储时两者都读写迁移建立的 users / invite_codes / invitations 表
+if sqlite_db is not None:
+    invite_summaries = SQLiteInviteSummaryStore(sqlite_db)
+    signup_engine = SQLiteSignupEngine(sqlite_db)
+elif DEVELOPMENT_MODE:
+    invite_summaries = MemoryInviteSummaryStore()
+    signup_engine = MemorySignupEngine(dev_invite_codes, invite_summaries)
+else:
+    invite_summaries = SupabaseInviteSummaryStore(supabase_pool)
+    signup_engine = SupabaseSignup(supabase_pool)
 
 def store_verification_code(phone_number, code):
-    if DEVELOPMENT_MODE:
-        # 开发模式：存储到内存
-        expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
-        dev_verification_codes[phone_number] = {
-            'code': code,
-            'expires_at': expires_at,
-            'used': False,
-            'created_at': datetime.now(timezone.utc)
-        }
-        return {"success": True}
-    else:
-        # 生产模式：存储到Supabase
-        expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
-        
-        result = supabase.table('verification_codes').upsert({
-            'phone_number': phone_number,
-            'code': code,
-            'expires_at': expires_at.isoformat(),
-            'used': False
-        }).execute()
-        
-        return result
+    return verification_store.put(phone_number, code)
 
 def send_verification_code(phone_number):
     code = generate_verification_code()
@@ -86,134 +195,138 @@ def send_verification_code(phone_number):
     
     if DEVELOPMENT_MODE:
         # 开发模式：模拟发送成功，并在控制台显示验证码
-        print(f"📱 开发模式 - 验证码已生成: {phone_number} -> {code}")
+        logger.info("📱 开发模式 - 验证码已生成: %s -> %s", phone_number, code)
         return {"success": True, "message": "验证码发送成功（开发模式）", "dev_code": code}
     else:
-        # 生产模式：真实发送短信
-        body = {'name': '验证码', 'code': code, 'targets': phone_number}
-        response = requests.post(SPUG_URL, json=body)
-        
-        if response.status_code == 200:
+        # 生产模式：放入短信发送队列，由后台线程发送
+        if get_sms_dispatcher().submit(phone_number, code):
             return {"success": True, "message": "验证码发送成功"}
         else:
-            return {"success": False, "message": "验证码发送失败"}
+            return {"success": False, "message": "短信服务繁忙，请稍后重试"}
+
+# 验证码消费结果 -> 返回信息
+CONSUME_CODE_MESSAGES = {
+    'ok': "验证码验证成功",
+    'not_found': "验证码不存在或已使用",
+    'expired': "验证码已过期",
+    'mismatch': "验证码错误",
+}
 
 def verify_code(phone_number, input_code):
-    if DEVELOPMENT_MODE:
-        # 开发模式：从内存验证
-        if phone_number not in dev_verification_codes:
-            return {"success": False, "message": "验证码不存在或已使用"}
-        
-        code_record = dev_verification_codes[phone_number]
-        
-        if code_record['used']:
-            return {"success": False, "message": "验证码不存在或已使用"}
-        
-        # 检查是否过期
-        if datetime.now(timezone.utc) > code_record['expires_at']:
-            return {"success": False, "message": "验证码已过期"}
-        
-        # 验证验证码
-        if code_record['code'] != input_code:
-            return {"success": False, "message": "验证码错误"}
-        
-        # 标记为已使用
-        code_record['used'] = True
-        return {"success": True, "message": "验证码验证成功"}
-    else:
-        # 生产模式：从Supabase验证
-        result = supabase.table('verification_codes').select('*').eq('phone_number', phone_number).eq('used', False).order('created_at', desc=True).limit(1).execute()
-        
-        if not result.data:
-            return {"success": False, "message": "验证码不存在或已使用"}
-        
-        code_record = result.data[0]
-        expires_at_str = code_record['expires_at']
-        if expires_at_str.endswith('+00:00'):
-            expires_at_str = expires_at_str.replace('+00:00', 'Z')
-        expires_at = datetime.fromisoformat(expires_at_str.replace('Z', '+00:00'))
-        
-        if datetime.now(timezone.utc) > expires_at:
-            return {"success": False, "message": "验证码已过期"}
-        
-        if code_record['code'] != input_code:
-            return {"success": False, "message": "验证码错误"}
-        
-        # 标记验证码为已使用
-        supabase.table('verification_codes').update({'used': True}).eq('id', code_record['id']).execute()
-        
-        return {"success": True, "message": "验证码验证成功"}
+    # 开发模式在内存中、生产模式由数据库函数一次完成校验、过期检查和标记已使用
+    status = verification_store.consume(phone_number, input_code)
+    return {"success": status == 'ok', "message": CONSUME_CODE_MESSAGES.get(status, "验证码验证失败")}
 
-def login_with_phone(phone_number, verification_code):
-    print(f"🔐 开始登录验证: {phone_number}")
-    verify_result = verify_code(phone_number, verification_code)
-    
-    if not verify_result["success"]:
-        print(f"❌ 验证码验证失败: {verify_result['message']}")
-        return verify_result
-    
-    print(f"✅ 验证码验证成功: {phone_number}")
-    is_new_user = False
+# 用户资料缓存：按手机号和用户ID两个键缓存同一份资料，登录和注册时写入，用户数据变更时失效
+user_cache = LRUCache(
+    max_entries=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+)
+
+def cache_user(user):
+    user_cache.put(('phone', user['phone_number']), user)
+    user_cache.put(('id', str(user['id'])), user)
+
+def invalidate_cached_user(user_id):
+    """用户数据变更后调用，同时失效手机号和用户ID两个键"""
+    user = user_cache.get(('id', str(user_id)))
+    user_cache.invalidate(('id', str(user_id)))
+    if user is not None:
+        user_cache.invalidate(('phone', user['phone_number']))
+
+def get_cached_user_by_phone(phone_number):
+    return user_cache.get(('phone', phone_number))
+
+def get_user_by_phone(phone_number):
+    """按手机号读取用户资料（先查缓存），用户不存在时返回None"""
+    user = get_cached_user_by_phone(phone_number)
+    if user is not None:
+        return user
     
     if DEVELOPMENT_MODE:
-        # 开发模式：使用内存存储用户
-        print(f"📝 当前用户列表: {list(dev_users.keys())}")
-        if phone_number not in dev_users:
-            # 新用户，但暂不创建，等待邀请码验证
-            is_new_user = True
-            user_id = f"dev_user_{len(dev_users) + 1}"
-            print(f"🆕 检测到新用户: {phone_number}")
-        else:
-            user_data = dev_users[phone_number]
-            user_id = user_data['id']
-            user_sequence = user_data.get('user_sequence', 0)
-            print(f"👤 老用户登录: {phone_number} (ID: {user_id}, 序号: {user_sequence})")
-        
-        print(f"✅ 开发模式 - 用户验证成功: {phone_number} (新用户: {is_new_user})")
+        user = signup_engine.get_user_by_phone(phone_number)
     else:
-        # 生产模式：使用Supabase
-        user_result = supabase.table('users').select('*').eq('phone_number', phone_number).execute()
-        
-        if not user_result.data:
-            # 新用户，但暂不创建，等待邀请码验证
-            is_new_user = True
-            user_id = f"temp_user_{phone_number}"  # 临时ID
-            print(f"🆕 检测到新用户: {phone_number}")
-        else:
-            user_id = user_result.data[0]['id']
-            print(f"👤 老用户登录: {phone_number} (ID: {user_id})")
+        with supabase_pool.connection() as supabase:
+            user_result = supabase.table('users').select('*').eq('phone_number', phone_number).execute()
+        user = user_result.data[0] if user_result.data else None
+    
+    if user is not None:
+        cache_user(user)
+    return user
+
+def login_result(phone_number, user):
+    """根据用户资料构造登录结果，user为None表示新用户"""
+    is_new_user = user is None
+    if is_new_user:
+        # 新用户，但暂不创建，等待邀请码验证
+        logger.info("🆕 检测到新用户: %s", phone_number)
+    else:
+        logger.info("👤 老用户登录: %s", phone_number, extra={'user_id': user['id'], 'user_sequence': user.get('user_sequence')})
     
     result = {
         "success": True,
         "message": "验证成功" if not is_new_user else "新用户验证成功，请输入邀请码",
-        "user_id": user_id if not is_new_user else None,
+        "user_id": user['id'] if not is_new_user else None,
         "phone_number": phone_number,
         "is_new_user": is_new_user
     }
     
-    # 如果是老用户，添加用户序号
-    if not is_new_user and DEVELOPMENT_MODE:
-        result["user_sequence"] = user_sequence
-    elif not is_new_user and not DEVELOPMENT_MODE:
-        # 生产模式：从数据库获取用户序号
-        # TODO: 这里需要在生产模式实现
-        pass
+    # 如果是老用户，添加用户序号（生产模式取自同一条用户记录，不再额外查询）
+    if not is_new_user and user.get('user_sequence') is not None:
+        result["user_sequence"] = user['user_sequence']
+    return result
+
+def login_with_phone(phone_number, verification_code):
+    logger.debug("🔐 开始登录验证: %s", phone_number)
+    verify_result = verify_code(phone_number, verification_code)
+    
+    if not verify_result["success"]:
+        logger.info("❌ 验证码验证失败: %s", verify_result['message'], extra={'phone_number': phone_number})
+        return verify_result
+    
+    logger.debug("✅ 验证码验证成功: %s", phone_number)
     
-    print(f"📤 返回结果: {result}")
+    # 老用户命中缓存时，整个登录只有验证码这一次数据库往返
+    result = login_result(phone_number, get_user_by_phone(phone_number))
+    
+    logger.debug("📤 返回结果: %s", result)
     return result
 
+# 请求限流：发送验证码和验证码登录按手机号和客户端IP限流（GCRA，规则为 "次数/秒数"）
+# 存储为进程内（memory）或本地SQLite（sqlite，同一台机器上的多个工作进程共享，多进程部署时默认）
+# 部署在反向代理之后时，RATE_LIMIT_TRUSTED_PROXIES 为受信任的代理层数，按这些代理追加的 X-Forwarded-For 地址限流
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+if os.getenv("RATE_LIMIT_BACKEND", "sqlite" if WORKERS > 1 else "memory").lower() == "sqlite":
+    rate_limit_store = SQLiteRateLimitStore(sqlite_db or SQLiteDatabase(os.getenv("SQLITE_PATH", "omnilaze.db")).migrate())
+else:
+    rate_limit_store = MemoryRateLimitStore(max_entries=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+rate_limiter = RateLimiter(rate_limit_store, [
+    RateLimit.parse('sms_phone', os.getenv("RATE_LIMIT_SMS_PHONE", "5/3600")),
+    RateLimit.parse('sms_ip', os.getenv("RATE_LIMIT_SMS_IP", "20/3600")),
+    RateLimit.parse('login_phone', os.getenv("RATE_LIMIT_LOGIN_PHONE", "10/600")),
+    RateLimit.parse('login_ip', os.getenv("RATE_LIMIT_LOGIN_IP", "60/600")),
+], enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true")
+
+def check_rate_limit(kind, phone_number, ip):
+    """kind 为 sms 或 login，被限流时返回 (JSON内容, 响应头)，否则返回None"""
+    rejection = rate_limiter.check((f'{kind}_phone', phone_number), (f'{kind}_ip', ip))
+    if rejection is None:
+        return None
+    logger.info("🚫 请求被限流: %s", phone_number, extra={'rule': rejection.rule, 'ip': ip, 'retry_after': round(rejection.retry_after, 1)})
+    return rejection_response(rejection)
+
+def request_ip():
+    return client_address(request.remote_addr, request.headers.get('X-Forwarded-For'), RATE_LIMIT_TRUSTED_PROXIES)
+
 # Flask API路由
 
 @app.route('/send-verification-code', methods=['POST'])
 def api_send_verification_code():
     """发送验证码API"""
-    print(f"📱 收到发送验证码请求 - Origin: {request.headers.get('Origin', 'Unknown')}")
     try:
         data = request.get_json()
         phone_number = data.get('phone_number')
         
-        print(f"📱 手机号: {phone_number}")
-        
         if not phone_number:
             return jsonify({"success": False, "message": "手机号不能为空"}), 400
         
@@ -221,19 +334,28 @@ def api_send_verification_code():
         if len(phone_number) != 11 or not phone_number.isdigit():
             return jsonify({"success": False, "message": "请输入正确的11位手机号码"}), 400
         
+        # 限流在生成验证码和调用短信网关之前
+        limited = check_rate_limit('sms', phone_number, request_ip())
+        if limited:
+            body, headers = limited
+            return jsonify(body), 429, headers
+        
         result = send_verification_code(phone_number)
         
         if result["success"]:
-            print(f"✅ 验证码发送成功: {phone_number}")
+            logger.info("✅ 验证码发送成功: %s", phone_number)
             return jsonify(result), 200
         else:
-            print(f"❌ 验证码发送失败: {result['message']}")
+            logger.warning("❌ 验证码发送失败: %s", result['message'], extra={'phone_number': phone_number})
             return jsonify(result), 500
             
     except Exception as e:
-        print(f"❌ 服务器错误: {str(e)}")
+        logger.exception("❌ 服务器错误: %s", e)
         return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
 
+# 登录路径延迟直方图（验证码校验 + 用户查询），在 /health 中输出
+login_latency = LatencyHistogram()
+
 @app.route('/login-with-phone', methods=['POST'])
 def api_login_with_phone():
     """验证码登录API"""
@@ -253,7 +375,15 @@ def api_login_with_phone():
         if len(verification_code) != 6 or not verification_code.isdigit():
             return jsonify({"success": False, "message": "请输入6位数字验证码"}), 400
         
+        # 限制验证码尝试次数，防止暴力猜测
+        limited = check_rate_limit('login', phone_number, request_ip())
+        if limited:
+            body, headers = limited
+            return jsonify(body), 429, headers
+        
+        started = time.perf_counter()
         result = login_with_phone(phone_number, verification_code)
+        login_latency.observe((time.perf_counter() - started) * 1000)
         
         if result["success"]:
             return jsonify(result), 200
@@ -263,94 +393,87 @@ def api_login_with_phone():
     except Exception as e:
         return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
 
+# 注册失败结果 -> 返回信息
+SIGNUP_MESSAGES = {
+    SIGNUP_INVALID_CODE: "邀请码无效或已达到使用次数限制",
+    SIGNUP_ALREADY_REGISTERED: "该手机号已注册",
+}
+
 def verify_invite_code_and_create_user(phone_number, invite_code):
-    """验证邀请码并创建新用户"""
-    print(f"🔑 验证邀请码: {phone_number} -> {invite_code}")
+    """验证邀请码并创建新用户：占用邀请码、创建用户、分配用户序号和记录邀请关系一次原子完成"""
+    logger.debug("🔑 验证邀请码: %s -> %s", phone_number, invite_code)
     
-    if DEVELOPMENT_MODE:
-        # 开发模式：检查内存中的邀请码
-        print(f"📝 可用邀请码: {list(dev_invite_codes.keys())}")
-        if invite_code not in dev_invite_codes:
-            print(f"❌ 邀请码无效: {invite_code}")
-            return {"success": False, "message": "邀请码无效"}
-        
-        # 创建新用户，分配用户序号
-        global dev_user_sequence_counter
-        dev_user_sequence_counter += 1
-        user_sequence = dev_user_sequence_counter
-        user_id = f"dev_user_{user_sequence}"
-        
-        dev_users[phone_number] = {
-            'id': user_id,
-            'phone_number': phone_number,
-            'user_sequence': user_sequence,
-            'created_at': datetime.now(timezone.utc).isoformat(),
-            'invite_code': invite_code
-        }
-        
-        print(f"✅ 开发模式 - 新用户创建成功: {phone_number} (ID: {user_id}, 序号: {user_sequence})")
-        return {
-            "success": True,
-            "message": "新用户注册成功",
-            "user_id": user_id,
-            "phone_number": phone_number,
-            "user_sequence": user_sequence
-        }
-    else:
-        # 生产模式：从Supabase验证邀请码
-        invite_result = supabase.table('invite_codes').select('*').eq('code', invite_code).eq('used', False).execute()
-        
-        if not invite_result.data:
-            return {"success": False, "message": "邀请码无效或已使用"}
-        
-        try:
-            # 创建新用户
-            new_user = supabase.table('users').insert({
-                'phone_number': phone_number,
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'invite_code': invite_code
-            }).execute()
-            
-            # 标记邀请码为已使用
-            supabase.table('invite_codes').update({'used': True, 'used_by': phone_number}).eq('code', invite_code).execute()
-            
-            return {
-                "success": True,
-                "message": "新用户注册成功",
-                "user_id": new_user.data[0]['id'],
-                "phone_number": phone_number
-            }
-        except Exception as e:
-            return {"success": False, "message": f"用户创建失败: {str(e)}"}
+    try:
+        status, user = signup_engine.signup(phone_number, invite_code)
+    except Exception as e:
+        return {"success": False, "message": f"用户创建失败: {str(e)}"}
+    
+    if status != SIGNUP_OK:
+        logger.info("❌ 注册失败: %s", invite_code, extra={'phone_number': phone_number, 'status': status})
+        return {"success": False, "message": SIGNUP_MESSAGES.get(status, "邀请码无效")}
+    
+    cache_user(user)
+    logger.info("✅ 新用户创建成功: %s", phone_number, extra={'user_id': user['id'], 'user_sequence': user['user_sequence']})
+    return signup_result(user)
+
+def signup_result(user):
+    return {
+        "success": True,
+        "message": "新用户注册成功",
+        "user_id": user['id'],
+        "phone_number": user['phone_number'],
+        "user_invite_code": user['user_invite_code'],
+        "user_sequence": user['user_sequence']
+    }
+
+# 订单号分配器：每个进程一次预留一段当天的连续序号，用完再预留，生成订单号不需要查询订单表
+ORDER_NUMBER_BLOCK_SIZE = int(os.getenv("ORDER_NUMBER_BLOCK_SIZE", "50"))
+if DEVELOPMENT_MODE:
+    order_number_allocator = OrderNumberAllocator(dev_orders.next_daily_count, ORDER_NUMBER_BLOCK_SIZE)
+else:
+    order_number_allocator = OrderNumberAllocator(supabase_reserver(supabase_pool), ORDER_NUMBER_BLOCK_SIZE)
 
 def generate_order_number():
     """生成订单号"""
-    today = datetime.now().strftime('%Y%m%d')
-    if DEVELOPMENT_MODE:
-        # 开发模式：简单计数
-        daily_count = len([o for o in dev_orders.values() if o['order_date'] == datetime.now().date().isoformat()]) + 1
-    else:
-        # 生产模式：使用数据库函数
-        return None  # 让数据库触发器自动生成
-    
-    return f"ORD{today}{daily_count:03d}"
+    return order_number_allocator.next()
+
+# 批量创建/提交订单时单次最多处理的订单数
+ORDER_BATCH_MAX = int(os.getenv("ORDER_BATCH_MAX", "100"))
+
+def build_order_data(user_id, phone_number, form_data, order_number, user_sequence_number, current_time):
+    """根据表单数据构造订单记录"""
+    return {
+        'order_number': order_number,
+        'user_id': user_id,
+        'phone_number': phone_number,
+        'status': 'draft',
+        'order_date': current_time.date().isoformat(),
+        'created_at': current_time.isoformat(),
+        'delivery_address': form_data.get('address', ''),
+        'dietary_restrictions': json.dumps(form_data.get('allergies', []), ensure_ascii=False),
+        'food_preferences': json.dumps(form_data.get('preferences', []), ensure_ascii=False),
+        'budget_amount': float(form_data.get('budget', 0)),
+        'budget_currency': 'CNY',
+        'user_sequence_number': user_sequence_number,
+        'is_deleted': False
+    }
 
 def create_order(user_id, phone_number, form_data):
     """创建订单"""
-    print(f"📋 创建订单: 用户 {user_id}")
+    logger.debug("📋 创建订单: 用户 %s", user_id)
     
     order_number = generate_order_number()
     current_time = datetime.now(timezone.utc)
     
     # 获取用户的下一个序号
     if DEVELOPMENT_MODE:
-        # 开发模式：计算该用户的订单序号
-        user_orders = [o for o in dev_orders.values() if o['user_id'] == user_id]
-        user_sequence_number = len(user_orders) + 1
+        # 开发模式：用户序号计数器
+        user_sequence_number = dev_orders.next_user_sequence(user_id)
     else:
         # 生产模式：从数据库查询最大序号
         try:
-            result = supabase.from_('orders').select('user_sequence_number').eq('user_id', user_id).order('user_sequence_number', desc=True).limit(1).execute()
+            with supabase_pool.connection() as supabase:
+                result = supabase.from_('orders').select('user_sequence_number').eq('user_id', user_id).order('user_sequence_number', desc=True).limit(1).execute()
             if result.data:
                 user_sequence_number = result.data[0]['user_sequence_number'] + 1
             else:
@@ -358,29 +481,12 @@ def create_order(user_id, phone_number, form_data):
         except:
             user_sequence_number = 1
     
-    order_data = {
-        'order_number': order_number,
-        'user_id': user_id,
-        'phone_number': phone_number,
-        'status': 'draft',
-        'order_date': current_time.date().isoformat(),
-        'created_at': current_time.isoformat(),
-        'delivery_address': form_data.get('address', ''),
-        'dietary_restrictions': json.dumps(form_data.get('allergies', []), ensure_ascii=False),
-        'food_preferences': json.dumps(form_data.get('preferences', []), ensure_ascii=False),
-        'budget_amount': float(form_data.get('budget', 0)),
-        'budget_currency': 'CNY',
-        'user_sequence_number': user_sequence_number,
-        'is_deleted': False
-    }
-    
     if DEVELOPMENT_MODE:
-        # 开发模式：存储到内存
+        # 开发模式：以紧凑的订单记录存储到内存
         order_id = str(uuid.uuid4())
-        order_data['id'] = order_id
-        dev_orders[order_id] = order_data
+        dev_orders.add(OrderRecord.from_form(order_id, user_id, phone_number, form_data, order_number, user_sequence_number, current_time))
         
-        print(f"✅ 开发模式 - 订单创建成功: {order_number} (用户序号: {user_sequence_number})")
+        logger.info("✅ 开发模式 - 订单创建成功: %s", order_number, extra={'user_id': user_id, 'user_sequence_number': user_sequence_number})
         return {
             "success": True,
             "message": "订单创建成功",
@@ -390,12 +496,14 @@ def create_order(user_id, phone_number, form_data):
         }
     else:
         # 生产模式：存储到Supabase
+        order_data = build_order_data(user_id, phone_number, form_data, order_number, user_sequence_number, current_time)
         try:
-            result = supabase.table('orders').insert(order_data).execute()
+            with supabase_pool.connection() as supabase:
+                result = supabase.table('orders').insert(order_data).execute()
             order_id = result.data[0]['id']
             actual_order_number = result.data[0]['order_number']
             
-            print(f"✅ 生产模式 - 订单创建成功: {actual_order_number} (用户序号: {user_sequence_number})")
+            logger.info("✅ 生产模式 - 订单创建成功: %s", actual_order_number, extra={'user_id': user_id, 'user_sequence_number': user_sequence_number})
             return {
                 "success": True,
                 "message": "订单创建成功",
@@ -404,52 +512,234 @@ def create_order(user_id, phone_number, form_data):
                 "user_sequence_number": user_sequence_number
             }
         except Exception as e:
-            print(f"❌ 订单创建失败: {str(e)}")
+            logger.error("❌ 订单创建失败: %s", e, extra={'user_id': user_id})
             return {"success": False, "message": f"订单创建失败: {str(e)}"}
 
 def submit_order(order_id):
     """提交订单"""
-    print(f"📤 提交订单: {order_id}")
+    logger.debug("📤 提交订单: %s", order_id)
     
     if DEVELOPMENT_MODE:
         # 开发模式
-        if order_id not in dev_orders:
+        order = dev_orders.update(order_id, submitted_fields(datetime.now(timezone.utc)))
+        if order is None:
             return {"success": False, "message": "订单不存在"}
         
-        dev_orders[order_id]['status'] = 'submitted'
-        dev_orders[order_id]['submitted_at'] = datetime.now(timezone.utc).isoformat()
-        dev_orders[order_id]['updated_at'] = datetime.now(timezone.utc).isoformat()
-        
-        print(f"✅ 开发模式 - 订单提交成功: {dev_orders[order_id]['order_number']}")
+        logger.info("✅ 开发模式 - 订单提交成功: %s", order['order_number'], extra={'order_id': order_id})
+        publish_order_event('order_status', order)
         return {
             "success": True,
             "message": "订单提交成功",
-            "order_number": dev_orders[order_id]['order_number']
+            "order_number": order['order_number']
         }
     else:
         # 生产模式
         try:
-            result = supabase.table('orders').update({
-                'status': 'submitted',
-                'submitted_at': datetime.now(timezone.utc).isoformat()
-            }).eq('id', order_id).execute()
+            with supabase_pool.connection() as supabase:
+                result = supabase.table('orders').update({
+                    'status': 'submitted',
+                    'submitted_at': datetime.now(timezone.utc).isoformat()
+                }).eq('id', order_id).execute()
             
             if not result.data:
                 return {"success": False, "message": "订单不存在"}
             
-            print(f"✅ 生产模式 - 订单提交成功: {result.data[0]['order_number']}")
+            logger.info("✅ 生产模式 - 订单提交成功: %s", result.data[0]['order_number'], extra={'order_id': order_id})
+            publish_order_event('order_status', result.data[0])
             return {
                 "success": True,
                 "message": "订单提交成功",
                 "order_number": result.data[0]['order_number']
             }
         except Exception as e:
-            print(f"❌ 订单提交失败: {str(e)}")
+            logger.error("❌ 订单提交失败: %s", e, extra={'order_id': order_id})
             return {"success": False, "message": f"订单提交失败: {str(e)}"}
 
+def validate_order_form(form_data):
+    """校验订单表单，返回错误信息，通过时返回None"""
+    if not isinstance(form_data, dict) or not form_data.get('address'):
+        return "配送地址不能为空"
+    
+    # 预算验证：允许免单订单的0金额，但不允许负数
+    try:
+        if float(form_data.get('budget', 0)) < 0:
+            return "预算金额无效"
+    except (ValueError, TypeError):
+        return "预算金额无效"
+    return None
+
+def submitted_fields(current_time):
+    return {
+        'status': 'submitted',
+        'submitted_at': current_time.isoformat(),
+        'updated_at': current_time.isoformat()
+    }
+
+def mark_order_submitted(order, current_time):
+    order.update(submitted_fields(current_time))
+
+def create_orders(user_id, phone_number, forms, submit=False):
+    """批量创建订单（submit为True时直接以已提交状态写入）
+
+    订单号和用户序号整批一次分配，所有订单一次写入：开发模式一次加锁，
+    生产模式调用数据库函数 create_orders_batch（一条多行INSERT）。返回与forms顺序一致的订单。
+    """
+    logger.debug("📋 批量创建订单: 用户 %s, %s 个", user_id, len(forms))
+    current_time = datetime.now(timezone.utc)
+    
+    order_numbers = order_number_allocator.allocate(len(forms))
+    
+    if DEVELOPMENT_MODE:
+        first_sequence = dev_orders.next_user_sequence(user_id, len(forms))
+        orders = [
+            OrderRecord.from_form(str(uuid.uuid4()), user_id, phone_number, form_data, order_number, first_sequence + offset, current_time)
+            for offset, (form_data, order_number) in enumerate(zip(forms, order_numbers))
+        ]
+        if submit:
+            for order in orders:
+                mark_order_submitted(order, current_time)
+        dev_orders.add_many(orders)
+    else:
+        orders = build_batch_orders(user_id, phone_number, forms, order_numbers, submit, current_time)
+        with supabase_pool.connection() as supabase:
+            result = supabase.rpc('create_orders_batch', {'p_orders': orders}).execute()
+        orders = sort_batch_orders(result.data, order_numbers)
+    
+    if submit:
+        for order in orders:
+            publish_order_event('order_status', order)
+    logger.info("✅ 批量创建订单成功: %s 个", len(orders), extra={'user_id': user_id, 'submitted': submit})
+    return orders
+
+def build_batch_orders(user_id, phone_number, forms, order_numbers, submit, current_time):
+    """生产模式：构造 create_orders_batch 的参数，user_sequence_number 由数据库函数分配"""
+    orders = []
+    for form_data, order_number in zip(forms, order_numbers):
+        order = build_order_data(user_id, phone_number, form_data, order_number, None, current_time)
+        if submit:
+            mark_order_submitted(order, current_time)
+        orders.append(order)
+    return orders
+
+def sort_batch_orders(orders, order_numbers):
+    """create_orders_batch 不保证返回顺序，按订单号恢复请求顺序"""
+    position = {order_number: index for index, order_number in enumerate(order_numbers)}
+    return sorted(orders, key=lambda order: position[order['order_number']])
+
+def submit_orders(order_ids):
+    """批量提交订单，返回 订单ID -> 提交后的订单（不存在的订单不在结果中）"""
+    logger.debug("📤 批量提交订单: %s 个", len(order_ids))
+    current_time = datetime.now(timezone.utc)
+    
+    if DEVELOPMENT_MODE:
+        submitted = dev_orders.update_many(order_ids, submitted_fields(current_time))
+    else:
+        # 生产模式：一条 UPDATE ... WHERE id IN (...)
+        with supabase_pool.connection() as supabase:
+            result = supabase.table('orders').update({
+                'status': 'submitted',
+                'submitted_at': current_time.isoformat()
+            }).in_('id', list(order_ids)).execute()
+        submitted = {str(order['id']): order for order in result.data}
+    
+    for order in submitted.values():
+        publish_order_event('order_status', order)
+    logger.info("✅ 批量提交订单成功: %s 个", len(submitted))
+    return submitted
+
+def batch_create_results(errors, orders):
+    """按请求顺序组合每个订单的结果，errors 为逐个校验的错误信息，orders 为通过校验并创建的订单"""
+    created = iter(orders)
+    results = []
+    for index, error in enumerate(errors):
+        if error:
+            results.append({"index": index, "success": False, "message": error})
+            continue
+        order = next(created)
+        results.append({
+            "index": index,
+            "success": True,
+            "order_id": order['id'],
+            "order_number": order['order_number'],
+            "user_sequence_number": order['user_sequence_number'],
+            "status": order['status']
+        })
+    return {
+        "success": True,
+        "message": f"成功创建 {len(orders)} 个订单",
+        "created": len(orders),
+        "failed": len(errors) - len(orders),
+        "results": results
+    }
+
+def batch_submit_results(order_ids, submitted):
+    results = []
+    for index, order_id in enumerate(order_ids):
+        order = submitted.get(str(order_id))
+        if order is None:
+            results.append({"index": index, "success": False, "order_id": order_id, "message": "订单不存在"})
+        else:
+            results.append({"index": index, "success": True, "order_id": order_id, "order_number": order['order_number']})
+    return {
+        "success": True,
+        "message": f"成功提交 {len(submitted)} 个订单",
+        "submitted": len(submitted),
+        "failed": len(order_ids) - len(submitted),
+        "results": results
+    }
+
+def flush_order_updates(updates):
+    """写后缓冲的写库函数：updates 为 订单ID -> 合并后的字段，开发模式一次更新本地存储，生产模式一次调用 apply_order_updates"""
+    if DEVELOPMENT_MODE:
+        orders = dev_orders.apply_updates(updates)
+    else:
+        with supabase_pool.connection() as supabase:
+            result = supabase.rpc('apply_order_updates', {
+                'p_updates': [{'id': order_id, **fields} for order_id, fields in updates.items()]
+            }).execute()
+        orders = {str(order['id']): order for order in result.data}
+    missing = len(updates) - len(orders)
+    if missing:
+        logger.warning("⚠️  写后缓冲: %s 个订单不存在，更新已丢弃", missing)
+    for order in orders.values():
+        publish_order_event('order_feedback', order)
+    logger.info("✅ 批量写入订单反馈: %s 个", len(orders))
+
+# 写后缓冲：订单反馈先写入本地日志（WRITE_BEHIND_JOURNAL_PATH，单独的数据库文件）后立即返回，后台按订单合并、批量写库
+# 日志文件需放在持久化的数据卷上，否则容器销毁时未写库的反馈会丢失
+# 生产模式默认开启；WRITE_BEHIND_ENABLED=false 时每次反馈同步写库
+# 缓冲在 start_background_services 中创建，之前（只导入本模块时）反馈同步写库
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false" if DEVELOPMENT_MODE else "true").lower() == "true"
+order_update_buffer = None
+
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background_services():
+    """启动后台服务：日志写出线程、过期验证码清理和写后缓冲（打开日志文件并重放未写库的更新），重复调用无效
+
+    由 create_app() 和 ASGI 应用启动时调用；只导入本模块（脚本、测试、压测）不会启动后台线程，也不会创建写后日志文件。
+    """
+    global order_update_buffer, _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        configure_logging()
+        verification_sweeper.start()
+        if WRITE_BEHIND_ENABLED and order_update_buffer is None:
+            order_update_buffer = WriteBehindBuffer(
+                flush_order_updates,
+                SQLiteJournal(SQLiteDatabase(os.getenv("WRITE_BEHIND_JOURNAL_PATH", "write_behind.db"))),
+                max_batch=int(os.getenv("WRITE_BEHIND_BATCH", "100")),
+                interval=float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0")),
+                max_attempts=int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "3")),
+            ).start()
+            atexit.register(order_update_buffer.stop)
+
 def update_order_feedback(order_id, rating, feedback):
-    """更新订单反馈"""
-    print(f"⭐ 更新订单反馈: {order_id} - 评分: {rating}")
+    """更新订单反馈（开启写后缓冲时只写入本地日志，由后台线程批量写库）"""
+    logger.debug("⭐ 更新订单反馈: %s - 评分: %s", order_id, rating)
     
     if rating < 1 or rating > 5:
         return {"success": False, "message": "评分必须在1-5之间"}
@@ -460,56 +750,103 @@ def update_order_feedback(order_id, rating, feedback):
         'feedback_submitted_at': datetime.now(timezone.utc).isoformat()
     }
     
+    if order_update_buffer is not None:
+        # 开发模式可以直接检查订单是否存在；生产模式不再为此查询数据库，只校验订单ID的格式（SERIAL整数），
+        # 格式错误的ID会让整批 apply_order_updates 失败，不能进入缓冲；不存在的订单在写库时丢弃
+        try:
+            order_id = normalize_order_id(order_id)
+        except ValueError:
+            return {"success": False, "message": "订单不存在"}
+        if DEVELOPMENT_MODE and order_id not in dev_orders:
+            return {"success": False, "message": "订单不存在"}
+        order_update_buffer.submit(str(order_id), {**feedback_data, 'updated_at': feedback_data['feedback_submitted_at']})
+        return {"success": True, "message": "反馈提交成功"}
+    
     if DEVELOPMENT_MODE:
         # 开发模式
-        if order_id not in dev_orders:
+        order = dev_orders.update(order_id, {**feedback_data, 'updated_at': datetime.now(timezone.utc).isoformat()})
+        if order is None:
             return {"success": False, "message": "订单不存在"}
         
-        dev_orders[order_id].update(feedback_data)
-        dev_orders[order_id]['updated_at'] = datetime.now(timezone.utc).isoformat()
-        
-        print(f"✅ 开发模式 - 反馈更新成功")
+        logger.info("✅ 开发模式 - 反馈更新成功", extra={'order_id': order_id, 'rating': rating})
+        publish_order_event('order_feedback', order)
         return {"success": True, "message": "反馈提交成功"}
     else:
         # 生产模式
         try:
-            result = supabase.table('orders').update(feedback_data).eq('id', order_id).execute()
+            with supabase_pool.connection() as supabase:
+                result = supabase.table('orders').update(feedback_data).eq('id', order_id).execute()
             
             if not result.data:
                 return {"success": False, "message": "订单不存在"}
             
-            print(f"✅ 生产模式 - 反馈更新成功")
+            logger.info("✅ 生产模式 - 反馈更新成功", extra={'order_id': order_id, 'rating': rating})
+            publish_order_event('order_feedback', result.data[0])
             return {"success": True, "message": "反馈提交成功"}
         except Exception as e:
-            print(f"❌ 反馈更新失败: {str(e)}")
+            logger.error("❌ 反馈更新失败: %s", e, extra={'order_id': order_id})
             return {"success": False, "message": f"反馈提交失败: {str(e)}"}
 
+# 幂等请求：带 Idempotency-Key 请求头的下单/提交请求只执行一次，客户端重试时重放第一次的响应
+# 存储为进程内（memory）或本地SQLite（sqlite，多进程部署时默认）
+# 处理中的键只占用 IDEMPOTENCY_LEASE 秒，处理请求的进程崩溃后客户端不必等到 IDEMPOTENCY_TTL 过期才能重试
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "60"))
+if os.getenv("IDEMPOTENCY_BACKEND", "sqlite" if WORKERS > 1 else "memory").lower() == "sqlite":
+    idempotency_store = SQLiteIdempotencyStore(sqlite_db or SQLiteDatabase(os.getenv("SQLITE_PATH", "omnilaze.db")).migrate(),
+                                               ttl=IDEMPOTENCY_TTL, lease=IDEMPOTENCY_LEASE)
+else:
+    idempotency_store = MemoryIdempotencyStore(max_entries=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000")),
+                                               ttl=IDEMPOTENCY_TTL, lease=IDEMPOTENCY_LEASE)
+
+def idempotent(view):
+    """按 (路由, Idempotency-Key) 只执行一次视图函数，重复请求重放保存的响应；5xx响应不保存"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"success": False, "message": "Idempotency-Key 过长"}), 400
+        
+        scope = f"{request.path}:{key}"
+        fingerprint = request_fingerprint(request.method, request.path, request.get_data())
+        state, saved = idempotency_store.begin(scope, fingerprint)
+        if state == IDEMPOTENCY_REPLAY:
+            status, body = saved
+            return Response(body, status=status, mimetype='application/json', headers={'Idempotent-Replayed': 'true'})
+        if state != IDEMPOTENCY_NEW:
+            message, status = IDEMPOTENCY_MESSAGES[state]
+            return jsonify({"success": False, "message": message}), status
+        
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency_store.release(scope)
+            raise
+        if response.status_code >= 500:
+            idempotency_store.release(scope)
+        else:
+            idempotency_store.complete(scope, fingerprint, response.status_code, response.get_data())
+        return response
+    return wrapper
+
 @app.route('/create-order', methods=['POST'])
+@idempotent
 def api_create_order():
     """创建订单API"""
-    print(f"📋 收到创建订单请求")
     try:
         data = request.get_json()
         user_id = data.get('user_id')
         phone_number = data.get('phone_number')
         form_data = data.get('form_data', {})
         
-        print(f"📋 订单数据: 用户{user_id}, 地址{form_data.get('address', '')[:20]}...")
-        
         if not user_id or not phone_number:
             return jsonify({"success": False, "message": "用户信息不能为空"}), 400
         
-        if not form_data.get('address'):
-            return jsonify({"success": False, "message": "配送地址不能为空"}), 400
-        
-        # 预算验证：允许免单订单的0金额，但不允许负数
-        budget = form_data.get('budget', 0)
-        try:
-            budget_amount = float(budget)
-            if budget_amount < 0:
-                return jsonify({"success": False, "message": "预算金额无效"}), 400
-        except (ValueError, TypeError):
-            return jsonify({"success": False, "message": "预算金额无效"}), 400
+        error = validate_order_form(form_data)
+        if error:
+            return jsonify({"success": False, "message": error}), 400
         
         result = create_order(user_id, phone_number, form_data)
         
@@ -519,19 +856,17 @@ def api_create_order():
             return jsonify(result), 500
             
     except Exception as e:
-        print(f"❌ 创建订单API错误: {str(e)}")
+        logger.exception("❌ 创建订单API错误: %s", e)
         return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
 
 @app.route('/submit-order', methods=['POST'])
+@idempotent
 def api_submit_order():
     """提交订单API"""
-    print(f"📤 收到提交订单请求")
     try:
         data = request.get_json()
         order_id = data.get('order_id')
         
-        print(f"📤 提交订单: {order_id}")
-        
         if not order_id:
             return jsonify({"success": False, "message": "订单ID不能为空"}), 400
         
@@ -543,21 +878,67 @@ def api_submit_order():
             return jsonify(result), 500
             
     except Exception as e:
-        print(f"❌ 提交订单API错误: {str(e)}")
+        logger.exception("❌ 提交订单API错误: %s", e)
+        return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
+
+@app.route('/create-orders', methods=['POST'])
+@idempotent
+def api_create_orders():
+    """批量创建订单API：逐个校验表单，通过校验的订单一次写入，submit为true时直接提交"""
+    try:
+        data = request.get_json()
+        user_id = data.get('user_id')
+        phone_number = data.get('phone_number')
+        forms = data.get('orders')
+        
+        if not user_id or not phone_number:
+            return jsonify({"success": False, "message": "用户信息不能为空"}), 400
+        
+        if not isinstance(forms, list) or not forms:
+            return jsonify({"success": False, "message": "订单列表不能为空"}), 400
+        
+        if len(forms) > ORDER_BATCH_MAX:
+            return jsonify({"success": False, "message": f"单次最多创建 {ORDER_BATCH_MAX} 个订单"}), 400
+        
+        errors = [validate_order_form(form_data) for form_data in forms]
+        valid_forms = [form_data for form_data, error in zip(forms, errors) if error is None]
+        orders = create_orders(user_id, phone_number, valid_forms, submit=bool(data.get('submit'))) if valid_forms else []
+        
+        return jsonify(batch_create_results(errors, orders)), 200
+            
+    except Exception as e:
+        logger.exception("❌ 批量创建订单API错误: %s", e)
+        return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
+
+@app.route('/submit-orders', methods=['POST'])
+@idempotent
+def api_submit_orders():
+    """批量提交订单API"""
+    try:
+        data = request.get_json()
+        order_ids = data.get('order_ids')
+        
+        if not isinstance(order_ids, list) or not order_ids:
+            return jsonify({"success": False, "message": "订单ID列表不能为空"}), 400
+        
+        if len(order_ids) > ORDER_BATCH_MAX:
+            return jsonify({"success": False, "message": f"单次最多提交 {ORDER_BATCH_MAX} 个订单"}), 400
+        
+        return jsonify(batch_submit_results(order_ids, submit_orders(order_ids))), 200
+            
+    except Exception as e:
+        logger.exception("❌ 批量提交订单API错误: %s", e)
         return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
 
 @app.route('/order-feedback', methods=['POST'])
 def api_order_feedback():
     """订单反馈API"""
-    print(f"⭐ 收到订单反馈请求")
     try:
         data = request.get_json()
         order_id = data.get('order_id')
         rating = data.get('rating')
         feedback = data.get('feedback', '')
         
-        print(f"⭐ 订单反馈: {order_id} - 评分: {rating}")
-        
         if not order_id:
             return jsonify({"success": False, "message": "订单ID不能为空"}), 400
         
@@ -572,33 +953,130 @@ def api_order_feedback():
             return jsonify(result), 500
             
     except Exception as e:
-        print(f"❌ 订单反馈API错误: {str(e)}")
+        logger.exception("❌ 订单反馈API错误: %s", e)
         return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
 
+# 订单列表分页与字段投影
+ORDERS_PAGE_DEFAULT_LIMIT = 20
+ORDERS_PAGE_MAX_LIMIT = 100
+ORDER_FIELDS = {
+    'id', 'order_number', 'user_id', 'phone_number', 'status', 'order_date', 'created_at', 'submitted_at',
+    'delivery_address', 'delivery_latitude', 'delivery_longitude', 'delivery_notes',
+    'dietary_restrictions', 'food_preferences', 'budget_amount', 'budget_currency',
+    'recommended_restaurants', 'selected_restaurant_id', 'user_rating', 'user_feedback', 'feedback_submitted_at',
+    'updated_at', 'metadata', 'is_deleted', 'deleted_at', 'user_sequence_number'
+}
+
+def encode_orders_cursor(order):
+    """把订单的(created_at, id)编码为分页游标"""
+    raw = json.dumps([order['created_at'], order['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def normalize_order_id(order_id):
+    """校验订单ID并返回规范形式，无效时抛出ValueError
+
+    生产模式 orders.id 为 SERIAL：接受正整数或只含数字的字符串，返回int；
+    开发模式（内存/本地SQLite）订单ID为UUID字符串，原样返回。
+    """
+    if DEVELOPMENT_MODE:
+        if not isinstance(order_id, str) or str(uuid.UUID(order_id)) != order_id.lower():
+            raise ValueError("订单ID无效")
+        return order_id
+    if isinstance(order_id, str) and order_id.isascii() and order_id.isdigit():
+        order_id = int(order_id)
+    if isinstance(order_id, bool) or not isinstance(order_id, int) or order_id < 1:
+        raise ValueError("订单ID无效")
+    return order_id
+
+def decode_orders_cursor(cursor):
+    """解析分页游标，格式错误时抛出ValueError
+
+    created_at 必须是ISO时间戳、id 必须是当前存储的订单ID（见 normalize_order_id）：
+    游标的值会拼进PostgREST的 or= 过滤条件，也会和开发模式索引中的 (created_at, id) 比较，其他类型的值不能放行。
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+        if not isinstance(created_at, str):
+            raise ValueError
+        datetime.fromisoformat(created_at)
+        order_id = normalize_order_id(order_id)
+    except Exception:
+        raise ValueError("分页游标无效")
+    return created_at, order_id
+
+def parse_order_fields(fields_param):
+    """解析fields参数，返回请求的字段列表；未指定时返回None表示全部字段"""
+    if not fields_param:
+        return None
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in ORDER_FIELDS]
+    if unknown:
+        raise ValueError(f"未知字段: {', '.join(unknown)}")
+    return fields
+
+def order_json(order, fields=None):
+    """按 fields 投影订单；开发模式的订单记录在这里转换为JSON结构"""
+    if isinstance(order, OrderRecord):
+        return order.to_dict(fields)
+    return order if fields is None else {f: order.get(f) for f in fields}
+
 @app.route('/orders/<user_id>', methods=['GET'])
 def api_get_user_orders(user_id):
-    """获取用户订单列表API"""
-    print(f"📋 获取用户订单: {user_id}")
+    """获取用户订单列表API
+
+    支持 limit/cursor 分页（按 created_at, id 倒序）和 fields 字段投影，
+    响应中的 next_cursor 用于获取下一页。
+    """
     try:
+        try:
+            limit = int(request.args.get('limit', ORDERS_PAGE_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({"success": False, "message": "limit必须为整数"}), 400
+        if limit < 1:
+            return jsonify({"success": False, "message": "limit必须大于0"}), 400
+        limit = min(limit, ORDERS_PAGE_MAX_LIMIT)
+        
+        try:
+            cursor = request.args.get('cursor')
+            before = decode_orders_cursor(cursor) if cursor else None
+            fields = parse_order_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        
         if DEVELOPMENT_MODE:
-            # 开发模式：从内存获取
-            user_orders = [order for order in dev_orders.values() 
-                          if order['user_id'] == user_id and not order.get('is_deleted', False)]
-            user_orders.sort(key=lambda x: x['created_at'], reverse=True)
+            # 开发模式：从用户订单索引分页获取
+            user_orders, has_more = dev_orders.page_by_user(user_id, limit, before)
         else:
-            # 生产模式：从Supabase获取
-            result = supabase.table('orders').select('*').eq('user_id', user_id).eq('is_deleted', False).order('created_at', desc=True).execute()
-            user_orders = result.data
+            # 生产模式：从Supabase按游标分页获取，多取一条判断是否还有更多
+            columns = '*' if fields is None else ','.join(sorted(set(fields) | {'id', 'created_at'}))
+            with supabase_pool.connection() as supabase:
+                query = supabase.table('orders').select(columns).eq('user_id', user_id).eq('is_deleted', False)
+                if before:
+                    created_at, order_id = before
+                    query.params = query.params.add(
+                        'or', f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{order_id}))'
+                    )
+                # postgrest-py 的 order() 会重复添加order参数，这里直接写入复合排序
+                query.params = query.params.add('order', 'created_at.desc,id.desc')
+                result = query.limit(limit + 1).execute()
+            user_orders = result.data[:limit]
+            has_more = len(result.data) > limit
+        
+        next_cursor = encode_orders_cursor(user_orders[-1]) if has_more else None
+        user_orders = [order_json(order, fields) for order in user_orders]
         
-        print(f"📋 找到 {len(user_orders)} 个订单")
+        logger.debug("📋 找到 %d 个订单", len(user_orders), extra={'user_id': user_id})
         return jsonify({
             "success": True,
             "orders": user_orders,
-            "count": len(user_orders)
+            "count": len(user_orders),
+            "has_more": has_more,
+            "next_cursor": next_cursor
         }), 200
         
     except Exception as e:
-        print(f"❌ 获取订单API错误: {str(e)}")
+        logger.exception("❌ 获取订单API错误: %s", e)
         return jsonify({"success": False, "message": f"服务器错误: {str(e)}"}), 500
 
 @app.route('/verify-invite-code', methods=['POST'])
@@ -628,10 +1106,55 @@ def api_verify_invite_code():
 
 # ===== 免单相关API =====
 
-# 开发模式的免单数据存储
-dev_user_invite_stats = {}  # 用户邀请统计
-dev_invite_progress = {}    # 邀请进度记录
-dev_free_drinks_remaining = 100  # 全局免单剩余数量
+# 开发模式首次查询邀请统计时写入的模拟邀请记录：(被邀请人手机号, 几天前)
+DEV_MOCK_INVITATIONS = [('13800000001', 5), ('13900000002', 3), ('18200007609', 0)]
+dev_invite_seed_lock = threading.Lock()
+
+def get_invite_summary(user_id):
+    """获取用户的邀请统计（单次按用户ID查找），开发模式（内存存储）首次访问还没有邀请记录的用户时写入模拟邀请记录"""
+    summary = invite_summaries.get(user_id)
+    if (summary is not None and summary['current_uses']) or not DEVELOPMENT_MODE or sqlite_db is not None:
+        return summary
+    with dev_invite_seed_lock:
+        summary = invite_summaries.get(user_id)
+        if summary is None or not summary['current_uses']:
+            # 模拟用户已邀请3人，可以获得免单
+            user = signup_engine.get_user(user_id)
+            user_invite_code = user['user_invite_code'] if user else f'USR{user_id[-6:]}'
+            for index, (phone_number, days_ago) in enumerate(DEV_MOCK_INVITATIONS):
+                invited_at = (datetime.now() - timedelta(days=days_ago)).isoformat()
+                invite_summaries.record_invitation(user_id, f'dev_invitee_{index}', phone_number, user_invite_code, invited_at)
+            summary = invite_summaries.get(user_id)
+    return summary
+
+def check_dev_free_drink_eligibility(user_id):
+    """开发模式：检查用户是否有资格领取免单，返回错误信息，有资格时返回None"""
+    summary = invite_summaries.get(user_id)
+    if summary is None:
+        return "用户邀请信息不存在"
+    if summary['free_drink_claimed']:
+        return "您已经领取过免单奶茶"
+    if not summary['eligible_for_free_drink']:
+        return "邀请人数不足，无法领取免单"
+    return None
+
+# 领取失败结果 -> 返回信息
+FREE_DRINK_CLAIM_MESSAGES = {
+    CLAIM_ALREADY_CLAIMED: "您已经领取过免单奶茶",
+    CLAIM_NOT_ELIGIBLE: "邀请人数不足，无法领取免单",
+    CLAIM_SOLD_OUT: "免单名额已用完",
+}
+
+# 免单名额：开发模式为进程内原子计数器（本地SQLite存储时为 free_drink_config 表），生产模式为数据库分片令牌桶
+if sqlite_db is not None:
+    free_drink_quota = SQLiteQuota(sqlite_db, int(os.getenv("FREE_DRINK_TOTAL", "100")))
+elif DEVELOPMENT_MODE:
+    free_drink_quota = QuotaCounter(int(os.getenv("FREE_DRINK_TOTAL", "100")))
+else:
+    free_drink_quota = ShardedSupabaseQuota(supabase_pool, shard_count=int(os.getenv("FREE_DRINK_SHARDS", "16")))
+
+# 剩余名额的短TTL缓存，领取成功后主动失效；轮询请求带 If-None-Match 时未变化直接返回304
+free_drinks_view = CachedValue(free_drink_quota.remaining, ttl=float(os.getenv("FREE_DRINK_CACHE_TTL", "2")))
 
 @app.route('/get-user-invite-stats', methods=['GET'])
 def api_get_user_invite_stats():
@@ -641,33 +1164,18 @@ def api_get_user_invite_stats():
         if not user_id:
             return jsonify({"success": False, "message": "用户ID不能为空"}), 400
         
-        if DEVELOPMENT_MODE:
-            # 开发模式：模拟邀请统计数据
-            if user_id not in dev_user_invite_stats:
-                # 模拟用户已邀请3人，可以获得免单
-                dev_user_invite_stats[user_id] = {
-                    'user_invite_code': f'USR{user_id[-6:]}',
-                    'current_uses': 3,
-                    'max_uses': 3,
-                    'remaining_uses': 0,
-                    'eligible_for_free_drink': True,
-                    'free_drink_claimed': False
-                }
-            
-            stats = dev_user_invite_stats[user_id]
-            stats['free_drinks_remaining'] = dev_free_drinks_remaining
-            
-            return jsonify({
-                "success": True,
-                **stats
-            }), 200
-        else:
-            # 生产模式：从Supabase查询
-            # TODO: 实现Supabase查询逻辑
-            return jsonify({"success": False, "message": "生产模式暂未实现"}), 501
+        summary = get_invite_summary(user_id)
+        if summary is None:
+            return jsonify({"success": False, "message": "用户邀请信息不存在"}), 404
+        
+        return jsonify({
+            "success": True,
+            **format_invite_stats(summary),
+            "free_drinks_remaining": free_drinks_view.get()[0]
+        }), 200
             
     except Exception as e:
-        print(f"❌ 获取邀请统计错误: {e}")
+        logger.exception("❌ 获取邀请统计错误: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/get-invite-progress', methods=['GET'])
@@ -678,43 +1186,17 @@ def api_get_invite_progress():
         if not user_id:
             return jsonify({"success": False, "message": "用户ID不能为空"}), 400
         
-        if DEVELOPMENT_MODE:
-            # 开发模式：模拟邀请进度数据
-            if user_id not in dev_invite_progress:
-                # 模拟3个邀请记录
-                dev_invite_progress[user_id] = {
-                    'invitations': [
-                        {
-                            'phone_number': '138****0001',
-                            'masked_phone': '138****0001',
-                            'invited_at': (datetime.now() - timedelta(days=5)).isoformat()
-                        },
-                        {
-                            'phone_number': '139****0002', 
-                            'masked_phone': '139****0002',
-                            'invited_at': (datetime.now() - timedelta(days=3)).isoformat()
-                        },
-                        {
-                            'phone_number': '182****7609',
-                            'masked_phone': '182****7609',
-                            'invited_at': datetime.now().isoformat()
-                        }
-                    ],
-                    'total_invitations': 3
-                }
-            
-            progress = dev_invite_progress[user_id]
-            return jsonify({
-                "success": True,
-                **progress
-            }), 200
-        else:
-            # 生产模式：从Supabase查询
-            # TODO: 实现Supabase查询逻辑
-            return jsonify({"success": False, "message": "生产模式暂未实现"}), 501
+        summary = get_invite_summary(user_id)
+        if summary is None:
+            return jsonify({"success": False, "message": "用户邀请信息不存在"}), 404
+        
+        return jsonify({
+            "success": True,
+            **format_invite_progress(summary)
+        }), 200
             
     except Exception as e:
-        print(f"❌ 获取邀请进度错误: {e}")
+        logger.exception("❌ 获取邀请进度错误: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/claim-free-drink', methods=['POST'])
@@ -728,63 +1210,119 @@ def api_claim_free_drink():
             return jsonify({"success": False, "message": "用户ID不能为空"}), 400
         
         if DEVELOPMENT_MODE:
-            global dev_free_drinks_remaining
-            
             # 检查用户是否有资格领取免单
-            if user_id not in dev_user_invite_stats:
-                return jsonify({"success": False, "message": "用户邀请信息不存在"}), 400
-            
-            user_stats = dev_user_invite_stats[user_id]
-            
-            if user_stats.get('free_drink_claimed', False):
-                return jsonify({"success": False, "message": "您已经领取过免单奶茶"}), 400
-            
-            if not user_stats.get('eligible_for_free_drink', False):
-                return jsonify({"success": False, "message": "邀请人数不足，无法领取免单"}), 400
-            
-            if dev_free_drinks_remaining <= 0:
-                return jsonify({"success": False, "message": "免单名额已用完"}), 400
-            
-            # 领取免单
-            user_stats['free_drink_claimed'] = True
-            dev_free_drinks_remaining -= 1
-            
-            print(f"🎉 用户 {user_id} 成功领取免单，剩余名额: {dev_free_drinks_remaining}")
-            
-            return jsonify({
-                "success": True,
-                "message": "免单领取成功！",
-                "free_drinks_remaining": dev_free_drinks_remaining
-            }), 200
-        else:
-            # 生产模式：更新Supabase
-            # TODO: 实现Supabase更新逻辑
-            return jsonify({"success": False, "message": "生产模式暂未实现"}), 501
+            error = check_dev_free_drink_eligibility(user_id)
+            if error:
+                return jsonify({"success": False, "message": error}), 400
+        
+        # 领取免单：名额扣减和按用户去重一次原子完成，并发领取不会超发
+        status = free_drink_quota.try_claim(user_id)
+        
+        if status != CLAIM_OK:
+            return jsonify({"success": False, "message": FREE_DRINK_CLAIM_MESSAGES.get(status, "免单名额已用完")}), 400
+        
+        if DEVELOPMENT_MODE:
+            # 生产模式由 user_free_drinks 上的触发器同步
+            invite_summaries.mark_claimed(user_id)
+        # 领取会更新用户的 free_drink_claimed
+        invalidate_cached_user(user_id)
+        
+        free_drinks_view.invalidate()
+        free_drinks_remaining = free_drink_quota.remaining()
+        event_hub.publish('quota', 'free_drinks_remaining', {"free_drinks_remaining": free_drinks_remaining})
+        logger.info("🎉 用户 %s 成功领取免单", user_id, extra={'free_drinks_remaining': free_drinks_remaining})
+        
+        return jsonify({
+            "success": True,
+            "message": "免单领取成功！",
+            "free_drinks_remaining": free_drinks_remaining
+        }), 200
             
     except Exception as e:
-        print(f"❌ 领取免单错误: {e}")
+        logger.exception("❌ 领取免单错误: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/free-drinks-remaining', methods=['GET'])
 def api_free_drinks_remaining():
     """获取免单剩余数量API"""
     try:
-        if DEVELOPMENT_MODE:
-            global dev_free_drinks_remaining
-            return jsonify({
-                "success": True,
-                "free_drinks_remaining": dev_free_drinks_remaining,
-                "message": f"还有 {dev_free_drinks_remaining} 个免单名额"
-            }), 200
+        free_drinks_remaining, etag = free_drinks_view.get()
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
         else:
-            # 生产模式：从Supabase查询
-            # TODO: 实现Supabase查询逻辑
-            return jsonify({"success": False, "message": "生产模式暂未实现"}), 501
+            response = jsonify({
+                "success": True,
+                "free_drinks_remaining": free_drinks_remaining,
+                "message": f"还有 {free_drinks_remaining} 个免单名额"
+            })
+        response.set_etag(etag)
+        # 允许客户端缓存，但每次使用前都要带ETag重新验证
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
             
     except Exception as e:
-        print(f"❌ 获取免单剩余数量错误: {e}")
+        logger.exception("❌ 获取免单剩余数量错误: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+# Flask（同步多线程）模式下每个SSE连接在断开前一直占用一个工作线程，连接数限制在线程数的一半以内，
+# 其余线程留给普通请求；大量实时推送连接需使用 SERVER_MODE=asgi（连接挂起期间不占用线程）
+SSE_THREAD_CONNECTIONS = int(os.getenv("SSE_THREAD_CONNECTIONS", str(max(1, int(os.getenv("WORKER_THREADS", "8")) // 2))))
+sse_thread_slots = threading.BoundedSemaphore(SSE_THREAD_CONNECTIONS)
+
+@app.route('/events', methods=['GET'])
+def api_events():
+    """实时事件推送API（SSE）
+
+    推送免单剩余名额变化；带 user_id 时同时推送该用户的订单状态和反馈变化，
+    客户端不再需要轮询 /free-drinks-remaining 和 /orders/<user_id>。
+    每个连接占用一个工作线程，连接数超过 SSE_THREAD_CONNECTIONS 时返回503。
+    """
+    if not sse_thread_slots.acquire(blocking=False):
+        return jsonify({"success": False, "message": "实时推送连接数已满，请稍后重试"}), 503
+    user_id = request.args.get('user_id')
+    topics = ['quota'] + ([f"user:{user_id}"] if user_id else [])
+    subscription = event_hub.subscribe(topics)
+    if subscription is None:
+        sse_thread_slots.release()
+        return jsonify({"success": False, "message": "实时推送连接数已满，请稍后重试"}), 503
+    
+    free_drinks_remaining = free_drinks_view.get()[0]
+    
+    def stream():
+        # 先推送当前名额，之后只推送变化；空闲时发送注释行保持连接
+        yield format_sse({'event': 'free_drinks_remaining', 'data': {"free_drinks_remaining": free_drinks_remaining}})
+        while True:
+            event = subscription.get(timeout=SSE_HEARTBEAT_INTERVAL)
+            yield format_sse(event) if event else ": heartbeat\n\n"
+    
+    def close():
+        # 响应关闭时调用（包括生成器还没开始迭代客户端就断开的情况）
+        event_hub.unsubscribe(subscription)
+        sse_thread_slots.release()
+    
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(close)
+    return response
+
+# /metrics 中按需读取的仪表
+REGISTRY.gauge('omnilaze_free_drinks_remaining', '免单剩余名额（缓存值）', lambda: free_drinks_view.get()[0])
+REGISTRY.gauge('omnilaze_user_cache_hit_rate', '用户资料缓存命中率', lambda: user_cache.stats()['hit_rate'])
+REGISTRY.gauge('omnilaze_sse_subscribers', '实时推送连接数', lambda: event_hub.stats()['subscribers'])
+REGISTRY.gauge('omnilaze_rate_limited_requests', '被限流拒绝的请求数', lambda: rate_limiter.stats()['rejected'])
+REGISTRY.gauge('omnilaze_log_records_dropped', '日志队列满时丢弃的日志数', lambda: log_stats().get('dropped', 0))
+if not DEVELOPMENT_MODE:
+    REGISTRY.gauge('omnilaze_supabase_pool_in_use', '正在使用的Supabase客户端数', lambda: supabase_pool.stats()['in_use'])
+    REGISTRY.gauge('omnilaze_supabase_pool_waiting', '等待Supabase客户端的请求数', lambda: supabase_pool.stats()['waiting'])
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus指标API"""
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查API"""
@@ -793,9 +1331,52 @@ def health_check():
         "message": "API服务正常运行",
         "cors_origins": ["http://localhost:8081", "http://localhost:3000", "http://localhost:19006"],
         "development_mode": DEVELOPMENT_MODE,
-        "free_drinks_remaining": dev_free_drinks_remaining if DEVELOPMENT_MODE else "unknown"
+        "workers": WORKERS,
+        "pid": os.getpid(),
+        "storage_backend": STORAGE_BACKEND if DEVELOPMENT_MODE else "supabase",
+        "sqlite": sqlite_db.stats() if sqlite_db is not None else None,
+        "free_drinks_remaining": free_drinks_view.get()[0],
+        "login_latency_ms": login_latency.snapshot(),
+        "verification_codes": verification_store.stats(),
+        "events": event_hub.stats(),
+        "user_cache": user_cache.stats(),
+        "invite_summaries": invite_summaries.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "idempotency": idempotency_store.stats(),
+        "write_behind": order_update_buffer.stats() if order_update_buffer is not None else None,
+        "order_numbers": order_number_allocator.stats(),
+        "logging": log_stats(),
+        "client_pools": None if DEVELOPMENT_MODE else {
+            "supabase": supabase_pool.stats(),
+            "sms_gateway": http_session.stats() if http_session is not None else None
+        }
     }), 200
 
+def prewarm():
+    """预热：提前导入并创建生产模式的Supabase客户端和短信发送队列，开发模式无需预热"""
+    if DEVELOPMENT_MODE:
+        return
+    started = time.perf_counter()
+    try:
+        supabase_pool.prewarm(1)
+        get_sms_dispatcher()
+    except Exception as e:
+        logger.warning("⚠️  预热失败，将在第一次使用时重试: %s", e)
+        return
+    logger.info("🔥 预热完成: %.0fms", (time.perf_counter() - started) * 1000)
+
+def create_app():
+    """启动后台服务并返回WSGI应用（gunicorn "app:create_app()"、python app.py）
+
+    较慢的导入和客户端创建都推迟到第一次使用。预热默认关闭：后台线程导入 supabase 时与第一个请求争用GIL，
+    从启动到第一个响应反而更慢（见 benchmark.py startup）；只有服务在接收流量前有空闲时间
+    （如等待就绪检查）时才值得设置 PREWARM=true，让第一个用到数据库的请求不必等待客户端创建。
+    """
+    start_background_services()
+    if os.getenv("PREWARM", "false").lower() == "true":
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+    return app
+
 if __name__ == '__main__':
     print("=== 手机验证码登录API服务 ===")
     print(f"🔧 开发模式: {DEVELOPMENT_MODE}")
@@ -805,4 +1386,4 @@ if __name__ == '__main__':
     print("   - http://localhost:19006 (Expo Web)")
     print("📡 API服务启动中...")
     print("🔗 测试连接: http://localhost:5001/health")
-    app.run(host='0.0.0.0', port=5001, debug=True)  # 改为5001端口
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5001, debug=True)  # 改为5001端口
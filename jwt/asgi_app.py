@@ -0,0 +1,721 @@
+"""
+异步(ASGI)服务入口 - 与 app.py 相同的路由和JSON格式
+
+开发模式直接复用 app.py 的内存存储；生产模式通过异步PostgREST客户端和异步短信发送器访问外部服务，
+等待I/O时不占用线程。app.py 中的同步调用（开发模式的存储、SQLite限流/幂等存储、写后缓冲的日志）
+都通过 run_in_threadpool 在线程池中执行，磁盘I/O或等锁不会阻塞事件循环。启动方式：
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+
+或在 .env 中设置 SERVER_MODE=asgi 后运行 start_api.sh。
+"""
+
+import asyncio
+import functools
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import app as core
+from events import format_sse
+from idempotency import IDEMPOTENCY_NEW, IDEMPOTENCY_REPLAY, IDEMPOTENCY_MESSAGES, MAX_KEY_LENGTH, request_fingerprint
+from invite_stats import format_invite_stats, format_invite_progress
+from metrics import REGISTRY, HTTP_REQUEST_DURATION, PROMETHEUS_CONTENT_TYPE
+from logs import get_logger
+from quota import CLAIM_OK
+from rate_limit import client_address
+from signup import SIGNUP_OK
+
+logger = get_logger('asgi')
+
+DEVELOPMENT_MODE = core.DEVELOPMENT_MODE
+CORS_ORIGINS = ["http://localhost:8081", "http://localhost:3000", "http://localhost:19006"]
+SSE_HEARTBEAT_INTERVAL = core.SSE_HEARTBEAT_INTERVAL
+
+# 生产模式的异步客户端：共享连接池的PostgREST客户端、短信发送器和订单号分配器
+backend = None
+sms_sender = None
+order_number_allocator = None
+
+if not DEVELOPMENT_MODE:
+    from async_backend import AsyncSupabaseBackend, AsyncSmsSender
+    from clients import create_async_postgrest_client
+    from order_numbers import AsyncOrderNumberAllocator
+
+    backend = AsyncSupabaseBackend(
+        create_async_postgrest_client(
+            core.SUPABASE_URL, core.SUPABASE_KEY,
+            timeout=float(os.getenv("SUPABASE_TIMEOUT", "5")),
+            max_connections=int(os.getenv("ASGI_DB_MAX_CONNECTIONS", "100")),
+        ),
+        ttl_seconds=core.VERIFICATION_CODE_TTL,
+        quota_shards=int(os.getenv("FREE_DRINK_SHARDS", "16")),
+    )
+    order_number_allocator = AsyncOrderNumberAllocator(backend.reserve_order_numbers, core.ORDER_NUMBER_BLOCK_SIZE)
+    sms_sender = AsyncSmsSender(
+        core.SPUG_URL,
+        max_pending=int(os.getenv("SMS_QUEUE_SIZE", "1000")),
+        max_concurrency=int(os.getenv("SMS_MAX_CONCURRENCY", "4")),
+        max_retries=int(os.getenv("SMS_MAX_RETRIES", "3")),
+        timeout=float(os.getenv("SMS_TIMEOUT", "5")),
+    )
+
+def json_response(data, status_code=200):
+    return JSONResponse(data, status_code=status_code)
+
+def rate_limited_response(limited):
+    body, headers = limited
+    return JSONResponse(body, status_code=429, headers=headers)
+
+def request_ip(request):
+    return client_address(request.client.host if request.client else None,
+                          request.headers.get('x-forwarded-for'), core.RATE_LIMIT_TRUSTED_PROXIES)
+
+def idempotent(handler):
+    """与 app.idempotent 相同：按 (路由, Idempotency-Key) 只执行一次，重复请求重放保存的响应"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        key = request.headers.get('idempotency-key')
+        if not key:
+            return await handler(request)
+        if len(key) > MAX_KEY_LENGTH:
+            return json_response({"success": False, "message": "Idempotency-Key 过长"}, 400)
+
+        scope = f"{request.url.path}:{key}"
+        fingerprint = request_fingerprint(request.method, request.url.path, await request.body())
+        state, saved = await run_in_threadpool(core.idempotency_store.begin, scope, fingerprint)
+        if state == IDEMPOTENCY_REPLAY:
+            status, body = saved
+            return Response(body, status_code=status, media_type='application/json', headers={'Idempotent-Replayed': 'true'})
+        if state != IDEMPOTENCY_NEW:
+            message, status = IDEMPOTENCY_MESSAGES[state]
+            return json_response({"success": False, "message": message}, status)
+
+        try:
+            response = await handler(request)
+        except BaseException:
+            await run_in_threadpool(core.idempotency_store.release, scope)
+            raise
+        if response.status_code >= 500:
+            await run_in_threadpool(core.idempotency_store.release, scope)
+        else:
+            await run_in_threadpool(core.idempotency_store.complete, scope, fingerprint, response.status_code, response.body)
+        return response
+    return wrapper
+
+async def send_verification_code(phone_number):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.send_verification_code, phone_number)
+
+    code = core.generate_verification_code()
+    await backend.store_verification_code(phone_number, code)
+    if sms_sender.submit(phone_number, code):
+        return {"success": True, "message": "验证码发送成功"}
+    else:
+        return {"success": False, "message": "短信服务繁忙，请稍后重试"}
+
+async def login_with_phone(phone_number, verification_code):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.login_with_phone, phone_number, verification_code)
+
+    status = await backend.consume_verification_code(phone_number, verification_code)
+    if status != 'ok':
+        return {"success": False, "message": core.CONSUME_CODE_MESSAGES.get(status, "验证码验证失败")}
+
+    user = core.get_cached_user_by_phone(phone_number)
+    if user is None:
+        user = await backend.find_user(phone_number)
+        if user is not None:
+            core.cache_user(user)
+    return core.login_result(phone_number, user)
+
+async def verify_invite_code_and_create_user(phone_number, invite_code):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.verify_invite_code_and_create_user, phone_number, invite_code)
+    try:
+        status, user = await backend.signup(phone_number, invite_code)
+    except Exception as e:
+        return {"success": False, "message": f"用户创建失败: {str(e)}"}
+    if status != SIGNUP_OK:
+        return {"success": False, "message": core.SIGNUP_MESSAGES.get(status, "邀请码无效")}
+    core.cache_user(user)
+    return core.signup_result(user)
+
+async def get_invite_summary(user_id):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.get_invite_summary, user_id)
+    return await backend.get_invite_summary(user_id)
+
+async def create_order(user_id, phone_number, form_data):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.create_order, user_id, phone_number, form_data)
+
+    order_number = await order_number_allocator.next()
+    user_sequence_number = await backend.next_user_sequence(user_id)
+    order_data = core.build_order_data(user_id, phone_number, form_data, order_number, user_sequence_number, datetime.now(timezone.utc))
+    try:
+        order = await backend.insert_order(order_data)
+        logger.info("✅ 生产模式 - 订单创建成功: %s", order['order_number'], extra={'user_id': user_id, 'user_sequence_number': user_sequence_number})
+        return {
+            "success": True,
+            "message": "订单创建成功",
+            "order_id": order['id'],
+            "order_number": order['order_number'],
+            "user_sequence_number": user_sequence_number
+        }
+    except Exception as e:
+        logger.error("❌ 订单创建失败: %s", e, extra={'user_id': user_id})
+        return {"success": False, "message": f"订单创建失败: {str(e)}"}
+
+async def submit_order(order_id):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.submit_order, order_id)
+
+    try:
+        order = await backend.update_order(order_id, {
+            'status': 'submitted',
+            'submitted_at': datetime.now(timezone.utc).isoformat()
+        })
+        if order is None:
+            return {"success": False, "message": "订单不存在"}
+
+        core.publish_order_event('order_status', order)
+        return {"success": True, "message": "订单提交成功", "order_number": order['order_number']}
+    except Exception as e:
+        logger.error("❌ 订单提交失败: %s", e, extra={'order_id': order_id})
+        return {"success": False, "message": f"订单提交失败: {str(e)}"}
+
+async def create_orders(user_id, phone_number, forms, submit=False):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.create_orders, user_id, phone_number, forms, submit)
+
+    order_numbers = await order_number_allocator.allocate(len(forms))
+    rows = core.build_batch_orders(user_id, phone_number, forms, order_numbers, submit, datetime.now(timezone.utc))
+    orders = core.sort_batch_orders(await backend.create_orders_batch(rows), order_numbers)
+    if submit:
+        for order in orders:
+            core.publish_order_event('order_status', order)
+    logger.info("✅ 批量创建订单成功: %s 个", len(orders), extra={'user_id': user_id, 'submitted': submit})
+    return orders
+
+async def submit_orders(order_ids):
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.submit_orders, order_ids)
+
+    orders = await backend.update_orders(order_ids, {
+        'status': 'submitted',
+        'submitted_at': datetime.now(timezone.utc).isoformat()
+    })
+    for order in orders:
+        core.publish_order_event('order_status', order)
+    logger.info("✅ 批量提交订单成功: %s 个", len(orders))
+    return {str(order['id']): order for order in orders}
+
+async def update_order_feedback(order_id, rating, feedback):
+    # 开启写后缓冲时只写入本地日志，与 app.py 共用同一个缓冲
+    if DEVELOPMENT_MODE or core.order_update_buffer is not None:
+        return await run_in_threadpool(core.update_order_feedback, order_id, rating, feedback)
+
+    if rating < 1 or rating > 5:
+        return {"success": False, "message": "评分必须在1-5之间"}
+    try:
+        order = await backend.update_order(order_id, {
+            'user_rating': rating,
+            'user_feedback': feedback,
+            'feedback_submitted_at': datetime.now(timezone.utc).isoformat()
+        })
+        if order is None:
+            return {"success": False, "message": "订单不存在"}
+
+        core.publish_order_event('order_feedback', order)
+        return {"success": True, "message": "反馈提交成功"}
+    except Exception as e:
+        logger.error("❌ 反馈更新失败: %s", e, extra={'order_id': order_id})
+        return {"success": False, "message": f"反馈提交失败: {str(e)}"}
+
+async def get_free_drinks_remaining():
+    """返回 (剩余名额, ETag)，与 app.py 共用同一个缓存"""
+    if DEVELOPMENT_MODE:
+        return await run_in_threadpool(core.free_drinks_view.get)
+    cached = core.free_drinks_view.peek()
+    if cached is None:
+        cached = core.free_drinks_view.put(await backend.free_drinks_remaining())
+    return cached
+
+def etag_matches(if_none_match, etag):
+    """判断 If-None-Match 请求头是否包含给定ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
+# API路由
+
+async def api_send_verification_code(request):
+    """发送验证码API"""
+    try:
+        data = await request.json()
+        phone_number = data.get('phone_number')
+
+        if not phone_number:
+            return json_response({"success": False, "message": "手机号不能为空"}, 400)
+
+        if len(phone_number) != 11 or not phone_number.isdigit():
+            return json_response({"success": False, "message": "请输入正确的11位手机号码"}, 400)
+
+        limited = await run_in_threadpool(core.check_rate_limit, 'sms', phone_number, request_ip(request))
+        if limited:
+            return rate_limited_response(limited)
+
+        result = await send_verification_code(phone_number)
+        return json_response(result, 200 if result["success"] else 500)
+
+    except Exception as e:
+        logger.exception("❌ 服务器错误: %s", e)
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+async def api_login_with_phone(request):
+    """验证码登录API"""
+    try:
+        data = await request.json()
+        phone_number = data.get('phone_number')
+        verification_code = data.get('verification_code')
+
+        if not phone_number or not verification_code:
+            return json_response({"success": False, "message": "手机号和验证码不能为空"}, 400)
+
+        if len(phone_number) != 11 or not phone_number.isdigit():
+            return json_response({"success": False, "message": "请输入正确的11位手机号码"}, 400)
+
+        if len(verification_code) != 6 or not verification_code.isdigit():
+            return json_response({"success": False, "message": "请输入6位数字验证码"}, 400)
+
+        limited = await run_in_threadpool(core.check_rate_limit, 'login', phone_number, request_ip(request))
+        if limited:
+            return rate_limited_response(limited)
+
+        started = time.perf_counter()
+        result = await login_with_phone(phone_number, verification_code)
+        core.login_latency.observe((time.perf_counter() - started) * 1000)
+        return json_response(result, 200 if result["success"] else 400)
+
+    except Exception as e:
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+async def api_verify_invite_code(request):
+    """验证邀请码并创建新用户API"""
+    try:
+        data = await request.json()
+        phone_number = data.get('phone_number')
+        invite_code = data.get('invite_code')
+
+        if not phone_number or not invite_code:
+            return json_response({"success": False, "message": "手机号和邀请码不能为空"}, 400)
+
+        if len(phone_number) != 11 or not phone_number.isdigit():
+            return json_response({"success": False, "message": "请输入正确的11位手机号码"}, 400)
+
+        result = await verify_invite_code_and_create_user(phone_number, invite_code)
+        return json_response(result, 200 if result["success"] else 400)
+
+    except Exception as e:
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+@idempotent
+async def api_create_order(request):
+    """创建订单API"""
+    try:
+        data = await request.json()
+        user_id = data.get('user_id')
+        phone_number = data.get('phone_number')
+        form_data = data.get('form_data', {})
+
+        if not user_id or not phone_number:
+            return json_response({"success": False, "message": "用户信息不能为空"}, 400)
+
+        error = core.validate_order_form(form_data)
+        if error:
+            return json_response({"success": False, "message": error}, 400)
+
+        result = await create_order(user_id, phone_number, form_data)
+        return json_response(result, 200 if result["success"] else 500)
+
+    except Exception as e:
+        logger.exception("❌ 创建订单API错误: %s", e)
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+@idempotent
+async def api_submit_order(request):
+    """提交订单API"""
+    try:
+        data = await request.json()
+        order_id = data.get('order_id')
+
+        if not order_id:
+            return json_response({"success": False, "message": "订单ID不能为空"}, 400)
+
+        result = await submit_order(order_id)
+        return json_response(result, 200 if result["success"] else 500)
+
+    except Exception as e:
+        logger.exception("❌ 提交订单API错误: %s", e)
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+@idempotent
+async def api_create_orders(request):
+    """批量创建订单API"""
+    try:
+        data = await request.json()
+        user_id = data.get('user_id')
+        phone_number = data.get('phone_number')
+        forms = data.get('orders')
+
+        if not user_id or not phone_number:
+            return json_response({"success": False, "message": "用户信息不能为空"}, 400)
+
+        if not isinstance(forms, list) or not forms:
+            return json_response({"success": False, "message": "订单列表不能为空"}, 400)
+
+        if len(forms) > core.ORDER_BATCH_MAX:
+            return json_response({"success": False, "message": f"单次最多创建 {core.ORDER_BATCH_MAX} 个订单"}, 400)
+
+        errors = [core.validate_order_form(form_data) for form_data in forms]
+        valid_forms = [form_data for form_data, error in zip(forms, errors) if error is None]
+        orders = await create_orders(user_id, phone_number, valid_forms, bool(data.get('submit'))) if valid_forms else []
+        return json_response(core.batch_create_results(errors, orders))
+
+    except Exception as e:
+        logger.exception("❌ 批量创建订单API错误: %s", e)
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+@idempotent
+async def api_submit_orders(request):
+    """批量提交订单API"""
+    try:
+        data = await request.json()
+        order_ids = data.get('order_ids')
+
+        if not isinstance(order_ids, list) or not order_ids:
+            return json_response({"success": False, "message": "订单ID列表不能为空"}, 400)
+
+        if len(order_ids) > core.ORDER_BATCH_MAX:
+            return json_response({"success": False, "message": f"单次最多提交 {core.ORDER_BATCH_MAX} 个订单"}, 400)
+
+        return json_response(core.batch_submit_results(order_ids, await submit_orders(order_ids)))
+
+    except Exception as e:
+        logger.exception("❌ 批量提交订单API错误: %s", e)
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+async def api_order_feedback(request):
+    """订单反馈API"""
+    try:
+        data = await request.json()
+        order_id = data.get('order_id')
+        rating = data.get('rating')
+        feedback = data.get('feedback', '')
+
+        if not order_id:
+            return json_response({"success": False, "message": "订单ID不能为空"}, 400)
+
+        if not rating or not isinstance(rating, int):
+            return json_response({"success": False, "message": "评分不能为空且必须为整数"}, 400)
+
+        result = await update_order_feedback(order_id, rating, feedback)
+        return json_response(result, 200 if result["success"] else 500)
+
+    except Exception as e:
+        logger.exception("❌ 订单反馈API错误: %s", e)
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+async def api_get_user_orders(request):
+    """获取用户订单列表API（limit/cursor 分页和 fields 字段投影，与 app.py 一致）"""
+    user_id = request.path_params['user_id']
+    try:
+        try:
+            limit = int(request.query_params.get('limit', core.ORDERS_PAGE_DEFAULT_LIMIT))
+        except ValueError:
+            return json_response({"success": False, "message": "limit必须为整数"}, 400)
+        if limit < 1:
+            return json_response({"success": False, "message": "limit必须大于0"}, 400)
+        limit = min(limit, core.ORDERS_PAGE_MAX_LIMIT)
+
+        try:
+            cursor = request.query_params.get('cursor')
+            before = core.decode_orders_cursor(cursor) if cursor else None
+            fields = core.parse_order_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return json_response({"success": False, "message": str(e)}, 400)
+
+        if DEVELOPMENT_MODE:
+            user_orders, has_more = await run_in_threadpool(core.dev_orders.page_by_user, user_id, limit, before)
+        else:
+            user_orders, has_more = await backend.page_orders(user_id, limit, before, fields)
+
+        next_cursor = core.encode_orders_cursor(user_orders[-1]) if has_more else None
+        user_orders = [core.order_json(order, fields) for order in user_orders]
+
+        return json_response({
+            "success": True,
+            "orders": user_orders,
+            "count": len(user_orders),
+            "has_more": has_more,
+            "next_cursor": next_cursor
+        })
+
+    except Exception as e:
+        logger.exception("❌ 获取订单API错误: %s", e)
+        return json_response({"success": False, "message": f"服务器错误: {str(e)}"}, 500)
+
+async def api_get_user_invite_stats(request):
+    """获取用户邀请统计API"""
+    try:
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return json_response({"success": False, "message": "用户ID不能为空"}, 400)
+
+        summary = await get_invite_summary(user_id)
+        if summary is None:
+            return json_response({"success": False, "message": "用户邀请信息不存在"}, 404)
+
+        return json_response({
+            "success": True,
+            **format_invite_stats(summary),
+            "free_drinks_remaining": (await get_free_drinks_remaining())[0]
+        })
+
+    except Exception as e:
+        logger.exception("❌ 获取邀请统计错误: %s", e)
+        return json_response({"success": False, "message": str(e)}, 500)
+
+async def api_get_invite_progress(request):
+    """获取用户邀请进度API"""
+    try:
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return json_response({"success": False, "message": "用户ID不能为空"}, 400)
+
+        summary = await get_invite_summary(user_id)
+        if summary is None:
+            return json_response({"success": False, "message": "用户邀请信息不存在"}, 404)
+
+        return json_response({"success": True, **format_invite_progress(summary)})
+
+    except Exception as e:
+        logger.exception("❌ 获取邀请进度错误: %s", e)
+        return json_response({"success": False, "message": str(e)}, 500)
+
+async def api_claim_free_drink(request):
+    """领取免单奶茶API"""
+    try:
+        data = await request.json()
+        user_id = data.get('user_id')
+
+        if not user_id:
+            return json_response({"success": False, "message": "用户ID不能为空"}, 400)
+
+        if DEVELOPMENT_MODE:
+            error = await run_in_threadpool(core.check_dev_free_drink_eligibility, user_id)
+            if error:
+                return json_response({"success": False, "message": error}, 400)
+            status = await run_in_threadpool(core.free_drink_quota.try_claim, user_id)
+        else:
+            status = await backend.claim_free_drink(user_id)
+
+        if status != CLAIM_OK:
+            return json_response({"success": False, "message": core.FREE_DRINK_CLAIM_MESSAGES.get(status, "免单名额已用完")}, 400)
+
+        if DEVELOPMENT_MODE:
+            await run_in_threadpool(core.invite_summaries.mark_claimed, user_id)
+        core.invalidate_cached_user(user_id)
+
+        core.free_drinks_view.invalidate()
+        free_drinks_remaining = (await get_free_drinks_remaining())[0]
+        core.event_hub.publish('quota', 'free_drinks_remaining', {"free_drinks_remaining": free_drinks_remaining})
+        logger.info("🎉 用户 %s 成功领取免单", user_id, extra={'free_drinks_remaining': free_drinks_remaining})
+
+        return json_response({
+            "success": True,
+            "message": "免单领取成功！",
+            "free_drinks_remaining": free_drinks_remaining
+        })
+
+    except Exception as e:
+        logger.exception("❌ 领取免单错误: %s", e)
+        return json_response({"success": False, "message": str(e)}, 500)
+
+async def api_free_drinks_remaining(request):
+    """获取免单剩余数量API（支持ETag条件请求）"""
+    try:
+        free_drinks_remaining, etag = await get_free_drinks_remaining()
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse({
+            "success": True,
+            "free_drinks_remaining": free_drinks_remaining,
+            "message": f"还有 {free_drinks_remaining} 个免单名额"
+        }, headers=headers)
+
+    except Exception as e:
+        logger.exception("❌ 获取免单剩余数量错误: %s", e)
+        return json_response({"success": False, "message": str(e)}, 500)
+
+async def api_events(request):
+    """实时事件推送API（SSE），连接挂起期间不占用线程"""
+    user_id = request.query_params.get('user_id')
+    topics = ['quota'] + ([f"user:{user_id}"] if user_id else [])
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    # 发布者可能在其他线程，通过 call_soon_threadsafe 唤醒事件循环
+    subscription = core.event_hub.subscribe(topics, listener=lambda: loop.call_soon_threadsafe(ready.set))
+    if subscription is None:
+        return json_response({"success": False, "message": "实时推送连接数已满，请稍后重试"}, 503)
+
+    free_drinks_remaining = (await get_free_drinks_remaining())[0]
+
+    async def stream():
+        try:
+            yield format_sse({'event': 'free_drinks_remaining', 'data': {"free_drinks_remaining": free_drinks_remaining}})
+            while True:
+                ready.clear()
+                event = subscription.get(timeout=0)
+                if event is None:
+                    try:
+                        await asyncio.wait_for(ready.wait(), SSE_HEARTBEAT_INTERVAL)
+                        continue
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+                        continue
+                yield format_sse(event)
+        finally:
+            core.event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+async def api_metrics(request):
+    """Prometheus指标API"""
+    return Response(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+def store_stats():
+    """各存储的统计（SQLite存储会查询数据库，在线程池中调用）"""
+    return {
+        "sqlite": core.sqlite_db.stats() if core.sqlite_db is not None else None,
+        "verification_codes": core.verification_store.stats(),
+        "invite_summaries": core.invite_summaries.stats(),
+        "rate_limit": core.rate_limiter.stats(),
+        "idempotency": core.idempotency_store.stats(),
+        "write_behind": core.order_update_buffer.stats() if core.order_update_buffer is not None else None,
+    }
+
+async def health_check(request):
+    """健康检查API"""
+    stats = await run_in_threadpool(store_stats)
+    return json_response({
+        "status": "healthy",
+        "message": "API服务正常运行",
+        "server_mode": "asgi",
+        "cors_origins": CORS_ORIGINS,
+        "development_mode": DEVELOPMENT_MODE,
+        "workers": core.WORKERS,
+        "pid": os.getpid(),
+        "storage_backend": core.STORAGE_BACKEND if DEVELOPMENT_MODE else "supabase",
+        "sqlite": stats["sqlite"],
+        "free_drinks_remaining": (await get_free_drinks_remaining())[0],
+        "login_latency_ms": core.login_latency.snapshot(),
+        "verification_codes": stats["verification_codes"],
+        "events": core.event_hub.stats(),
+        "user_cache": core.user_cache.stats(),
+        "invite_summaries": stats["invite_summaries"],
+        "rate_limit": stats["rate_limit"],
+        "idempotency": stats["idempotency"],
+        "write_behind": stats["write_behind"],
+        "client_pools": None if DEVELOPMENT_MODE else {
+            "sms_gateway": sms_sender.stats()
+        }
+    })
+
+@asynccontextmanager
+async def lifespan(app):
+    # 日志写出线程、过期验证码清理和写后缓冲只在服务启动时开始，导入 app.py 不会启动
+    await run_in_threadpool(core.start_background_services)
+    yield
+    if not DEVELOPMENT_MODE:
+        await sms_sender.aclose()
+        await backend.aclose()
+
+routes = [
+    Route('/send-verification-code', api_send_verification_code, methods=['POST']),
+    Route('/login-with-phone', api_login_with_phone, methods=['POST']),
+    Route('/verify-invite-code', api_verify_invite_code, methods=['POST']),
+    Route('/create-order', api_create_order, methods=['POST']),
+    Route('/submit-order', api_submit_order, methods=['POST']),
+    Route('/create-orders', api_create_orders, methods=['POST']),
+    Route('/submit-orders', api_submit_orders, methods=['POST']),
+    Route('/order-feedback', api_order_feedback, methods=['POST']),
+    Route('/orders/{user_id}', api_get_user_orders, methods=['GET']),
+    Route('/get-user-invite-stats', api_get_user_invite_stats, methods=['GET']),
+    Route('/get-invite-progress', api_get_invite_progress, methods=['GET']),
+    Route('/claim-free-drink', api_claim_free_drink, methods=['POST']),
+    Route('/free-drinks-remaining', api_free_drinks_remaining, methods=['GET']),
+    Route('/events', api_events, methods=['GET']),
+    Route('/metrics', api_metrics, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+]
+
+class TimingMiddleware:
+    """按路由模板、方法和状态码记录接口耗时，计到响应头发出为止（SSE等流式响应只计首包）"""
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = {route.endpoint: route.path for route in routes}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                route = self.route_paths.get(scope.get('endpoint'), 'unmatched')
+                HTTP_REQUEST_DURATION.observe((time.perf_counter() - started) * 1000, scope['method'], route, message['status'])
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+app = Starlette(routes=routes, lifespan=lifespan, middleware=[
+    Middleware(TimingMiddleware),
+    Middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=core.CORS_ALLOW_HEADERS,
+        expose_headers=core.CORS_EXPOSE_HEADERS,
+        allow_credentials=True,
+    )
+])
+
+if __name__ == '__main__':
+    import uvicorn
+    print("=== 手机验证码登录API服务（ASGI） ===")
+    print(f"🔧 开发模式: {DEVELOPMENT_MODE}")
+    print("🔗 测试连接: http://localhost:5001/health")
+    uvicorn.run(app, host='0.0.0.0', port=5001)
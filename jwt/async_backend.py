@@ -0,0 +1,195 @@
+"""
+异步后端 - ASGI模式下生产环境使用的异步Supabase数据访问和异步短信发送
+"""
+
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from logs import get_logger
+from metrics import SMS_CALL_DURATION
+
+logger = get_logger('sms')
+
+
+class AsyncSupabaseBackend:
+    """生产模式的异步数据访问
+
+    所有请求共享一个异步PostgREST客户端（见 clients.create_async_postgrest_client），
+    等待数据库响应时不占用线程，单进程可以同时挂起大量请求。
+    每个方法与 app.py 中生产模式分支的查询一一对应。
+    """
+
+    def __init__(self, client, ttl_seconds=600, quota_shards=16):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.quota_shards = quota_shards
+
+    async def store_verification_code(self, phone_number, code):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        return await self.client.table('verification_codes').insert({
+            'phone_number': phone_number,
+            'code': code,
+            'expires_at': expires_at.isoformat(),
+            'used': False
+        }).execute()
+
+    async def consume_verification_code(self, phone_number, input_code):
+        """校验并标记验证码，返回 'ok' | 'not_found' | 'expired' | 'mismatch'"""
+        result = await self.client.rpc('consume_verification_code', {
+            'p_phone_number': phone_number,
+            'p_code': input_code
+        }).execute()
+        return result.data
+
+    async def find_user(self, phone_number):
+        result = await self.client.table('users').select('*').eq('phone_number', phone_number).execute()
+        return result.data[0] if result.data else None
+
+    async def signup(self, phone_number, invite_code):
+        """调用数据库函数 signup_with_invite 注册，返回 (SIGNUP_* 结果, 新用户记录)"""
+        result = await self.client.rpc('signup_with_invite', {
+            'p_phone_number': phone_number,
+            'p_invite_code': invite_code
+        }).execute()
+        return result.data['status'], result.data.get('user')
+
+    async def get_invite_summary(self, user_id):
+        result = await self.client.table('user_invite_summaries').select('*').eq('user_id', str(user_id)).execute()
+        return result.data[0] if result.data else None
+
+    async def reserve_order_numbers(self, day, count):
+        """预留 day 当天接下来的 count 个订单序号，返回其中第一个（见 order_numbers.py）"""
+        result = await self.client.rpc('reserve_order_numbers', {'p_day': day, 'p_count': count}).execute()
+        return result.data
+
+    async def next_user_sequence(self, user_id):
+        try:
+            result = await self.client.from_('orders').select('user_sequence_number').eq('user_id', user_id).order('user_sequence_number', desc=True).limit(1).execute()
+        except Exception:
+            return 1
+        return result.data[0]['user_sequence_number'] + 1 if result.data else 1
+
+    async def insert_order(self, order_data):
+        result = await self.client.table('orders').insert(order_data).execute()
+        return result.data[0]
+
+    async def create_orders_batch(self, rows):
+        """调用数据库函数 create_orders_batch 一次写入多个订单，返回写入后的订单"""
+        result = await self.client.rpc('create_orders_batch', {'p_orders': rows}).execute()
+        return result.data
+
+    async def update_orders(self, order_ids, fields):
+        """一条语句更新多个订单，返回更新后的订单"""
+        result = await self.client.table('orders').update(fields).in_('id', list(order_ids)).execute()
+        return result.data
+
+    async def update_order(self, order_id, fields):
+        """更新订单，返回更新后的订单，订单不存在时返回None"""
+        result = await self.client.table('orders').update(fields).eq('id', order_id).execute()
+        return result.data[0] if result.data else None
+
+    async def page_orders(self, user_id, limit, before=None, fields=None):
+        """按 (created_at, id) 倒序分页获取用户订单，返回 (orders, has_more)"""
+        columns = '*' if fields is None else ','.join(sorted(set(fields) | {'id', 'created_at'}))
+        query = self.client.table('orders').select(columns).eq('user_id', user_id).eq('is_deleted', False)
+        if before:
+            created_at, order_id = before
+            query.params = query.params.add(
+                'or', f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{order_id}))'
+            )
+        query.params = query.params.add('order', 'created_at.desc,id.desc')
+        result = await query.limit(limit + 1).execute()
+        return result.data[:limit], len(result.data) > limit
+
+    async def claim_free_drink(self, user_id):
+        result = await self.client.rpc('claim_free_drink', {
+            'p_user_id': str(user_id),
+            'p_shard': random.randrange(self.quota_shards)
+        }).execute()
+        return result.data
+
+    async def free_drinks_remaining(self):
+        result = await self.client.rpc('free_drinks_remaining', {}).execute()
+        return result.data or 0
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class AsyncSmsSender:
+    """ASGI模式的短信发送器
+
+    与 sms_dispatch.SmsDispatcher 的行为一致：接口只负责提交，短信在后台任务中发送，
+    按网关限制并发数，失败时指数退避重试。待发送的短信数超过 max_pending 时拒绝提交。
+    """
+
+    def __init__(self, url, max_pending=1000, max_concurrency=4, max_retries=3, backoff=0.5, timeout=5.0):
+        self.url = url
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self._limit = None
+        self._max_concurrency = max_concurrency
+        self._tasks = set()
+        self._stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0}
+
+    def submit(self, phone_number, code):
+        """在当前事件循环中创建发送任务，待发送数已满时返回False"""
+        if len(self._tasks) >= self.max_pending:
+            self._stats['dropped'] += 1
+            return False
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self._max_concurrency)
+        body = {'name': '验证码', 'code': code, 'targets': phone_number}
+        task = asyncio.get_running_loop().create_task(self._send(body))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._stats['queued'] += 1
+        return True
+
+    async def join(self):
+        """等待所有已提交的短信处理完毕"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self):
+        return {**self._stats, 'pending': len(self._tasks)}
+
+    async def aclose(self, timeout=5.0):
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        await self.client.aclose()
+
+    async def _send(self, body):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._stats['retried'] += 1
+                # 指数退避加随机抖动，避免网关恢复时被重试请求同时打满
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+            try:
+                async with self._limit:
+                    started = time.perf_counter()
+                    response = await self.client.post(self.url, json=body)
+                SMS_CALL_DURATION.observe((time.perf_counter() - started) * 1000, response.status_code)
+                if response.status_code == 200:
+                    self._stats['sent'] += 1
+                    return True
+                # 除限流(429)外的4xx为请求本身错误，重试没有意义
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    break
+            except httpx.HTTPError as e:
+                SMS_CALL_DURATION.observe((time.perf_counter() - started) * 1000, 'error')
+                logger.warning("⚠️  短信发送异常: %s - %s", body['targets'], e)
+        self._stats['failed'] += 1
+        logger.error("❌ 短信发送失败: %s", body['targets'])
+        return False
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+性能基准测试脚本 - 输出机器可读的JSON结果，便于逐次提交对比
+
+用法:
+    python benchmark.py quota --threads 64 --users 2000 --total 100
+    python benchmark.py funnel --threads 16 --users 800
+    python benchmark.py memory --orders 200000
+    python benchmark.py startup --runs 5 --mode production
+    python benchmark.py --output funnel.json funnel --url http://localhost:5001
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+
+def run_concurrently(threads, target):
+    """启动 threads 个线程同时执行 target(index)，返回总耗时（秒）"""
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        barrier.wait()
+        target(index)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def load_dev_app():
+    """以开发模式导入Flask应用"""
+    os.environ["FORCE_DEV_MODE"] = "true"
+    # 压测时关闭常规日志，只保留警告和错误
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    # 压测请求都来自同一个地址，关闭限流
+    app.rate_limiter.enabled = False
+    return app
+
+
+def percentile(samples, q):
+    """按最近秩法计算分位数"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarize_latencies(samples_ms, errors, elapsed):
+    return {
+        'requests': len(samples_ms),
+        'errors': errors,
+        'p50_ms': round(percentile(samples_ms, 0.50), 3) if samples_ms else None,
+        'p99_ms': round(percentile(samples_ms, 0.99), 3) if samples_ms else None,
+        'max_ms': round(max(samples_ms), 3) if samples_ms else None,
+        'avg_ms': round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else None,
+        'requests_per_s': round(len(samples_ms) / elapsed, 1) if elapsed else None,
+    }
+
+
+class UrlClient:
+    """把 requests.Session 包装成与测试客户端相同的调用方式，用于压测已运行的服务"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, path, **kwargs):
+        return self.session.get(self.base_url + path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.session.post(self.base_url + path, **kwargs)
+
+
+def response_json(response):
+    # Flask测试客户端的 .json 是属性，requests/httpx 的是方法
+    data = response.json
+    return data() if callable(data) else data
+
+
+FUNNEL_STEPS = ['send_verification_code', 'login_with_phone', 'verify_invite_code', 'create_order', 'submit_order']
+
+
+def run_funnel(client, phone_number, invite_code, record):
+    """走完一遍注册下单流程，每一步调用 record(step, 耗时毫秒, 是否成功)，任一步失败即停止"""
+
+    def step(name, path, body):
+        started = time.perf_counter()
+        try:
+            response = client.post(path, json=body)
+            data = response_json(response)
+            ok = response.status_code == 200 and data.get('success') is True
+        except Exception:
+            data, ok = None, False
+        record(name, (time.perf_counter() - started) * 1000, ok)
+        return data if ok else None
+
+    sent = step('send_verification_code', '/send-verification-code', {'phone_number': phone_number})
+    # 开发模式才会返回 dev_code，生产模式无法自动完成后续步骤
+    if not sent or 'dev_code' not in sent:
+        return False
+    if not step('login_with_phone', '/login-with-phone', {'phone_number': phone_number, 'verification_code': sent['dev_code']}):
+        return False
+    user = step('verify_invite_code', '/verify-invite-code', {'phone_number': phone_number, 'invite_code': invite_code})
+    if not user:
+        return False
+    order = step('create_order', '/create-order', {
+        'user_id': user['user_id'],
+        'phone_number': phone_number,
+        'form_data': {'address': '压测地址', 'budget': 30, 'allergies': [], 'preferences': ['奶茶']}
+    })
+    if not order:
+        return False
+    return step('submit_order', '/submit-order', {'order_id': order['order_id']}) is not None
+
+
+def bench_funnel(args):
+    """注册下单全流程压测：发送验证码 → 登录 → 邀请码注册 → 创建订单 → 提交订单，输出各步骤和整体的p50/p99延迟与吞吐"""
+    if args.url:
+        target = args.url
+        make_client = lambda: UrlClient(args.url)
+    elif args.app == 'asgi':
+        load_dev_app()
+        from starlette.testclient import TestClient
+        import asgi_app
+        target = 'in-process:asgi'
+        make_client = lambda: TestClient(asgi_app.app)
+    else:
+        app = load_dev_app()
+        target = 'in-process:flask'
+        make_client = app.app.test_client
+
+    lock = threading.Lock()
+    samples = {name: [] for name in FUNNEL_STEPS}
+    errors = {name: 0 for name in FUNNEL_STEPS}
+    funnel_ms = []
+    completed = []
+    per_thread = args.users // args.threads
+    # 手机号前缀带上进程号，同一服务多次压测不会撞上已注册的手机号
+    prefix = f"19{os.getpid() % 1000:03d}"
+
+    def record(name, elapsed_ms, ok):
+        with lock:
+            samples[name].append(elapsed_ms)
+            if not ok:
+                errors[name] += 1
+
+    def worker(index):
+        client = make_client()
+        for n in range(per_thread):
+            phone_number = f"{prefix}{index * per_thread + n:06d}"
+            started = time.perf_counter()
+            ok = run_funnel(client, phone_number, args.invite_code, record)
+            with lock:
+                funnel_ms.append((time.perf_counter() - started) * 1000)
+                completed.append(ok)
+
+    elapsed = run_concurrently(args.threads, worker)
+    attempted = len(completed)
+    succeeded = completed.count(True)
+    return {
+        'target': target,
+        'threads': args.threads,
+        'elapsed_s': round(elapsed, 4),
+        'funnels': {
+            'attempted': attempted,
+            'completed': succeeded,
+            'p50_ms': round(percentile(funnel_ms, 0.50), 3) if funnel_ms else None,
+            'p99_ms': round(percentile(funnel_ms, 0.99), 3) if funnel_ms else None,
+            'funnels_per_s': round(succeeded / elapsed, 1) if elapsed else None,
+        },
+        'steps': {name: summarize_latencies(samples[name], errors[name], elapsed) for name in FUNNEL_STEPS},
+        'ok': attempted > 0 and succeeded == attempted,
+    }
+
+
+def add_funnel_arguments(parser):
+    parser.add_argument('--threads', type=int, default=8, help='并发用户数（线程数）')
+    parser.add_argument('--users', type=int, default=400, help='走完流程的用户总数')
+    parser.add_argument('--url', help='压测已运行的服务（需为开发模式），不指定时在进程内压测')
+    parser.add_argument('--app', choices=['flask', 'asgi'], default='flask', help='进程内压测的服务入口')
+    parser.add_argument('--invite-code', default='WELCOME', help='注册使用的邀请码')
+
+
+def bench_quota(args):
+    """免单名额并发压测：每个用户重复领取，验证成功数等于总名额且没有用户领取两次"""
+    from quota import QuotaCounter, CLAIM_OK
+
+    # 缩短线程切换间隔，让线程交错更频繁，更容易暴露竞争
+    sys.setswitchinterval(1e-6)
+    results = {}
+
+    counter = QuotaCounter(args.total)
+    granted = []
+    per_thread = args.users // args.threads
+
+    def claim_engine(index):
+        for n in range(per_thread):
+            user_id = f"user_{index * per_thread + n}"
+            for _ in range(args.repeat):
+                if counter.try_claim(user_id) == CLAIM_OK:
+                    granted.append(user_id)
+
+    elapsed = run_concurrently(args.threads, claim_engine)
+    attempts = args.threads * per_thread * args.repeat
+    results['engine'] = {
+        'attempts': attempts,
+        'granted': len(granted),
+        'duplicate_grants': len(granted) - len(set(granted)),
+        'remaining': counter.remaining(),
+        'elapsed_s': round(elapsed, 4),
+        'claims_per_s': round(attempts / elapsed, 1),
+    }
+
+    app = load_dev_app()
+    app.free_drink_quota = QuotaCounter(args.total)
+    client = app.app.test_client()
+    http_users = [f"dev_user_bench_{i}" for i in range(args.http_users)]
+    for user_id in http_users:
+        client.get(f"/get-user-invite-stats?user_id={user_id}")
+    statuses = []
+    per_thread = len(http_users) // args.threads
+
+    def claim_http(index):
+        local_client = app.app.test_client()
+        for user_id in http_users[index * per_thread:(index + 1) * per_thread]:
+            for _ in range(args.repeat):
+                statuses.append(local_client.post('/claim-free-drink', json={'user_id': user_id}).status_code)
+
+    elapsed = run_concurrently(args.threads, claim_http)
+    results['http'] = {
+        'attempts': len(statuses),
+        'granted': statuses.count(200),
+        'remaining': app.free_drink_quota.remaining(),
+        'elapsed_s': round(elapsed, 4),
+        'requests_per_s': round(len(statuses) / elapsed, 1),
+    }
+
+    expected_engine = min(args.total, args.threads * (args.users // args.threads))
+    expected_http = min(args.total, args.threads * per_thread)
+    results['ok'] = (results['engine']['granted'] == expected_engine
+                     and results['engine']['duplicate_grants'] == 0
+                     and results['http']['granted'] == expected_http)
+    return results
+
+
+def add_quota_arguments(parser):
+    parser.add_argument('--threads', type=int, default=32, help='并发线程数')
+    parser.add_argument('--users', type=int, default=2000, help='计数器压测的用户数')
+    parser.add_argument('--http-users', type=int, default=320, help='接口压测的用户数')
+    parser.add_argument('--total', type=int, default=100, help='免单总名额')
+    parser.add_argument('--repeat', type=int, default=2, help='每个用户重复领取次数')
+
+
+def bench_memory(args):
+    """开发模式内存占用：同样的订单和用户，原来的dict记录与 __slots__ 记录各占多少内存"""
+    import gc
+    import random
+    import tracemalloc
+    import uuid
+    from datetime import datetime, timezone
+    from records import OrderRecord, UserRecord
+
+    app = load_dev_app()
+    allergies = ['无辣', '无花生', '无海鲜', '无乳制品', '素食']
+    preferences = ['川菜', '粤菜', '清淡', '快餐', '日料', '西餐']
+    rng = random.Random(0)
+    forms = [{
+        'address': f"北京市朝阳区测试路{n % 500}号",
+        'budget': rng.choice([0, 20, 30, 50]),
+        'allergies': rng.sample(allergies, rng.randint(0, 2)),
+        'preferences': rng.sample(preferences, rng.randint(0, 2)),
+    } for n in range(args.orders)]
+    now = datetime.now(timezone.utc)
+
+    def build_dict_orders():
+        orders = []
+        for n, form_data in enumerate(forms):
+            order = app.build_order_data(f"user_{n % args.users}", f"138{n % args.users:08d}", form_data, f"ORD20250101{n:06d}", n, now)
+            order['id'] = str(uuid.uuid4())
+            orders.append(order)
+        return orders
+
+    def build_record_orders():
+        return [
+            OrderRecord.from_form(str(uuid.uuid4()), f"user_{n % args.users}", f"138{n % args.users:08d}", form_data, f"ORD20250101{n:06d}", n, now)
+            for n, form_data in enumerate(forms)
+        ]
+
+    def build_dict_users():
+        return [{
+            'id': f"dev_user_{n}", 'phone_number': f"138{n:08d}", 'user_sequence': n,
+            'user_invite_code': f"C{n:05d}", 'created_at': now.isoformat(), 'invite_code': 'WELCOME'
+        } for n in range(args.users)]
+
+    def build_record_users():
+        return [UserRecord(f"dev_user_{n}", f"138{n:08d}", n, f"C{n:05d}", now.isoformat(), 'WELCOME') for n in range(args.users)]
+
+    def measure(build, count):
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        records = build()
+        elapsed = time.perf_counter() - started
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del records
+        return {'bytes': size, 'bytes_per_record': round(size / count, 1), 'build_s': round(elapsed, 4)}
+
+    results = {
+        'orders': args.orders,
+        'users': args.users,
+        'dict_orders': measure(build_dict_orders, args.orders),
+        'record_orders': measure(build_record_orders, args.orders),
+        'dict_users': measure(build_dict_users, args.users),
+        'record_users': measure(build_record_users, args.users),
+    }
+    results['order_memory_ratio'] = round(results['record_orders']['bytes'] / results['dict_orders']['bytes'], 3)
+    results['user_memory_ratio'] = round(results['record_users']['bytes'] / results['dict_users']['bytes'], 3)
+    results['ok'] = results['order_memory_ratio'] < 1 and results['user_memory_ratio'] < 1
+    return results
+
+
+def add_memory_arguments(parser):
+    parser.add_argument('--orders', type=int, default=100000, help='订单数')
+    parser.add_argument('--users', type=int, default=10000, help='用户数（订单平均分配给这些用户）')
+
+
+# 冷启动测量在子进程中运行：导入耗时、导入后已加载的模块
+# 只导入不应启动后台线程，也不应创建写后缓冲的日志文件（这些在 create_app() 中启动）
+STARTUP_IMPORT_PROBE = """
+import json, os, sys, threading, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({'import_ms': elapsed * 1000, 'modules': len(sys.modules),
+                  'loaded': [name for name in sys.argv[1:] if name in sys.modules],
+                  'threads': [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()],
+                  'journal_created': os.path.exists(os.environ['WRITE_BEHIND_JOURNAL_PATH'])}))
+"""
+STARTUP_SERVE_PROBE = """
+import sys
+import app
+app.create_app().run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+# 推迟到第一次使用的较慢的依赖，导入应用后不应出现在 sys.modules 中
+STARTUP_DEFERRED_MODULES = ['supabase', 'postgrest', 'httpx', 'requests', 'asyncio']
+
+
+def free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(env, timeout, verbose):
+    """启动服务子进程，返回从启动到收到第一个HTTP响应的毫秒数，超时返回None
+
+    请求一个不存在的路径：经过完整的请求处理（路由、钩子），但不访问数据库，生产模式也不会连接虚构的地址。
+    """
+    import subprocess
+    import urllib.error
+    import urllib.request
+    port = free_port()
+    output = None if verbose else subprocess.DEVNULL
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-c', STARTUP_SERVE_PROBE, str(port)], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), stdout=output, stderr=output)
+    try:
+        while time.perf_counter() - started < timeout and server.poll() is None:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/startup-probe", timeout=1).close()
+            except urllib.error.HTTPError:
+                pass  # 404 也是完整处理过的响应
+            except OSError:
+                time.sleep(0.005)
+                continue
+            return (time.perf_counter() - started) * 1000
+        return None
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_startup(args):
+    """冷启动：新进程导入应用的耗时、从启动服务进程到第一个响应的耗时，以及导入后是否加载了应推迟的依赖"""
+    import subprocess
+    import tempfile
+
+    def summarize(samples):
+        if not samples:
+            return None
+        return {'min': round(min(samples), 1), 'p50': round(percentile(samples, 0.50), 1), 'max': round(max(samples), 1)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, LOG_LEVEL='WARNING', PREWARM='true' if args.prewarm else 'false',
+                   SQLITE_PATH=os.path.join(directory, 'omnilaze.db'),
+                   WRITE_BEHIND_JOURNAL_PATH=os.path.join(directory, 'write_behind.db'))
+        if args.mode == 'production':
+            # 客户端推迟到第一次使用，导入和 /metrics 都不会连接这个地址
+            env.update(SUPABASE_URL='https://startup-benchmark.supabase.co', SUPABASE_KEY='startup-benchmark', FORCE_DEV_MODE='false')
+        else:
+            env.update(FORCE_DEV_MODE='true')
+
+        imports = []
+        for _ in range(args.runs):
+            result = subprocess.run([sys.executable, '-c', STARTUP_IMPORT_PROBE, *STARTUP_DEFERRED_MODULES], env=env,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+            imports.append(json.loads(result.stdout.strip().splitlines()[-1]))
+        first_responses = [time_to_first_response(env, args.timeout, args.verbose) for _ in range(args.runs)]
+
+    responded = [elapsed for elapsed in first_responses if elapsed is not None]
+    loaded = sorted({name for probe in imports for name in probe['loaded']})
+    threads = sorted({name for probe in imports for name in probe['threads']})
+    journal_created = any(probe['journal_created'] for probe in imports)
+    return {
+        'mode': args.mode,
+        'prewarm': args.prewarm,
+        'runs': args.runs,
+        'import_ms': summarize([probe['import_ms'] for probe in imports]),
+        'modules_after_import': imports[-1]['modules'],
+        'deferred_modules_loaded': loaded,
+        'threads_after_import': threads,
+        'journal_created_on_import': journal_created,
+        'first_response_ms': summarize(responded),
+        'failed_starts': len(first_responses) - len(responded),
+        'ok': not loaded and not threads and not journal_created and len(responded) == args.runs,
+    }
+
+
+def add_startup_arguments(parser):
+    parser.add_argument('--runs', type=int, default=5, help='冷启动次数')
+    parser.add_argument('--mode', choices=['development', 'production'], default='development',
+                        help='production 时使用虚构的Supabase地址（只测启动，不访问数据库）')
+    parser.add_argument('--prewarm', action='store_true', help='开启后台预热（PREWARM=true），对比第一个响应的耗时')
+    parser.add_argument('--timeout', type=float, default=30, help='等待服务响应的超时(秒)')
+
+
+SCENARIOS = {
+    'quota': (bench_quota, add_quota_arguments),
+    'funnel': (bench_funnel, add_funnel_arguments),
+    'memory': (bench_memory, add_memory_arguments),
+    'startup': (bench_startup, add_startup_arguments),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API性能基准测试")
+    parser.add_argument('--output', help='把JSON结果写入文件')
+    parser.add_argument('--verbose', action='store_true', help='显示被测服务的日志输出')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+    for name, (func, add_arguments) in SCENARIOS.items():
+        add_arguments(subparsers.add_parser(name, help=func.__doc__))
+    args = parser.parse_args()
+
+    bench, _ = SCENARIOS[args.scenario]
+    # 进程内压测时服务的日志会混进标准输出，默认丢弃，保证输出是合法JSON
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        results = {'scenario': args.scenario, 'timestamp': time.time(), **bench(args)}
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    sys.exit(0 if results.get('ok', True) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+缓存工具 - 带TTL和主动失效的单值缓存、LRU+TTL键值缓存
+"""
+
+import collections
+import hashlib
+import json
+import threading
+import time
+
+
+class CachedValue:
+    """单值缓存
+
+    值在 ttl 秒内直接复用，过期或调用 invalidate() 后由下一次读取重新加载。
+    每次加载时根据内容计算ETag，内容不变ETag就不变，可直接用于条件请求。
+    """
+
+    def __init__(self, loader, ttl=2.0):
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._etag = None
+        self._expires_at = 0.0
+        self._stats = {'hits': 0, 'loads': 0, 'invalidations': 0}
+
+    def get(self):
+        """返回 (值, ETag)"""
+        if time.monotonic() < self._expires_at:
+            self._stats['hits'] += 1
+            return self._value, self._etag
+        with self._lock:
+            # 其他线程可能已经在等锁期间完成了加载
+            if time.monotonic() < self._expires_at:
+                self._stats['hits'] += 1
+                return self._value, self._etag
+            return self._store(self.loader())
+
+    def peek(self):
+        """不触发加载，缓存有效时返回 (值, ETag)，否则返回None（供异步代码自行加载后调用 put）"""
+        if time.monotonic() < self._expires_at:
+            self._stats['hits'] += 1
+            return self._value, self._etag
+        return None
+
+    def put(self, value):
+        """写入新加载的值，返回 (值, ETag)"""
+        with self._lock:
+            return self._store(value)
+
+    def invalidate(self):
+        self._expires_at = 0.0
+        self._stats['invalidations'] += 1
+
+    def stats(self):
+        return dict(self._stats)
+
+    def _store(self, value):
+        digest = hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+        self._value, self._etag = value, digest[:16]
+        self._expires_at = time.monotonic() + self.ttl
+        self._stats['loads'] += 1
+        return self._value, self._etag
+
+
+class LRUCache:
+    """带TTL的LRU键值缓存
+
+    条目写入 ttl 秒后过期，超过 max_entries 时淘汰最久未使用的条目。
+    只缓存查到的值，查不到的键不缓存，调用方写库后用 invalidate() 主动失效。
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # 键 -> (值, 过期时间)
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'expired': 0, 'evicted': 0}
+
+    def get(self, key):
+        """返回缓存的值，未命中或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if time.monotonic() >= entry[1]:
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        """写入条目，ttl 为该条目的有效期（秒），默认使用缓存的 ttl"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def put_if_absent(self, key, value, ttl=None):
+        """键不存在（或已过期）时写入并返回None，否则返回已有的值，检查和写入是原子的"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[1]:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0]
+            self._stats['misses'] += 1
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+            return None
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
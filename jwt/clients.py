@@ -0,0 +1,193 @@
+"""
+客户端管理 - 有界的Supabase客户端池和异步PostgREST客户端
+
+supabase、httpx、postgrest 都在第一次创建客户端时才导入，导入本模块不会拖慢冷启动。
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import SUPABASE_CALL_DURATION
+
+
+class PoolTimeoutError(Exception):
+    """在等待时限内没有可用的客户端"""
+
+
+class ClientPool:
+    """有界客户端池
+
+    最多创建 size 个客户端，每个客户端同一时间只借给一个线程使用。
+    没有空闲客户端时等待 acquire_timeout 秒，超时抛出 PoolTimeoutError。
+    """
+
+    def __init__(self, factory, size=8, acquire_timeout=5.0):
+        self.factory = factory
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = queue.LifoQueue()  # 优先复用最近用过的客户端，连接更可能还活着
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._acquisitions = 0
+        self._timeouts = 0
+
+    def acquire(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            client = self._create_or_wait(timeout)
+        with self._lock:
+            self._in_use += 1
+            self._acquisitions += 1
+        return client
+
+    def release(self, client):
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(client)
+
+    def prewarm(self, count=1):
+        """提前创建客户端，直到已创建 count 个（不超过 size），返回本次创建的个数"""
+        created = 0
+        while True:
+            with self._lock:
+                if self._created >= min(count, self.size):
+                    return created
+                self._created += 1
+            try:
+                client = self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._idle.put(client)
+            created += 1
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """借出一个客户端，with块结束后归还"""
+        client = self.acquire(timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def stats(self):
+        with self._lock:
+            acquisitions = self._acquisitions
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'waiting': self._waiting,
+                'acquisitions': acquisitions,
+                'timeouts': self._timeouts,
+                'reuse_ratio': round(max(0.0, 1 - self._created / acquisitions), 4) if acquisitions else 0.0,
+            }
+
+    def _create_or_wait(self, timeout):
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                self._waiting += 1
+                create = False
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeoutError(f"等待数据库连接超时（{timeout}秒）")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+
+def _postgrest_operation(request):
+    """把PostgREST请求归类为 '方法 表名' 或 '方法 rpc/函数名'，作为指标标签"""
+    path = request.url.path.split('/rest/v1/', 1)[-1]
+    return f"{request.method} {path}"
+
+
+def _start_timer(request):
+    request.extensions['started_at'] = time.perf_counter()
+
+
+def _observe_call(response):
+    request = response.request
+    started = request.extensions.get('started_at')
+    if started is not None:
+        SUPABASE_CALL_DURATION.observe((time.perf_counter() - started) * 1000, _postgrest_operation(request), response.status_code)
+
+
+async def _start_timer_async(request):
+    _start_timer(request)
+
+
+async def _observe_call_async(response):
+    _observe_call(response)
+
+
+def instrument_postgrest_session(session):
+    """给PostgREST使用的httpx会话挂上计时钩子，每次请求的耗时按操作和状态码记入 SUPABASE_CALL_DURATION"""
+    import httpx
+    if isinstance(session, httpx.AsyncClient):
+        session.event_hooks = {'request': [_start_timer_async], 'response': [_observe_call_async]}
+    else:
+        session.event_hooks = {'request': [_start_timer], 'response': [_observe_call]}
+    return session
+
+
+def create_supabase_pool(url, key, size=8, timeout=5.0, acquire_timeout=5.0):
+    """创建Supabase客户端池，timeout为每次数据库请求的超时时间（秒）"""
+    def factory():
+        # 导入supabase较慢，推迟到第一次创建客户端（第一次数据库操作或预热）
+        from supabase import create_client
+        from supabase.lib.client_options import ClientOptions
+
+        client = create_client(url, key, options=ClientOptions(postgrest_client_timeout=timeout))
+        # postgrest客户端只在登录状态变化时重建，服务端使用固定密钥，不会丢失钩子
+        instrument_postgrest_session(client.postgrest.session)
+        return client
+
+    return ClientPool(factory, size=size, acquire_timeout=acquire_timeout)
+
+
+def create_async_postgrest_client(url, key, timeout=5.0, max_connections=100):
+    """创建异步PostgREST客户端（ASGI模式），所有请求共享一个最多 max_connections 个连接的httpx连接池"""
+    import httpx
+    from postgrest import AsyncPostgrestClient
+
+    class PooledAsyncPostgrestClient(AsyncPostgrestClient):
+        def create_session(self, base_url, headers, timeout):
+            return httpx.AsyncClient(
+                base_url=base_url,
+                headers=headers,
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+
+    headers = {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'apiKey': key,
+        'Authorization': f"Bearer {key}",
+    }
+    client = PooledAsyncPostgrestClient(f"{url}/rest/v1", headers=headers, timeout=timeout)
+    instrument_postgrest_session(client.session)
+    return client
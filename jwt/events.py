@@ -0,0 +1,101 @@
+"""
+进程内事件推送 - 发布/订阅中心，供SSE接口推送名额和订单状态变化
+"""
+
+import collections
+import itertools
+import json
+import threading
+
+
+class Subscription:
+    """一个订阅者的有界事件缓冲区，缓冲区满时丢弃最旧的事件
+
+    listener 为可选回调，每次推入事件后调用（在发布者线程中执行），
+    供异步连接唤醒事件循环，而不必阻塞在 get() 上。
+    """
+
+    def __init__(self, topics, buffer_size, listener=None):
+        self.topics = frozenset(topics)
+        self.listener = listener
+        self.dropped = 0
+        self._events = collections.deque(maxlen=buffer_size)
+        self._ready = threading.Condition()
+        self._closed = False
+
+    def push(self, event):
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._ready.notify()
+        if self.listener is not None:
+            self.listener()
+
+    def get(self, timeout=None):
+        """取出下一个事件，超时或已关闭时返回None"""
+        with self._ready:
+            if not self._events and not self._closed:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+
+
+class EventHub:
+    """按主题分发事件的发布/订阅中心"""
+
+    def __init__(self, buffer_size=64, max_subscribers=1000):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._topics = collections.defaultdict(set)
+        self._subscribers = 0
+        self._ids = itertools.count(1)
+        self._published = 0
+
+    def subscribe(self, topics, listener=None):
+        """订阅若干主题，订阅数已满时返回None"""
+        with self._lock:
+            if self._subscribers >= self.max_subscribers:
+                return None
+            subscription = Subscription(topics, self.buffer_size, listener)
+            for topic in subscription.topics:
+                self._topics[topic].add(subscription)
+            self._subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+            self._subscribers -= 1
+        subscription.close()
+
+    def publish(self, topic, event_type, data):
+        """向主题的所有订阅者推送事件，返回收到事件的订阅者数"""
+        event = {'id': next(self._ids), 'event': event_type, 'data': data}
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+            self._published += 1
+        for subscription in subscribers:
+            subscription.push(event)
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': self._subscribers, 'topics': len(self._topics), 'published': self._published}
+
+
+def format_sse(event):
+    """把事件编码为SSE文本帧"""
+    data = json.dumps(event['data'], ensure_ascii=False)
+    frame = f"event: {event['event']}\ndata: {data}\n\n"
+    return f"id: {event['id']}\n{frame}" if 'id' in event else frame
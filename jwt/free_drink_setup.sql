@@ -0,0 +1,109 @@
+-- 免单系统（Supabase/PostgreSQL）
+-- 总名额预先分配到多个分片行，领取时只锁一个分片，避免所有请求争抢同一行
+
+-- 用户免单资格和领取标记（与D1迁移005一致）
+ALTER TABLE users ADD COLUMN IF NOT EXISTS free_drink_eligible BOOLEAN DEFAULT FALSE;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS free_drink_claimed BOOLEAN DEFAULT FALSE;
+
+-- 免单配置表（总名额）
+CREATE TABLE IF NOT EXISTS free_drink_config (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_quota INTEGER NOT NULL DEFAULT 100,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 用户免单领取记录，每个用户只能领取一次
+CREATE TABLE IF NOT EXISTS user_free_drinks (
+    id SERIAL PRIMARY KEY,
+    user_id VARCHAR(50) NOT NULL UNIQUE,
+    claimed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    order_id VARCHAR(50),
+    status VARCHAR(20) NOT NULL DEFAULT 'claimed' CHECK (status IN ('claimed', 'used', 'expired'))
+);
+
+-- 名额分片表
+CREATE TABLE IF NOT EXISTS free_drink_quota_shards (
+    shard_id INTEGER PRIMARY KEY,
+    remaining INTEGER NOT NULL CHECK (remaining >= 0)
+);
+
+-- 初始化名额分片：把总名额平均分到 p_shard_count 个分片（重新执行会重置剩余名额）
+CREATE OR REPLACE FUNCTION init_free_drink_shards(p_total INTEGER DEFAULT 100, p_shard_count INTEGER DEFAULT 16)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO free_drink_config (id, total_quota) VALUES (1, p_total)
+    ON CONFLICT (id) DO UPDATE SET total_quota = EXCLUDED.total_quota, updated_at = NOW();
+
+    DELETE FROM free_drink_quota_shards;
+    INSERT INTO free_drink_quota_shards (shard_id, remaining)
+    SELECT s, p_total / p_shard_count + CASE WHEN s < p_total % p_shard_count THEN 1 ELSE 0 END
+    FROM generate_series(0, p_shard_count - 1) AS s;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 领取免单：从 p_shard 开始找一个有余量且未被锁定的分片扣减
+-- 返回值: 'ok' | 'already_claimed' | 'sold_out' | 'not_eligible'
+CREATE OR REPLACE FUNCTION claim_free_drink(p_user_id VARCHAR, p_shard INTEGER)
+RETURNS TEXT AS $$
+DECLARE
+    v_shard_count INTEGER;
+    v_shard INTEGER;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM users WHERE id::TEXT = p_user_id AND free_drink_eligible = TRUE) THEN
+        RETURN 'not_eligible';
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM user_free_drinks WHERE user_id = p_user_id) THEN
+        RETURN 'already_claimed';
+    END IF;
+
+    SELECT COUNT(*) INTO v_shard_count FROM free_drink_quota_shards;
+    IF v_shard_count = 0 THEN
+        RETURN 'sold_out';
+    END IF;
+
+    -- 先跳过被其他事务锁定的分片
+    SELECT shard_id INTO v_shard
+    FROM free_drink_quota_shards
+    WHERE remaining > 0
+    ORDER BY (shard_id - p_shard + v_shard_count) % v_shard_count
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED;
+
+    -- 有余量的分片都被锁定时，等待其中一个
+    IF v_shard IS NULL THEN
+        SELECT shard_id INTO v_shard
+        FROM free_drink_quota_shards
+        WHERE remaining > 0
+        ORDER BY (shard_id - p_shard + v_shard_count) % v_shard_count
+        LIMIT 1
+        FOR UPDATE;
+    END IF;
+
+    IF v_shard IS NULL THEN
+        RETURN 'sold_out';
+    END IF;
+
+    UPDATE free_drink_quota_shards SET remaining = remaining - 1 WHERE shard_id = v_shard;
+
+    BEGIN
+        INSERT INTO user_free_drinks (user_id) VALUES (p_user_id);
+    EXCEPTION WHEN unique_violation THEN
+        -- 同一用户并发领取，退回名额
+        UPDATE free_drink_quota_shards SET remaining = remaining + 1 WHERE shard_id = v_shard;
+        RETURN 'already_claimed';
+    END;
+
+    UPDATE users SET free_drink_claimed = TRUE WHERE id::TEXT = p_user_id;
+    RETURN 'ok';
+END;
+$$ LANGUAGE plpgsql;
+
+-- 剩余名额：各分片余量之和
+CREATE OR REPLACE FUNCTION free_drinks_remaining()
+RETURNS INTEGER AS $$
+    SELECT COALESCE(SUM(remaining), 0)::INTEGER FROM free_drink_quota_shards;
+$$ LANGUAGE sql STABLE;
+
+SELECT init_free_drink_shards(100, 16);
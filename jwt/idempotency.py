@@ -0,0 +1,127 @@
+"""
+幂等请求 - 按 Idempotency-Key 请求头记录第一次的响应，客户端重试时直接重放
+
+键按 (路由, Idempotency-Key) 区分，同时保存请求内容的摘要：同一个键用于不同的请求内容时拒绝。
+第一次请求处理期间的重复请求返回"处理中"；5xx响应不保存，客户端可以用同一个键重试。
+处理中的键只占用 lease 秒（处理请求的进程崩溃后，租约到期即可重试），保存响应后才保留 ttl 秒。
+存储可替换：进程内LRU+TTL缓存，或本地SQLite（多个工作进程共享）。
+"""
+
+import hashlib
+import threading
+import time
+
+from cache import LRUCache
+
+# begin() 的结果
+IDEMPOTENCY_NEW = 'new'                  # 第一次请求，处理后调用 complete() 或 release()
+IDEMPOTENCY_REPLAY = 'replay'            # 重复请求，重放保存的 (状态码, 响应内容)
+IDEMPOTENCY_IN_PROGRESS = 'in_progress'  # 第一次请求尚未处理完
+IDEMPOTENCY_MISMATCH = 'mismatch'        # 同一个键用于不同的请求内容
+
+IDEMPOTENCY_MESSAGES = {
+    IDEMPOTENCY_IN_PROGRESS: ("相同的请求正在处理中，请稍后重试", 409),
+    IDEMPOTENCY_MISMATCH: ("Idempotency-Key 已用于不同的请求", 422),
+}
+
+# Idempotency-Key 的最大长度
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(method, path, body):
+    return hashlib.sha256(b'%s %s\n%s' % (method.encode(), path.encode(), body)).hexdigest()
+
+
+class MemoryIdempotencyStore:
+    """进程内存储：(路由, 键) -> (请求摘要, 响应)，响应为None表示处理中"""
+
+    def __init__(self, max_entries=100000, ttl=86400, lease=60):
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._stats = {'new': 0, 'replayed': 0, 'in_progress': 0, 'mismatched': 0}
+
+    def begin(self, scope, fingerprint):
+        """返回 (IDEMPOTENCY_* 结果, 重放时为 (状态码, 响应内容) 否则为None)"""
+        entry = self._cache.put_if_absent(scope, (fingerprint, None), ttl=self.lease)
+        if entry is None:
+            return self._count(IDEMPOTENCY_NEW, 'new')
+        saved_fingerprint, response = entry
+        if saved_fingerprint != fingerprint:
+            return self._count(IDEMPOTENCY_MISMATCH, 'mismatched')
+        if response is None:
+            return self._count(IDEMPOTENCY_IN_PROGRESS, 'in_progress')
+        return self._count(IDEMPOTENCY_REPLAY, 'replayed', response)
+
+    def complete(self, scope, fingerprint, status, body):
+        self._cache.put(scope, (fingerprint, (status, body)))
+
+    def release(self, scope):
+        self._cache.invalidate(scope)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'size': self._cache.stats()['size'], **self._stats}
+
+    def _count(self, result, counter, response=None):
+        with self._lock:
+            self._stats[counter] += 1
+        return result, response
+
+
+class SQLiteIdempotencyStore:
+    """本地SQLite存储（idempotency_keys 表），多个工作进程打开同一个数据库文件即可共享
+
+    占用键是一条 upsert（键不存在或已过期时写入，租约 lease 秒）；保存响应时把有效期延长到 ttl 秒。
+    每 purge_every 次占用顺带删除过期的键。
+    """
+
+    def __init__(self, db, ttl=86400, purge_every=1000, lease=60):
+        self.db = db
+        self.ttl = ttl
+        self.lease = lease
+        self.purge_every = purge_every
+        self._lock = threading.Lock()
+        self._stats = {'new': 0, 'replayed': 0, 'in_progress': 0, 'mismatched': 0}
+
+    def begin(self, scope, fingerprint):
+        now = time.time()
+        claimed = self.db.fetchone(
+            'INSERT INTO idempotency_keys (scope, fingerprint, expires_at) VALUES (:scope, :fingerprint, :expires_at) '
+            'ON CONFLICT (scope) DO UPDATE SET fingerprint = excluded.fingerprint, status = NULL, body = NULL, '
+            'expires_at = excluded.expires_at WHERE idempotency_keys.expires_at <= :now '
+            'RETURNING 1',
+            {'scope': scope, 'fingerprint': fingerprint, 'expires_at': now + self.lease, 'now': now}
+        )
+        if claimed is not None:
+            with self._lock:
+                self._stats['new'] += 1
+                purge = self._stats['new'] % self.purge_every == 0
+            if purge:
+                self.db.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,))
+            return IDEMPOTENCY_NEW, None
+        row = self.db.fetchone('SELECT fingerprint, status, body FROM idempotency_keys WHERE scope = ?', (scope,))
+        if row is None:
+            # 刚被第一次请求释放，按处理中返回，客户端稍后重试
+            return self._count(IDEMPOTENCY_IN_PROGRESS, 'in_progress')
+        if row['fingerprint'] != fingerprint:
+            return self._count(IDEMPOTENCY_MISMATCH, 'mismatched')
+        if row['status'] is None:
+            return self._count(IDEMPOTENCY_IN_PROGRESS, 'in_progress')
+        return self._count(IDEMPOTENCY_REPLAY, 'replayed', (row['status'], bytes(row['body'])))
+
+    def complete(self, scope, fingerprint, status, body):
+        self.db.execute('UPDATE idempotency_keys SET status = ?, body = ?, expires_at = ? WHERE scope = ? AND fingerprint = ?',
+                        (status, body, time.time() + self.ttl, scope, fingerprint))
+
+    def release(self, scope):
+        self.db.execute('DELETE FROM idempotency_keys WHERE scope = ?', (scope,))
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'sqlite', **self._stats}
+
+    def _count(self, result, counter, response=None):
+        with self._lock:
+            self._stats[counter] += 1
+        return result, response
@@ -0,0 +1,221 @@
+"""
+邀请统计 - 按邀请人预先汇总的邀请统计（记录邀请时增量更新，可按批重建）
+"""
+
+import collections
+import threading
+from datetime import datetime, timezone
+
+# 达到该邀请人数即可领取免单
+DEFAULT_MAX_USES = 3
+# 邀请进度中保留的最近被邀请人数量（与 invite_stats_setup.sql 一致）
+MAX_LISTED_INVITATIONS = 50
+
+
+def mask_phone(phone_number):
+    """手机号脱敏：13800000001 -> 138****0001"""
+    if not phone_number or len(phone_number) < 7:
+        return phone_number
+    return f"{phone_number[:3]}****{phone_number[-4:]}"
+
+
+def format_invite_stats(summary):
+    """把汇总记录转换为 /get-user-invite-stats 的返回字段"""
+    return {
+        'user_invite_code': summary['user_invite_code'],
+        'current_uses': summary['current_uses'],
+        'max_uses': summary['max_uses'],
+        'remaining_uses': max(0, summary['max_uses'] - summary['current_uses']),
+        'eligible_for_free_drink': summary['eligible_for_free_drink'],
+        'free_drink_claimed': summary['free_drink_claimed'],
+    }
+
+
+def format_invite_progress(summary):
+    """把汇总记录转换为 /get-invite-progress 的返回字段"""
+    return {
+        'invitations': [
+            {'phone_number': entry['masked_phone'], 'masked_phone': entry['masked_phone'], 'invited_at': entry['invited_at']}
+            for entry in summary['invitations']
+        ],
+        'total_invitations': summary['current_uses'],
+    }
+
+
+class InviteSummaryRecord:
+    """开发模式的邀请汇总记录，最近的被邀请人保存为 (脱敏手机号, 邀请时间) 元组"""
+
+    __slots__ = ('user_id', 'user_invite_code', 'current_uses', 'max_uses', 'free_drink_claimed', 'invitations')
+
+    def __init__(self, user_id, user_invite_code, max_uses):
+        self.user_id = user_id
+        self.user_invite_code = user_invite_code
+        self.current_uses = 0
+        self.max_uses = max_uses
+        self.free_drink_claimed = False
+        self.invitations = collections.deque(maxlen=MAX_LISTED_INVITATIONS)
+
+    def apply(self, invitation):
+        self.current_uses += 1
+        # 最新的在前
+        self.invitations.appendleft((mask_phone(invitation['invitee_phone']), invitation['invited_at']))
+
+    def to_dict(self):
+        """与 user_invite_summaries 表的一行结构一致"""
+        return {
+            'user_id': self.user_id,
+            'user_invite_code': self.user_invite_code,
+            'current_uses': self.current_uses,
+            'max_uses': self.max_uses,
+            'eligible_for_free_drink': self.current_uses >= self.max_uses,
+            'free_drink_claimed': self.free_drink_claimed,
+            'invitations': [{'masked_phone': masked_phone, 'invited_at': invited_at} for masked_phone, invited_at in self.invitations],
+        }
+
+
+class MemoryInviteSummaryStore:
+    """开发模式的邀请统计
+
+    _invitations 相当于 invitations 表（原始记录），_summaries 相当于 user_invite_summaries 表（物化结果）。
+    记录邀请时在同一把锁内追加原始记录并增量更新邀请人的汇总，读取只是一次字典查找。
+    """
+
+    def __init__(self, max_uses=DEFAULT_MAX_USES):
+        self.max_uses = max_uses
+        self._lock = threading.Lock()
+        self._invitations = []
+        self._summaries = {}
+        self._codes = {}  # 用户邀请码 -> 邀请人ID
+        self._stats = {'reads': 0, 'misses': 0, 'incremental_updates': 0, 'rebuilt': 0}
+
+    def get(self, user_id):
+        """返回汇总记录（dict），用户没有邀请统计时返回None"""
+        with self._lock:
+            summary = self._summaries.get(user_id)
+            self._stats['reads'] += 1
+            if summary is None:
+                self._stats['misses'] += 1
+                return None
+            return summary.to_dict()
+
+    def ensure(self, user_id, user_invite_code):
+        """为用户建立空的汇总记录（已存在时不变）"""
+        with self._lock:
+            self._ensure(user_id, user_invite_code)
+
+    def owner_of(self, invite_code):
+        with self._lock:
+            return self._codes.get(invite_code)
+
+    def record_invitation(self, inviter_user_id, invitee_user_id, invitee_phone, invite_code, invited_at=None):
+        """记录一次邀请并增量更新邀请人的汇总"""
+        invitation = {
+            'inviter_user_id': inviter_user_id,
+            'invitee_user_id': invitee_user_id,
+            'invitee_phone': invitee_phone,
+            'invite_code': invite_code,
+            'invited_at': invited_at or datetime.now(timezone.utc).isoformat(),
+        }
+        with self._lock:
+            self._invitations.append(invitation)
+            self._ensure(inviter_user_id, invite_code).apply(invitation)
+            self._stats['incremental_updates'] += 1
+
+    def mark_claimed(self, user_id):
+        with self._lock:
+            summary = self._summaries.get(user_id)
+            if summary is not None:
+                summary.free_drink_claimed = True
+
+    def rebuild(self, batch_size=500):
+        """按邀请人ID顺序分批从原始邀请记录重新计算汇总，返回重建的邀请人数"""
+        with self._lock:
+            inviters = sorted({invitation['inviter_user_id'] for invitation in self._invitations})
+        rebuilt = 0
+        for start in range(0, len(inviters), batch_size):
+            batch = set(inviters[start:start + batch_size])
+            with self._lock:
+                fresh = {}
+                for invitation in self._invitations:
+                    if invitation['inviter_user_id'] in batch:
+                        user_id = invitation['inviter_user_id']
+                        if user_id not in fresh:
+                            old = self._summaries.get(user_id)
+                            fresh[user_id] = InviteSummaryRecord(user_id, old.user_invite_code if old else invitation['invite_code'], self.max_uses)
+                            fresh[user_id].free_drink_claimed = old.free_drink_claimed if old else False
+                        fresh[user_id].apply(invitation)
+                self._summaries.update(fresh)
+                self._stats['rebuilt'] += len(fresh)
+            rebuilt += len(fresh)
+        return rebuilt
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'summaries': len(self._summaries), 'invitations': len(self._invitations), **self._stats}
+
+    def _ensure(self, user_id, user_invite_code):
+        summary = self._summaries.get(user_id)
+        if summary is None:
+            summary = self._summaries[user_id] = InviteSummaryRecord(user_id, user_invite_code, self.max_uses)
+            self._codes[user_invite_code] = user_id
+        return summary
+
+
+class SupabaseInviteSummaryStore:
+    """生产模式的邀请统计，读取 user_invite_summaries 的一行；注册时由触发器建立空的统计，写入 invitations 后由触发器增量更新"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._stats = {'reads': 0, 'misses': 0}
+
+    def get(self, user_id):
+        with self.pool.connection() as supabase:
+            result = supabase.table('user_invite_summaries').select('*').eq('user_id', str(user_id)).execute()
+        with self._lock:
+            self._stats['reads'] += 1
+            if not result.data:
+                self._stats['misses'] += 1
+        return result.data[0] if result.data else None
+
+    def record_invitation(self, inviter_user_id, invitee_user_id, invitee_phone, invite_code, invited_at=None):
+        row = {
+            'inviter_user_id': str(inviter_user_id),
+            'invitee_user_id': str(invitee_user_id),
+            'invitee_phone': invitee_phone,
+            'invite_code': invite_code,
+        }
+        if invited_at:
+            row['invited_at'] = invited_at
+        with self.pool.connection() as supabase:
+            supabase.table('invitations').insert(row).execute()
+
+    def rebuild(self, batch_size=500):
+        """分批调用数据库函数 rebuild_invite_summaries，返回处理的批数"""
+        after = ''
+        batches = 0
+        while True:
+            with self.pool.connection() as supabase:
+                result = supabase.rpc('rebuild_invite_summaries', {'p_after_user_id': after, 'p_batch_size': batch_size}).execute()
+            if not result.data:
+                return batches
+            after = result.data
+            batches += 1
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'supabase', **self._stats}
+
+
+if __name__ == '__main__':
+    # 重建任务：python invite_stats.py [每批邀请人数]
+    import os
+    import sys
+    from dotenv import load_dotenv
+    from clients import create_supabase_pool
+
+    load_dotenv()
+    pool = create_supabase_pool(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"), size=1, timeout=60)
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"🔄 开始重建邀请统计（每批 {batch_size} 个邀请人）")
+    print(f"✅ 重建完成，共 {SupabaseInviteSummaryStore(pool).rebuild(batch_size)} 批")
@@ -0,0 +1,170 @@
+-- 邀请统计物化表（Supabase/PostgreSQL）
+-- 每个邀请人一行预先汇总好的邀请统计，/get-user-invite-stats 和 /get-invite-progress 只需按用户ID读一行
+-- 记录邀请时由触发器增量更新，rebuild_invite_summaries 可按批从 invitations 表重新计算
+
+-- 用户邀请码和邀请关系（与D1迁移002一致）
+ALTER TABLE users ADD COLUMN IF NOT EXISTS user_invite_code VARCHAR(50) UNIQUE;
+ALTER TABLE invite_codes ADD COLUMN IF NOT EXISTS invite_type VARCHAR(20) DEFAULT 'activity';
+ALTER TABLE invite_codes ADD COLUMN IF NOT EXISTS max_uses INTEGER DEFAULT 1;
+ALTER TABLE invite_codes ADD COLUMN IF NOT EXISTS current_uses INTEGER DEFAULT 0;
+ALTER TABLE invite_codes ADD COLUMN IF NOT EXISTS owner_user_id VARCHAR(50);
+
+CREATE TABLE IF NOT EXISTS invitations (
+    id SERIAL PRIMARY KEY,
+    inviter_user_id VARCHAR(50) NOT NULL,
+    invitee_user_id VARCHAR(50) NOT NULL,
+    invite_code VARCHAR(50) NOT NULL,
+    invited_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    invitee_phone VARCHAR(20) NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_invitations_inviter ON invitations(inviter_user_id, invited_at);
+
+-- 物化的邀请统计，invitations 只保留最近 50 条脱敏后的被邀请人
+CREATE TABLE IF NOT EXISTS user_invite_summaries (
+    user_id VARCHAR(50) PRIMARY KEY,
+    user_invite_code VARCHAR(50),
+    current_uses INTEGER NOT NULL DEFAULT 0,
+    max_uses INTEGER NOT NULL DEFAULT 3,
+    eligible_for_free_drink BOOLEAN NOT NULL DEFAULT FALSE,
+    free_drink_claimed BOOLEAN NOT NULL DEFAULT FALSE,
+    invitations JSONB NOT NULL DEFAULT '[]'::JSONB,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 手机号脱敏：138****0001
+CREATE OR REPLACE FUNCTION mask_phone(p_phone VARCHAR)
+RETURNS VARCHAR AS $$
+    SELECT CASE WHEN length(p_phone) >= 7
+        THEN left(p_phone, 3) || '****' || right(p_phone, 4)
+        ELSE p_phone END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- 记录邀请后增量更新邀请人的统计；达到邀请上限时标记免单资格
+CREATE OR REPLACE FUNCTION apply_invitation_to_summary()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_entry JSONB := jsonb_build_object('masked_phone', mask_phone(NEW.invitee_phone), 'invited_at', NEW.invited_at);
+BEGIN
+    INSERT INTO user_invite_summaries (user_id, user_invite_code, current_uses, invitations)
+    VALUES (
+        NEW.inviter_user_id,
+        (SELECT user_invite_code FROM users WHERE id::TEXT = NEW.inviter_user_id),
+        1,
+        jsonb_build_array(v_entry)
+    )
+    ON CONFLICT (user_id) DO UPDATE SET
+        current_uses = user_invite_summaries.current_uses + 1,
+        eligible_for_free_drink = user_invite_summaries.current_uses + 1 >= user_invite_summaries.max_uses,
+        -- 最新的在前，只保留50条
+        invitations = (SELECT jsonb_agg(t.e ORDER BY t.n)
+                       FROM jsonb_array_elements(jsonb_build_array(v_entry) || user_invite_summaries.invitations)
+                            WITH ORDINALITY AS t(e, n)
+                       WHERE t.n <= 50),
+        updated_at = NOW();
+
+    UPDATE users SET free_drink_eligible = TRUE
+    WHERE id::TEXT = NEW.inviter_user_id
+      AND (SELECT eligible_for_free_drink FROM user_invite_summaries WHERE user_id = NEW.inviter_user_id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_invitations_summary ON invitations;
+CREATE TRIGGER trg_invitations_summary
+AFTER INSERT ON invitations
+FOR EACH ROW EXECUTE FUNCTION apply_invitation_to_summary();
+
+-- 注册时为新用户建立空的邀请统计，还没有邀请任何人的用户也能读到自己的邀请码和进度
+CREATE OR REPLACE FUNCTION create_empty_invite_summary()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.user_invite_code IS NOT NULL THEN
+        INSERT INTO user_invite_summaries (user_id, user_invite_code)
+        VALUES (NEW.id::TEXT, NEW.user_invite_code)
+        ON CONFLICT (user_id) DO UPDATE SET user_invite_code = EXCLUDED.user_invite_code, updated_at = NOW();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_invite_summary ON users;
+CREATE TRIGGER trg_users_invite_summary
+AFTER INSERT OR UPDATE OF user_invite_code ON users
+FOR EACH ROW EXECUTE FUNCTION create_empty_invite_summary();
+
+-- 补齐已注册但还没有邀请统计的用户
+INSERT INTO user_invite_summaries (user_id, user_invite_code)
+SELECT id::TEXT, user_invite_code FROM users WHERE user_invite_code IS NOT NULL
+ON CONFLICT (user_id) DO NOTHING;
+
+-- 领取免单后同步领取状态
+CREATE OR REPLACE FUNCTION apply_free_drink_claim_to_summary()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_invite_summaries SET free_drink_claimed = TRUE, updated_at = NOW() WHERE user_id = NEW.user_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_user_free_drinks_summary ON user_free_drinks;
+CREATE TRIGGER trg_user_free_drinks_summary
+AFTER INSERT ON user_free_drinks
+FOR EACH ROW EXECUTE FUNCTION apply_free_drink_claim_to_summary();
+
+-- 按邀请人ID顺序重新计算一批邀请统计，返回本批最后一个邀请人ID，没有更多邀请人时返回NULL
+-- 调用方从 p_after_user_id = '' 开始，把返回值作为下一批的起点，直到返回NULL
+CREATE OR REPLACE FUNCTION rebuild_invite_summaries(p_after_user_id VARCHAR DEFAULT '', p_batch_size INTEGER DEFAULT 500)
+RETURNS VARCHAR AS $$
+DECLARE
+    v_last VARCHAR;
+BEGIN
+    SELECT MAX(inviter_user_id) INTO v_last FROM (
+        SELECT DISTINCT inviter_user_id FROM invitations
+        WHERE inviter_user_id > p_after_user_id
+        ORDER BY inviter_user_id
+        LIMIT p_batch_size
+    ) AS batch;
+
+    IF v_last IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO user_invite_summaries AS s
+        (user_id, user_invite_code, current_uses, eligible_for_free_drink, free_drink_claimed, invitations, updated_at)
+    SELECT
+        b.user_id,
+        u.user_invite_code,
+        agg.current_uses,
+        agg.current_uses >= 3,
+        EXISTS (SELECT 1 FROM user_free_drinks f WHERE f.user_id = b.user_id),
+        agg.invitations,
+        NOW()
+    FROM (
+        SELECT DISTINCT inviter_user_id AS user_id FROM invitations
+        WHERE inviter_user_id > p_after_user_id AND inviter_user_id <= v_last
+    ) AS b
+    LEFT JOIN users u ON u.id::TEXT = b.user_id
+    CROSS JOIN LATERAL (
+        SELECT
+            (SELECT COUNT(*) FROM invitations i WHERE i.inviter_user_id = b.user_id)::INTEGER AS current_uses,
+            (SELECT COALESCE(jsonb_agg(jsonb_build_object('masked_phone', mask_phone(l.invitee_phone), 'invited_at', l.invited_at)
+                                      ORDER BY l.invited_at DESC), '[]'::JSONB)
+             FROM (SELECT invitee_phone, invited_at FROM invitations i
+                   WHERE i.inviter_user_id = b.user_id ORDER BY invited_at DESC LIMIT 50) AS l) AS invitations
+    ) AS agg
+    ON CONFLICT (user_id) DO UPDATE SET
+        user_invite_code = EXCLUDED.user_invite_code,
+        current_uses = EXCLUDED.current_uses,
+        eligible_for_free_drink = EXCLUDED.current_uses >= s.max_uses,
+        free_drink_claimed = EXCLUDED.free_drink_claimed,
+        invitations = EXCLUDED.invitations,
+        updated_at = NOW();
+
+    UPDATE users SET free_drink_eligible = TRUE
+    FROM user_invite_summaries s
+    WHERE s.user_id = users.id::TEXT AND s.eligible_for_free_drink
+      AND s.user_id > p_after_user_id AND s.user_id <= v_last;
+
+    RETURN v_last;
+END;
+$$ LANGUAGE plpgsql;
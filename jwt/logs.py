@@ -0,0 +1,141 @@
+"""
+日志 - 结构化日志、后台线程写出和采样
+
+请求线程只把日志记录放入有界队列，格式化和写出都在后台线程完成，
+队列满时直接丢弃并计数，不会阻塞请求。低于 WARNING 的日志可按比例采样，
+LOG_LEVEL=WARNING 可以整体关闭热点路径上的常规日志。
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# 结构化字段通过 extra={...} 传入，这些是 LogRecord 自带的属性，不作为字段输出
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行JSON，附带 extra 中的结构化字段"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """便于本地阅读的单行文本，结构化字段追加在消息后面"""
+
+    def format(self, record):
+        fields = ' '.join(f"{key}={value}" for key, value in record.__dict__.items() if key not in _RECORD_ATTRS)
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname[0]} {record.getMessage()}"
+        line = f"{line} {fields}" if fields else line
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """按 rate 比例保留低于 WARNING 的日志，WARNING 及以上全部保留"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列的日志处理器
+
+    与标准 QueueHandler 不同，不在请求线程中格式化消息（留给后台线程），
+    队列满时丢弃日志并计数，而不是阻塞或打印异常。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=None, sample_rate=None, fmt=None, queue_size=None, stream=None):
+    """配置 omnilaze 日志（重复调用无效），参数缺省时从环境变量 LOG_LEVEL/LOG_SAMPLE_RATE/LOG_FORMAT/LOG_QUEUE_SIZE 读取"""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return
+        level = level or os.getenv("LOG_LEVEL", "INFO")
+        sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "1.0") if sample_rate is None else sample_rate)
+        fmt = fmt or os.getenv("LOG_FORMAT", "text")
+        queue_size = queue_size or int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+        _handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        _handler.addFilter(SamplingFilter(sample_rate))
+        root = logging.getLogger('omnilaze')
+        root.setLevel(level.upper())
+        root.addHandler(_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(_handler.queue, output)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger('omnilaze').removeHandler(_handler)
+        _listener = None
+        _handler = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"omnilaze.{name}")
+
+
+def stats():
+    with _lock:
+        if _handler is None:
+            return {'configured': False}
+        return {
+            'configured': True,
+            'level': logging.getLevelName(logging.getLogger('omnilaze').level),
+            'queued': _handler.queue.qsize(),
+            'dropped': _handler.dropped,
+        }
@@ -0,0 +1,162 @@
+"""
+性能指标 - 请求延迟直方图和Prometheus文本格式导出
+"""
+
+import bisect
+import threading
+
+# 延迟分桶上界（毫秒），最后一个桶收集所有更慢的请求
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """线程安全的固定分桶延迟直方图"""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets_ms) + 1)
+        self._count = 0
+        self._sum_ms = 0.0
+
+    def observe(self, elapsed_ms):
+        index = bisect.bisect_left(self.buckets_ms, elapsed_ms)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum_ms += elapsed_ms
+
+    def quantile(self, q):
+        """按分桶估算分位数，返回所在桶的上界（毫秒），超出最大分桶时返回字符串 +Inf"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets_ms[index] if index < len(self.buckets_ms) else "+Inf"
+        return "+Inf"
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            sum_ms = self._sum_ms
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets_ms, counts)}
+        buckets["le_inf"] = counts[-1]
+        return {
+            "count": total,
+            "avg_ms": round(sum_ms / total, 3) if total else None,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+    def prometheus_lines(self, name, labels=''):
+        """按Prometheus直方图格式输出（累计分桶，单位秒），labels 为已格式化的标签串"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            sum_ms = self._sum_ms
+        prefix = f"{labels}," if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets_ms, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound / 1000:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {total}')
+        suffix = f"{{{labels}}}" if labels else ''
+        lines.append(f"{name}_sum{suffix} {sum_ms / 1000:.6f}")
+        lines.append(f"{name}_count{suffix} {total}")
+        return lines
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    return ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+
+
+class HistogramFamily:
+    """按标签值分组的一组延迟直方图"""
+
+    def __init__(self, name, help_text, label_names, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets_ms = buckets_ms
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, elapsed_ms, *label_values):
+        histogram = self._histograms.get(label_values)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(label_values, LatencyHistogram(self.buckets_ms))
+        histogram.observe(elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self._histograms.items())
+        return {' '.join(map(str, values)): histogram.snapshot() for values, histogram in items}
+
+    def prometheus_lines(self):
+        with self._lock:
+            items = sorted(self._histograms.items(), key=lambda item: tuple(map(str, item[0])))
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for values, histogram in items:
+            lines.extend(histogram.prometheus_lines(self.name, format_labels(self.label_names, values)))
+        return lines
+
+
+class MetricsRegistry:
+    """汇总直方图和按需读取的仪表，导出为Prometheus文本格式"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = []
+        self._gauges = []
+
+    def histogram(self, name, help_text, label_names, buckets_ms=DEFAULT_BUCKETS_MS):
+        family = HistogramFamily(name, help_text, label_names, buckets_ms)
+        with self._lock:
+            self._histograms.append(family)
+        return family
+
+    def gauge(self, name, help_text, read):
+        """注册仪表，导出时调用 read() 取当前值"""
+        with self._lock:
+            self._gauges.append((name, help_text, read))
+
+    def render(self):
+        with self._lock:
+            histograms = list(self._histograms)
+            gauges = list(self._gauges)
+        lines = []
+        for family in histograms:
+            lines.extend(family.prometheus_lines())
+        for name, help_text, read in gauges:
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共享的指标：接口耗时、Supabase调用耗时、短信网关调用耗时
+REGISTRY = MetricsRegistry()
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'omnilaze_http_request_duration_seconds', '接口处理耗时', ('method', 'route', 'status'))
+SUPABASE_CALL_DURATION = REGISTRY.histogram(
+    'omnilaze_supabase_call_duration_seconds', 'Supabase(PostgREST)请求耗时', ('operation', 'status'))
+SMS_CALL_DURATION = REGISTRY.histogram(
+    'omnilaze_sms_call_duration_seconds', '短信网关请求耗时', ('status',))
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
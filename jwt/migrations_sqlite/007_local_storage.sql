@@ -0,0 +1,39 @@
+-- 本地存储补充迁移 - 验证码表和订单计数器
+-- 执行时间: 2026-10-18
+
+-- 验证码表：每个手机号只保留最新的验证码，验证成功后删除
+CREATE TABLE IF NOT EXISTS verification_codes (
+    phone_number TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    expires_at REAL NOT NULL, -- 过期时间（Unix时间戳，秒）
+    created_at TEXT DEFAULT (datetime('now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_verification_codes_expires_at ON verification_codes(expires_at);
+
+-- 订单号计数器：每天一行，服务进程一次预留一段连续序号（与 jwt/order_numbers_setup.sql 一致）
+CREATE TABLE IF NOT EXISTS order_number_counters (
+    order_day TEXT PRIMARY KEY, -- YYYYMMDD
+    last_value INTEGER NOT NULL -- 当天已分配出去的最大序号
+);
+
+INSERT OR IGNORE INTO order_number_counters (order_day, last_value)
+SELECT substr(order_number, 4, 8), MAX(CAST(substr(order_number, 12) AS INTEGER))
+FROM orders
+WHERE order_number GLOB 'ORD[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]*'
+GROUP BY substr(order_number, 4, 8);
+
+-- 用户订单序号计数器：用户ID -> 已分配的最大订单序号
+CREATE TABLE IF NOT EXISTS user_order_counters (
+    user_id TEXT PRIMARY KEY,
+    last_value INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO user_order_counters (user_id, last_value)
+SELECT user_id, MAX(user_sequence_number)
+FROM orders
+WHERE user_sequence_number IS NOT NULL
+GROUP BY user_id;
+
+-- 按用户分页查询订单（created_at, id 倒序）
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at DESC, id DESC);
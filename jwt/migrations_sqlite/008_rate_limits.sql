@@ -0,0 +1,10 @@
+-- 请求限流状态（本地SQLite存储，见 jwt/rate_limit.py）
+-- 执行时间: 2026-10-18
+
+-- 每个限流键一行：GCRA理论到达时间（Unix时间戳，秒），早于当前时间的行可以删除
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    tat REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_rate_limits_tat ON rate_limits(tat);
@@ -0,0 +1,13 @@
+-- 幂等请求记录（本地SQLite存储，见 jwt/idempotency.py）
+-- 执行时间: 2026-10-18
+
+-- 每个 (路由, Idempotency-Key) 一行：请求内容摘要和第一次的响应，status 为空表示处理中
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status INTEGER,
+    body BLOB,
+    expires_at REAL NOT NULL -- 过期时间（Unix时间戳，秒）
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
@@ -0,0 +1,8 @@
+-- 免单名额初始化记录（本地SQLite存储，见 jwt/sqlite_backend.py 的 SQLiteQuota）
+-- 执行时间: 2026-10-18
+
+-- 服务启动时只在本表没有记录时写入 FREE_DRINK_TOTAL，之后重启不再覆盖 total_quota
+CREATE TABLE IF NOT EXISTS free_drink_quota_seed (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seeded_at TEXT DEFAULT (datetime('now'))
+);
@@ -0,0 +1,100 @@
+"""
+订单号分配 - 每个服务进程预留一段当天的连续序号，在进程内依次发放
+
+订单号格式为 ORD + 日期(YYYYMMDD) + 至少3位序号。序号段由 reserve(day, count) 预留：
+开发模式为进程内按日计数器，生产模式为数据库函数 reserve_order_numbers（单行 upsert，
+见 order_numbers_setup.sql）。不同进程拿到的序号段互不重叠，因此订单号全局唯一；
+进程退出时未用完的序号会留下空号。
+"""
+
+import threading
+from datetime import datetime
+
+
+def format_order_number(day, sequence):
+    return f"ORD{day}{sequence:03d}"
+
+
+def order_day():
+    return datetime.now().strftime('%Y%m%d')
+
+
+class OrderNumberAllocator:
+    """线程安全的订单号分配器，当前序号段用完或日期变化时才调用 reserve"""
+
+    def __init__(self, reserve, block_size=50):
+        self.reserve = reserve  # (日期, 个数) -> 预留序号段的第一个序号
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._day = None
+        self._next = 0
+        self._end = 0
+        self._stats = {'allocated': 0, 'blocks': 0}
+
+    def next(self):
+        return self.allocate(1)[0]
+
+    def allocate(self, count):
+        """分配 count 个订单号，同一次调用内的订单号按序号递增"""
+        day = order_day()
+        numbers = []
+        with self._lock:
+            while True:
+                self._take(day, count, numbers)
+                if len(numbers) == count:
+                    return numbers
+                size = max(self.block_size, count - len(numbers))
+                self._refill(day, self.reserve(day, size), size)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'block_size': self.block_size, 'day': self._day, 'block_remaining': self._end - self._next}
+
+    def _take(self, day, count, numbers):
+        if self._day != day:
+            return
+        take = min(count - len(numbers), self._end - self._next)
+        numbers.extend(format_order_number(day, sequence) for sequence in range(self._next, self._next + take))
+        self._next += take
+        self._stats['allocated'] += take
+
+    def _refill(self, day, first, size):
+        self._day, self._next, self._end = day, first, first + size
+        self._stats['blocks'] += 1
+
+
+class AsyncOrderNumberAllocator(OrderNumberAllocator):
+    """ASGI模式的订单号分配器，reserve 为协程函数"""
+
+    def __init__(self, reserve, block_size=50):
+        super().__init__(reserve, block_size)
+        self._async_lock = None
+
+    async def next(self):
+        return (await self.allocate(1))[0]
+
+    async def allocate(self, count):
+        if self._async_lock is None:
+            # 只有ASGI模式用到asyncio，同步服务导入本模块时不必加载
+            import asyncio
+            self._async_lock = asyncio.Lock()
+        day = order_day()
+        numbers = []
+        async with self._async_lock:
+            while True:
+                with self._lock:
+                    self._take(day, count, numbers)
+                if len(numbers) == count:
+                    return numbers
+                size = max(self.block_size, count - len(numbers))
+                first = await self.reserve(day, size)
+                with self._lock:
+                    self._refill(day, first, size)
+
+
+def supabase_reserver(pool):
+    """生产模式：通过数据库函数 reserve_order_numbers 预留序号段"""
+    def reserve(day, count):
+        with pool.connection() as supabase:
+            return supabase.rpc('reserve_order_numbers', {'p_day': day, 'p_count': count}).execute().data
+    return reserve
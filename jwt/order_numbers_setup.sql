@@ -0,0 +1,35 @@
+-- 订单号分配（Supabase/PostgreSQL）
+-- 每天一行计数器，各服务进程一次预留一段连续序号（见 order_numbers.py），不再按天 COUNT(*) 扫描订单表
+
+CREATE TABLE IF NOT EXISTS order_number_counters (
+    order_day VARCHAR(8) PRIMARY KEY,  -- YYYYMMDD
+    last_value INTEGER NOT NULL        -- 当天已分配出去的最大序号
+);
+
+-- 用已有订单初始化计数器（迁移时执行一次），之后分配的序号不会与已有订单号重复
+INSERT INTO order_number_counters (order_day, last_value)
+SELECT substr(order_number, 4, 8), MAX(substr(order_number, 12)::INTEGER)
+FROM orders
+WHERE order_number ~ '^ORD[0-9]{11,}$'
+GROUP BY substr(order_number, 4, 8)
+ON CONFLICT (order_day) DO UPDATE SET last_value = GREATEST(order_number_counters.last_value, EXCLUDED.last_value);
+
+-- 预留 p_day 当天接下来的 p_count 个序号，返回其中第一个
+-- 单行 upsert：并发预留在该行上依次执行，各自拿到互不重叠的区间
+CREATE OR REPLACE FUNCTION reserve_order_numbers(p_day VARCHAR, p_count INTEGER DEFAULT 1)
+RETURNS INTEGER AS $$
+    INSERT INTO order_number_counters (order_day, last_value) VALUES (p_day, p_count)
+    ON CONFLICT (order_day) DO UPDATE SET last_value = order_number_counters.last_value + p_count
+    RETURNING last_value - p_count + 1;
+$$ LANGUAGE sql;
+
+-- 订单号: ORD + 日期 + 至少3位序号（插入时未指定订单号的兜底，由 trigger_set_order_number 调用）
+CREATE OR REPLACE FUNCTION generate_order_number()
+RETURNS VARCHAR(50) AS $$
+DECLARE
+    v_day TEXT := TO_CHAR(CURRENT_DATE, 'YYYYMMDD');
+    v_sequence TEXT := reserve_order_numbers(v_day, 1)::TEXT;
+BEGIN
+    RETURN 'ORD' || v_day || LPAD(v_sequence, GREATEST(3, length(v_sequence)), '0');
+END;
+$$ LANGUAGE plpgsql;
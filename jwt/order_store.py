@@ -0,0 +1,113 @@
+"""
+开发模式订单仓库 - 带索引的内存订单存储
+"""
+
+import bisect
+import threading
+from collections import defaultdict
+
+
+class OrderStore:
+    """内存订单仓库
+
+    维护按日订单计数、用户订单序号计数和用户订单索引，
+    生成订单号、分配用户序号、创建订单都是O(1)操作。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._daily_counts = defaultdict(int)    # 日期 -> 当天已分配的订单数
+        self._user_sequences = defaultdict(int)  # 用户ID -> 已分配的最大订单序号
+        self._user_orders = defaultdict(list)    # 用户ID -> [(created_at, 订单ID)]，按升序排列
+
+    def next_daily_count(self, day, count=1):
+        """分配指定日期接下来的 count 个订单计数，返回其中第一个"""
+        with self._lock:
+            self._daily_counts[day] += count
+            return self._daily_counts[day] - count + 1
+
+    def next_user_sequence(self, user_id, count=1):
+        """分配用户接下来的 count 个订单序号，返回其中第一个"""
+        with self._lock:
+            self._user_sequences[user_id] += count
+            return self._user_sequences[user_id] - count + 1
+
+    def add(self, order):
+        """保存订单并更新用户索引"""
+        with self._lock:
+            self._orders[order['id']] = order
+            # 新订单通常是最新的，insort基本只在末尾追加
+            bisect.insort(self._user_orders[order['user_id']], (order['created_at'], order['id']))
+
+    def add_many(self, orders):
+        """一次加锁保存多个订单"""
+        with self._lock:
+            for order in orders:
+                self._orders[order['id']] = order
+                bisect.insort(self._user_orders[order['user_id']], (order['created_at'], order['id']))
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def update(self, order_id, fields):
+        """更新订单字段，返回更新后的订单，订单不存在时返回None"""
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is not None:
+                order.update(fields)
+            return order
+
+    def update_many(self, order_ids, fields):
+        """一次加锁更新多个订单，返回 订单ID -> 更新后的订单（不存在的订单不在结果中）"""
+        updated = {}
+        with self._lock:
+            for order_id in order_ids:
+                order = self._orders.get(order_id)
+                if order is not None:
+                    order.update(fields)
+                    updated[order_id] = order
+        return updated
+
+    def apply_updates(self, updates):
+        """一次加锁按订单更新不同的字段，updates 为 订单ID -> 字段，返回 订单ID -> 更新后的订单"""
+        updated = {}
+        with self._lock:
+            for order_id, fields in updates.items():
+                order = self._orders.get(order_id)
+                if order is not None:
+                    order.update(fields)
+                    updated[order_id] = order
+        return updated
+
+    def page_by_user(self, user_id, limit, before=None):
+        """按(created_at, id)倒序分页返回用户的订单
+
+        before为上一页最后一条订单的(created_at, id)，返回(订单列表, 是否还有更多)。
+        只遍历本页需要的订单，与用户订单总数无关。
+        """
+        orders = []
+        with self._lock:
+            keys = self._user_orders.get(user_id, [])
+            index = bisect.bisect_left(keys, tuple(before)) if before else len(keys)
+            while index > 0:
+                index -= 1
+                order = self._orders[keys[index][1]]
+                if order.get('is_deleted', False):
+                    continue
+                if len(orders) == limit:
+                    return orders, True
+                orders.append(order)
+        return orders, False
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def __getitem__(self, order_id):
+        return self._orders[order_id]
+
+    def __len__(self):
+        return len(self._orders)
+
+    def values(self):
+        return self._orders.values()
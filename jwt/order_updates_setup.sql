@@ -0,0 +1,21 @@
+-- 批量更新订单（Supabase/PostgreSQL）
+-- 写后缓冲（见 write_behind.py）合并后的订单更新一次调用写入
+
+-- p_updates 为更新记录数组，每条包含订单 id 和要更新的字段（字段与 orders 表一致，未包含的字段保持不变），
+-- 返回更新后的订单；不存在的订单不在结果中
+CREATE OR REPLACE FUNCTION apply_order_updates(p_updates JSONB)
+RETURNS SETOF orders AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE orders AS o SET
+        status = COALESCE(u.status, o.status),
+        submitted_at = COALESCE(u.submitted_at, o.submitted_at),
+        user_rating = COALESCE(u.user_rating, o.user_rating),
+        user_feedback = COALESCE(u.user_feedback, o.user_feedback),
+        feedback_submitted_at = COALESCE(u.feedback_submitted_at, o.feedback_submitted_at),
+        updated_at = COALESCE(u.updated_at, NOW())
+    FROM jsonb_populate_recordset(NULL::orders, p_updates) AS u
+    WHERE o.id = u.id
+    RETURNING o.*;
+END;
+$$ LANGUAGE plpgsql;
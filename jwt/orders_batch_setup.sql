@@ -0,0 +1,31 @@
+-- 批量创建订单（Supabase/PostgreSQL）
+-- 一次调用为整批订单分配用户序号，并用一条多行 INSERT 写入
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS user_sequence_number INTEGER;
+CREATE INDEX IF NOT EXISTS idx_orders_user_sequence ON orders(user_id, user_sequence_number);
+
+-- p_orders 为订单记录数组（字段与 orders 表一致，order_number 由服务进程预先分配，user_sequence_number 为空），
+-- 返回写入后的订单；未指定订单号的由 generate_order_number 兜底（见 order_numbers_setup.sql）
+CREATE OR REPLACE FUNCTION create_orders_batch(p_orders JSONB)
+RETURNS SETOF orders AS $$
+BEGIN
+    RETURN QUERY
+    INSERT INTO orders (
+        order_number, user_id, phone_number, status, order_date, created_at, submitted_at,
+        delivery_address, dietary_restrictions, food_preferences, budget_amount, budget_currency,
+        user_sequence_number, is_deleted
+    )
+    SELECT
+        COALESCE(o.order_number, generate_order_number()),
+        o.user_id, o.phone_number, o.status, o.order_date, o.created_at, o.submitted_at,
+        o.delivery_address, o.dietary_restrictions, o.food_preferences, o.budget_amount, o.budget_currency,
+        COALESCE(s.max_sequence, 0) + ROW_NUMBER() OVER (PARTITION BY o.user_id ORDER BY o.ordinality),
+        FALSE
+    FROM jsonb_populate_recordset(NULL::orders, p_orders) WITH ORDINALITY AS o
+    LEFT JOIN LATERAL (
+        SELECT MAX(user_sequence_number) AS max_sequence FROM orders WHERE orders.user_id = o.user_id
+    ) AS s ON TRUE
+    ORDER BY o.ordinality
+    RETURNING *;
+END;
+$$ LANGUAGE plpgsql;
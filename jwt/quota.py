@@ -0,0 +1,76 @@
+"""
+免单名额 - 进程内原子计数器和数据库分片令牌桶
+"""
+
+import itertools
+import random
+
+# 领取结果
+CLAIM_OK = 'ok'
+CLAIM_ALREADY_CLAIMED = 'already_claimed'
+CLAIM_SOLD_OUT = 'sold_out'
+CLAIM_NOT_ELIGIBLE = 'not_eligible'
+
+
+class QuotaCounter:
+    """开发模式的免单名额计数器
+
+    不加锁：按用户去重用 dict.setdefault，发放名额用 itertools.count 取号，
+    两者在CPython中都是原子操作。取到的号小于总名额才算领取成功，
+    因此并发领取时成功数永远不会超过总名额。
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self._tickets = itertools.count()
+        self._claims = {}    # 用户ID -> 领取凭据
+        self._granted = []   # 成功领取的用户ID，长度即已发放名额
+
+    def try_claim(self, user_id):
+        """尝试为用户领取一个名额，返回 CLAIM_* 结果"""
+        marker = object()
+        if self._claims.setdefault(user_id, marker) is not marker:
+            return CLAIM_ALREADY_CLAIMED
+        if next(self._tickets) >= self.total:
+            # 名额已发完，撤销占位，让用户之后还能看到"名额已用完"而不是"已领取"
+            self._claims.pop(user_id, None)
+            return CLAIM_SOLD_OUT
+        self._granted.append(user_id)
+        return CLAIM_OK
+
+    def has_claimed(self, user_id):
+        return user_id in self._claims
+
+    def remaining(self):
+        return max(0, self.total - len(self._granted))
+
+    def stats(self):
+        return {'backend': 'memory', 'total': self.total, 'granted': len(self._granted), 'remaining': self.remaining()}
+
+
+class ShardedSupabaseQuota:
+    """生产模式的免单名额
+
+    总名额预先分到 free_drink_quota_shards 的多行中，每次领取随机选一个分片起步，
+    由数据库函数 claim_free_drink 扣减，避免所有请求争抢 free_drink_config 的同一行。
+    """
+
+    def __init__(self, pool, shard_count=16):
+        self.pool = pool
+        self.shard_count = shard_count
+
+    def try_claim(self, user_id):
+        with self.pool.connection() as supabase:
+            result = supabase.rpc('claim_free_drink', {
+                'p_user_id': str(user_id),
+                'p_shard': random.randrange(self.shard_count)
+            }).execute()
+        return result.data
+
+    def remaining(self):
+        with self.pool.connection() as supabase:
+            result = supabase.rpc('free_drinks_remaining', {}).execute()
+        return result.data or 0
+
+    def stats(self):
+        return {'backend': 'supabase', 'shards': self.shard_count}
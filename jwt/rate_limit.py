@@ -0,0 +1,170 @@
+"""
+请求限流 - 按手机号和客户端IP限制发送验证码和验证码登录的频率
+
+采用GCRA（通用信元速率算法）：每个键只保存一个"理论到达时间"(TAT)，
+limit/period 的规则允许一次突发 limit 个请求，之后每 period/limit 秒恢复一个。
+存储可替换：进程内存储（单进程），或本地SQLite存储（同一台机器上的多个工作进程共享）。
+一次请求的多条规则（手机号、IP）先全部检查，都通过才一起计数，被任一规则拒绝的请求不消耗其他规则的额度。
+限流检查在调用Supabase和短信网关之前完成。
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+# 被限流的请求：规则名、需等待的秒数
+Rejection = namedtuple('Rejection', ['rule', 'retry_after'])
+
+RATE_LIMIT_MESSAGE = "请求过于频繁，请稍后再试"
+
+
+class RateLimit:
+    """限流规则：period 秒内最多 limit 个请求"""
+
+    __slots__ = ('name', 'limit', 'period', 'interval')
+
+    def __init__(self, name, limit, period):
+        if limit < 1 or period <= 0:
+            raise ValueError(f"限流规则 {name} 无效: {limit}/{period}")
+        self.name = name
+        self.limit = limit
+        self.period = float(period)
+        self.interval = self.period / limit
+
+    @classmethod
+    def parse(cls, name, spec):
+        """解析 "次数/秒数" 格式的规则，如 "5/3600" """
+        limit, _, period = spec.partition('/')
+        return cls(name, int(limit), float(period))
+
+    def __str__(self):
+        return f"{self.limit}/{self.period:g}"
+
+
+class MemoryRateLimitStore:
+    """进程内存储：键 -> TAT（单调时钟）
+
+    超过 max_entries 时先清理已恢复满额的键（TAT已过去），仍超过则淘汰最早写入的键。
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._tats = {}
+
+    def hit(self, checks):
+        """checks 为 [(键, interval, period)]：全部允许时一起计数并返回 (None, 0)，
+        否则都不计数，返回 (第一个拒绝的序号, 需等待的秒数)"""
+        now = time.monotonic()
+        with self._lock:
+            tats = []
+            for index, (key, interval, period) in enumerate(checks):
+                tat = max(self._tats.get(key, now), now) + interval
+                if tat - now > period:
+                    return index, tat - period - now
+                tats.append(tat)
+            for (key, _, _), tat in zip(checks, tats):
+                self._tats[key] = tat
+            if len(self._tats) > self.max_entries:
+                self._evict(now)
+        return None, 0.0
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'keys': len(self._tats)}
+
+    def _evict(self, now):
+        for key in [key for key, tat in self._tats.items() if tat <= now]:
+            del self._tats[key]
+        while len(self._tats) > self.max_entries:
+            del self._tats[next(iter(self._tats))]
+
+
+class SQLiteRateLimitStore:
+    """本地SQLite存储（rate_limits 表），多个工作进程打开同一个数据库文件即可共享限流状态
+
+    一次检查在一个写事务中读取各键的TAT、全部允许时再一起写入；每 purge_every 次写入顺带删除已恢复满额的键。
+    """
+
+    def __init__(self, db, purge_every=1000):
+        self.db = db
+        self.purge_every = purge_every
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def hit(self, checks):
+        now = time.time()
+        with self.db.transaction() as conn:
+            tats = []
+            for index, (key, interval, period) in enumerate(checks):
+                row = conn.execute('SELECT tat FROM rate_limits WHERE key = ?', (key,)).fetchone()
+                tat = max(row[0] if row is not None else now, now) + interval
+                if tat - now > period:
+                    return index, tat - period - now
+                tats.append((key, tat))
+            conn.executemany('INSERT INTO rate_limits (key, tat) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET tat = excluded.tat', tats)
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if purge:
+            self.db.execute('DELETE FROM rate_limits WHERE tat <= ?', (now,))
+        return None, 0.0
+
+    def stats(self):
+        return {'backend': 'sqlite', 'keys': self.db.fetchone('SELECT COUNT(*) FROM rate_limits')[0]}
+
+
+class RateLimiter:
+    """按规则名和键限流，enabled 为 False 时全部放行"""
+
+    def __init__(self, store, rules, enabled=True):
+        self.store = store
+        self.rules = {rule.name: rule for rule in rules}
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {'allowed': 0, 'rejected': 0}
+
+    def check(self, *checks):
+        """检查 (规则名, 键)，全部通过时一起计数并返回None，否则都不计数，返回第一个拒绝的 Rejection"""
+        if not self.enabled:
+            return None
+        rules = [self.rules[name] for name, _ in checks]
+        rejected, retry_after = self.store.hit([
+            (f"{name}:{key}", rule.interval, rule.period) for (name, key), rule in zip(checks, rules)
+        ])
+        if rejected is not None:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return Rejection(rules[rejected].name, retry_after)
+        with self._lock:
+            self._stats['allowed'] += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'rules': {name: str(rule) for name, rule in self.rules.items()},
+                'store': self.store.stats(),
+                **self._stats,
+            }
+
+
+def rejection_response(rejection):
+    """被限流请求的 (JSON内容, 响应头)，状态码为429"""
+    retry_after = max(1, math.ceil(rejection.retry_after))
+    return {"success": False, "message": RATE_LIMIT_MESSAGE, "retry_after": retry_after}, {'Retry-After': str(retry_after)}
+
+
+def client_address(remote_addr, forwarded_for=None, trusted_proxies=0):
+    """客户端IP：部署在 trusted_proxies 层反向代理之后时，取 X-Forwarded-For 从右数第 trusted_proxies 个地址
+
+    X-Forwarded-For 左边的地址由客户端自己填写，只有最右边的 trusted_proxies 个是受信任的代理追加的
+    （与 werkzeug ProxyFix 的 x_for 相同）；地址个数不足时使用连接的对端地址。
+    """
+    if trusted_proxies > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return remote_addr or 'unknown'
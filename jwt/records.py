@@ -0,0 +1,166 @@
+"""
+内存记录 - 开发模式订单和用户的紧凑记录
+
+每条记录用 __slots__ 类保存，不再是十几个字符串键的dict；订单状态、币种、日期和用户ID
+使用驻留字符串，所有记录共享同一个对象；忌口和偏好列表保存为小整数编码的元组（相同组合共享一个元组），
+不再保存JSON字符串，无法编码的取值按原值保存。记录支持 order['status'] / order.get(...) 形式的读写，
+只在响应时通过 to_dict() 转换为原有的JSON结构。
+"""
+
+import json
+import sys
+import threading
+
+
+class CodeBook:
+    """把选项字符串编码为小整数，选项组合编码为共享的整数元组
+
+    只有列表（或元组）且其中每一项都可哈希时才编码；字符串、字典等其他取值，
+    或包含不可哈希项的列表按原值保存，decode 时原样返回，保证转换回的JSON与原值一致。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._values = []
+        self._combos = {}
+
+    def encode(self, values):
+        if not isinstance(values, (list, tuple)):
+            return values
+        codes = []
+        for value in values:
+            # 按 (类型, 值) 编码，1 和 True 这类相等的值不会共用一个编码
+            key = (type(value), value)
+            try:
+                code = self._codes.get(key)
+            except TypeError:
+                return list(values)
+            if code is None:
+                with self._lock:
+                    code = self._codes.get(key)
+                    if code is None:
+                        code = self._codes[key] = len(self._values)
+                        self._values.append(value)
+            codes.append(code)
+        codes = tuple(codes)
+        return self._combos.setdefault(codes, codes)
+
+    def decode(self, codes):
+        if not isinstance(codes, tuple):
+            return codes
+        return [self._values[code] for code in codes]
+
+    def __len__(self):
+        return len(self._values)
+
+
+# 忌口和偏好共用一个编码表
+PREFERENCES = CodeBook()
+
+
+class Record:
+    """__slots__ 记录的公共部分：按字段名读写、to_dict() 转换为JSON结构
+
+    OPTIONAL 中的字段为 None 时不出现在 to_dict() 的结果中，与原来按需写入字段的dict一致。
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+    OPTIONAL = frozenset()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and (key not in self.OPTIONAL or getattr(self, key) is not None)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def update(self, fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    def to_dict(self, fields=None):
+        if fields is not None:
+            return {field: self.get(field) for field in fields}
+        result = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None or field not in self.OPTIONAL:
+                result[field] = value
+        return result
+
+
+class OrderRecord(Record):
+    __slots__ = (
+        'id', 'order_number', 'user_id', 'phone_number', 'status', 'order_date', 'created_at',
+        'submitted_at', 'updated_at', 'delivery_address', '_dietary_restrictions', '_food_preferences',
+        'budget_amount', 'budget_currency', 'user_sequence_number', 'is_deleted',
+        'user_rating', 'user_feedback', 'feedback_submitted_at', 'deleted_at',
+    )
+    OPTIONAL = frozenset({'submitted_at', 'updated_at', 'user_rating', 'user_feedback', 'feedback_submitted_at', 'deleted_at'})
+    FIELDS = tuple(field.lstrip('_') for field in __slots__)
+
+    def __init__(self, order_id, order_number, user_id, phone_number, delivery_address, allergies, preferences,
+                 budget_amount, user_sequence_number, created_at, status='draft', budget_currency='CNY'):
+        self.id = order_id
+        self.order_number = order_number
+        self.user_id = sys.intern(user_id) if isinstance(user_id, str) else user_id
+        self.phone_number = phone_number
+        self.status = status
+        self.created_at = created_at.isoformat()
+        self.order_date = sys.intern(created_at.date().isoformat())
+        self.delivery_address = delivery_address
+        self._dietary_restrictions = PREFERENCES.encode(allergies)
+        self._food_preferences = PREFERENCES.encode(preferences)
+        self.budget_amount = budget_amount
+        self.budget_currency = budget_currency
+        self.user_sequence_number = user_sequence_number
+        self.is_deleted = False
+        self.submitted_at = self.updated_at = None
+        self.user_rating = self.user_feedback = self.feedback_submitted_at = self.deleted_at = None
+
+    @classmethod
+    def from_form(cls, order_id, user_id, phone_number, form_data, order_number, user_sequence_number, current_time):
+        """与 app.build_order_data 对应的开发模式订单记录"""
+        return cls(
+            order_id, order_number, user_id, phone_number,
+            form_data.get('address', ''), form_data.get('allergies', []), form_data.get('preferences', []),
+            float(form_data.get('budget', 0)), user_sequence_number, current_time,
+        )
+
+    # 状态和币种只有少数几个取值，写入时驻留，所有订单共享同一个字符串对象
+    def __setattr__(self, key, value):
+        if key in ('status', 'budget_currency') and isinstance(value, str):
+            value = sys.intern(value)
+        object.__setattr__(self, key, value)
+
+    # 响应中仍是原来的JSON字符串
+    @property
+    def dietary_restrictions(self):
+        return json.dumps(PREFERENCES.decode(self._dietary_restrictions), ensure_ascii=False)
+
+    @property
+    def food_preferences(self):
+        return json.dumps(PREFERENCES.decode(self._food_preferences), ensure_ascii=False)
+
+
+class UserRecord(Record):
+    __slots__ = ('id', 'phone_number', 'user_sequence', 'user_invite_code', 'created_at', 'invite_code')
+    FIELDS = __slots__
+
+    def __init__(self, user_id, phone_number, user_sequence, user_invite_code, created_at, invite_code):
+        self.id = user_id
+        self.phone_number = phone_number
+        self.user_sequence = user_sequence
+        self.user_invite_code = user_invite_code
+        self.created_at = created_at
+        self.invite_code = sys.intern(invite_code) if isinstance(invite_code, str) else invite_code
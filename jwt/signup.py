@@ -0,0 +1,101 @@
+"""
+邀请码注册 - 进程内注册引擎和数据库注册函数（校验邀请码、创建用户、记录邀请关系一次原子完成）
+"""
+
+import random
+import string
+import threading
+from datetime import datetime, timezone
+
+from records import UserRecord
+
+# 注册结果
+SIGNUP_OK = 'ok'
+SIGNUP_INVALID_CODE = 'invalid_code'
+SIGNUP_ALREADY_REGISTERED = 'already_registered'
+
+# 用户邀请码可邀请的人数
+USER_INVITE_MAX_USES = 3
+
+
+def generate_user_invite_code(length=6):
+    """6位大写字母数字的用户邀请码（与 worker.js 的 generateUserInviteCode 一致）"""
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+class MemorySignupEngine:
+    """开发模式的注册引擎
+
+    与数据库函数 signup_with_invite 相同：在一把锁内占用邀请码的一次使用次数、创建用户、
+    分配用户序号、生成用户自己的邀请码，并在使用用户邀请码时记录邀请关系，
+    因此并发注册不会让邀请码超过 max_uses，同一手机号也不会注册两次。
+    """
+
+    def __init__(self, activity_codes, invite_summaries=None):
+        """activity_codes: 活动邀请码 -> 最大使用次数（None 表示不限次数）"""
+        self.invite_summaries = invite_summaries
+        self.users = {}  # 手机号 -> 用户
+        self._users_by_id = {}
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._codes = {
+            code: {'invite_type': 'activity', 'max_uses': max_uses, 'current_uses': 0, 'owner_user_id': None}
+            for code, max_uses in activity_codes.items()
+        }
+
+    def signup(self, phone_number, invite_code):
+        """使用邀请码注册，返回 (SIGNUP_* 结果, 新用户记录)，失败时新用户记录为None"""
+        with self._lock:
+            if phone_number in self.users:
+                return SIGNUP_ALREADY_REGISTERED, None
+            invite = self._codes.get(invite_code)
+            if invite is None or (invite['max_uses'] is not None and invite['current_uses'] >= invite['max_uses']):
+                return SIGNUP_INVALID_CODE, None
+            invite['current_uses'] += 1
+
+            self._sequence += 1
+            user_invite_code = generate_user_invite_code()
+            while user_invite_code in self._codes:
+                user_invite_code = generate_user_invite_code()
+            user = UserRecord(
+                f"dev_user_{self._sequence}", phone_number, self._sequence, user_invite_code,
+                datetime.now(timezone.utc).isoformat(), invite_code
+            )
+            self.users[phone_number] = self._users_by_id[user['id']] = user
+            self._codes[user_invite_code] = {
+                'invite_type': 'user', 'max_uses': USER_INVITE_MAX_USES, 'current_uses': 0, 'owner_user_id': user['id']
+            }
+            if self.invite_summaries is not None:
+                # 与数据库触发器 trg_users_invite_summary 一致：新用户注册时建立空的邀请统计
+                self.invite_summaries.ensure(user['id'], user_invite_code)
+                if invite['owner_user_id'] is not None:
+                    self.invite_summaries.record_invitation(invite['owner_user_id'], user['id'], phone_number, invite_code)
+        return SIGNUP_OK, user
+
+    def get_user(self, user_id):
+        return self._users_by_id.get(user_id)
+
+    def get_user_by_phone(self, phone_number):
+        return self.users.get(phone_number)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'users': len(self.users), 'invite_codes': len(self._codes)}
+
+
+class SupabaseSignup:
+    """生产模式的注册，调用数据库函数 signup_with_invite，一次往返完成"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def signup(self, phone_number, invite_code):
+        with self.pool.connection() as supabase:
+            result = supabase.rpc('signup_with_invite', {
+                'p_phone_number': phone_number,
+                'p_invite_code': invite_code
+            }).execute()
+        return result.data['status'], result.data.get('user')
+
+    def stats(self):
+        return {'backend': 'supabase'}
@@ -0,0 +1,85 @@
+-- 邀请码注册（Supabase/PostgreSQL）
+-- 校验并占用邀请码、创建用户、分配用户序号、生成用户邀请码、记录邀请关系在一个函数（一个事务、一次往返）中完成
+
+-- 用户序号和用户邀请码（与D1迁移002/003一致），邀请码使用次数见 invite_stats_setup.sql
+ALTER TABLE users ADD COLUMN IF NOT EXISTS user_sequence INTEGER UNIQUE;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS user_invite_code VARCHAR(50) UNIQUE;
+
+-- 用户序号用序列分配，不需要锁计数器行
+CREATE SEQUENCE IF NOT EXISTS user_sequence_seq;
+SELECT setval('user_sequence_seq', GREATEST((SELECT COALESCE(MAX(user_sequence), 0) FROM users), 1),
+              (SELECT MAX(user_sequence) IS NOT NULL FROM users));
+
+-- 现有活动邀请码的使用次数（与D1迁移002一致）
+UPDATE invite_codes SET current_uses = 1 WHERE used AND current_uses = 0;
+UPDATE invite_codes SET max_uses = 10 WHERE code = 'ADVX2025' AND max_uses = 1;
+
+-- 6位大写字母数字的用户邀请码，与已有邀请码或用户邀请码冲突时重新生成
+CREATE OR REPLACE FUNCTION generate_user_invite_code()
+RETURNS VARCHAR AS $$
+DECLARE
+    v_chars CONSTANT TEXT := 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789';
+    v_code VARCHAR;
+BEGIN
+    LOOP
+        SELECT string_agg(substr(v_chars, 1 + floor(random() * 36)::INTEGER, 1), '') INTO v_code
+        FROM generate_series(1, 6);
+        EXIT WHEN NOT EXISTS (SELECT 1 FROM invite_codes WHERE code = v_code)
+              AND NOT EXISTS (SELECT 1 FROM users WHERE user_invite_code = v_code);
+    END LOOP;
+    RETURN v_code;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 使用邀请码注册
+-- 返回 {"status": "ok", "user": {...}} | {"status": "invalid_code"} | {"status": "already_registered"}
+-- 邀请码的 UPDATE ... WHERE current_uses < max_uses 会锁住该行，并发注册同一邀请码时依次执行，不会超过使用次数
+CREATE OR REPLACE FUNCTION signup_with_invite(p_phone_number VARCHAR, p_invite_code VARCHAR)
+RETURNS JSONB AS $$
+DECLARE
+    v_invite invite_codes%ROWTYPE;
+    v_user users%ROWTYPE;
+    v_constraint TEXT;
+BEGIN
+    IF EXISTS (SELECT 1 FROM users WHERE phone_number = p_phone_number) THEN
+        RETURN jsonb_build_object('status', 'already_registered');
+    END IF;
+
+    UPDATE invite_codes
+    SET current_uses = current_uses + 1,
+        used = current_uses + 1 >= max_uses,
+        used_by = p_phone_number
+    WHERE code = p_invite_code AND current_uses < max_uses
+      AND (expires_at IS NULL OR expires_at > NOW())
+    RETURNING * INTO v_invite;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'invalid_code');
+    END IF;
+
+    INSERT INTO users (phone_number, invite_code, user_sequence, user_invite_code, created_at)
+    VALUES (p_phone_number, p_invite_code, nextval('user_sequence_seq'), generate_user_invite_code(), NOW())
+    RETURNING * INTO v_user;
+
+    -- 新用户自己的邀请码，可邀请3人
+    INSERT INTO invite_codes (code, invite_type, max_uses, current_uses, owner_user_id)
+    VALUES (v_user.user_invite_code, 'user', 3, 0, v_user.id::TEXT);
+
+    -- 用户邀请码：记录邀请关系，invitations 上的触发器会增量更新邀请人的邀请统计
+    IF v_invite.invite_type = 'user' AND v_invite.owner_user_id IS NOT NULL THEN
+        INSERT INTO invitations (inviter_user_id, invitee_user_id, invite_code, invitee_phone)
+        VALUES (v_invite.owner_user_id, v_user.id::TEXT, p_invite_code, p_phone_number);
+    END IF;
+
+    RETURN jsonb_build_object('status', 'ok', 'user', to_jsonb(v_user));
+EXCEPTION
+    -- 同一手机号并发注册时，后提交的一方在手机号唯一约束上失败，整个函数回滚（邀请码使用次数不变）；
+    -- 其他唯一约束冲突（如并发生成了相同的用户邀请码）不是重复注册，原样抛出
+    WHEN unique_violation THEN
+        GET STACKED DIAGNOSTICS v_constraint = CONSTRAINT_NAME;
+        IF v_constraint = 'users_phone_number_key' THEN
+            RETURN jsonb_build_object('status', 'already_registered');
+        END IF;
+        RAISE;
+END;
+$$ LANGUAGE plpgsql;
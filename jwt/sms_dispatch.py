@@ -0,0 +1,167 @@
+"""
+短信异步发送队列 - 后台线程通过SPUG网关发送验证码短信，以及带超时的HTTP会话
+"""
+
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logs import get_logger
+from metrics import SMS_CALL_DURATION
+
+logger = get_logger('sms')
+
+
+class SmsDispatcher:
+    """短信后台发送器
+
+    请求线程只负责把短信放入有界队列，由固定数量的工作线程发送。
+    工作线程共享一个保持长连接的 requests.Session，失败时按指数退避重试，
+    并按网关限制同时发送的请求数。
+    """
+
+    def __init__(self, url, workers=4, queue_size=1000, max_concurrency=4,
+                 max_retries=3, backoff=0.5, timeout=5.0, session=None):
+        self.url = url
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._max_concurrency = max_concurrency
+        self._gateway_limits = {}
+        self._limits_lock = threading.Lock()
+
+        # 可传入共享的会话（如 TimeoutSession），否则自建一个长连接会话
+        self.session = session
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, max_concurrency))
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0}
+
+    def start(self):
+        """启动工作线程"""
+        if self._threads:
+            return self
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"sms-dispatch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=5.0):
+        """等待队列中的短信发送完毕后停止工作线程"""
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        self.session.close()
+
+    def submit(self, phone_number, code):
+        """把验证码短信放入发送队列，队列已满时返回False"""
+        body = {'name': '验证码', 'code': code, 'targets': phone_number}
+        try:
+            self._queue.put_nowait(body)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def join(self):
+        """阻塞直到队列中的短信都已处理（测试用）"""
+        self._queue.join()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _gateway_limit(self, url):
+        gateway = urlsplit(url).netloc
+        with self._limits_lock:
+            if gateway not in self._gateway_limits:
+                self._gateway_limits[gateway] = threading.BoundedSemaphore(self._max_concurrency)
+            return self._gateway_limits[gateway]
+
+    def _worker(self):
+        while True:
+            body = self._queue.get()
+            try:
+                if body is None:
+                    return
+                self._send(body)
+            finally:
+                self._queue.task_done()
+
+    def _send(self, body):
+        limit = self._gateway_limit(self.url)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count('retried')
+                # 指数退避加随机抖动，避免网关恢复时被重试请求同时打满
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+            try:
+                with limit:
+                    started = time.perf_counter()
+                    response = self.session.post(self.url, json=body, timeout=self.timeout)
+                SMS_CALL_DURATION.observe((time.perf_counter() - started) * 1000, response.status_code)
+                if response.status_code == 200:
+                    self._count('sent')
+                    return True
+                # 除限流(429)外的4xx为请求本身错误，重试没有意义
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    break
+            except requests.RequestException as e:
+                SMS_CALL_DURATION.observe((time.perf_counter() - started) * 1000, 'error')
+                logger.warning("⚠️  短信发送异常: %s - %s", body['targets'], e)
+        self._count('failed')
+        logger.error("❌ 短信发送失败: %s", body['targets'])
+        return False
+
+
+class TimeoutSession(requests.Session):
+    """为每个请求设置默认超时的 requests.Session"""
+
+    def __init__(self, timeout=5.0, pool_size=10):
+        super().__init__()
+        self.timeout = timeout
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.mount('http://', self._adapter)
+        self.mount('https://', self._adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+    def stats(self):
+        """汇总各主机连接池的建连数和请求数"""
+        connections = 0
+        requests_made = 0
+        for pool in list(self._adapter.poolmanager.pools._container.values()):
+            connections += pool.num_connections
+            requests_made += pool.num_requests
+        return {
+            'pool_size': self._adapter._pool_maxsize,
+            'connections_opened': connections,
+            'requests': requests_made,
+            'reuse_ratio': round(1 - connections / requests_made, 4) if requests_made else 0.0,
+        }
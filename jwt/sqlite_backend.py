@@ -0,0 +1,496 @@
+"""
+本地SQLite存储 - 持久化的本地存储模式（STORAGE_BACKEND=sqlite）
+
+数据保存在本地数据库文件中，服务重启后仍然存在。启动时先按文件名顺序应用 migrations/ 下的迁移
+（与 Cloudflare D1 使用同一套表结构），再应用 jwt/migrations_sqlite/ 下只用于本地存储的补充迁移
+（不放在 D1 的迁移目录中，wrangler 和 deploy.sh 不会执行），已应用的迁移记录在 schema_migrations 表中。
+每个线程使用自己的连接（WAL模式下读写互不阻塞），SQL均为带参数的固定语句，
+由 sqlite3 按连接缓存预编译结果。各存储类的接口与开发模式的内存存储一致。
+同一台机器上的多个工作进程打开同一个数据库文件即共享全部状态（多进程部署，WORKERS > 1）。
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from invite_stats import DEFAULT_MAX_USES, MAX_LISTED_INVITATIONS, mask_phone
+from quota import CLAIM_OK, CLAIM_ALREADY_CLAIMED, CLAIM_SOLD_OUT
+from records import OrderRecord, UserRecord
+from signup import SIGNUP_OK, SIGNUP_INVALID_CODE, SIGNUP_ALREADY_REGISTERED, USER_INVITE_MAX_USES, generate_user_invite_code
+
+# 与 Cloudflare D1 共用的表结构迁移，以及只用于本地存储的补充迁移；两个目录中的文件名不能重复
+MIGRATIONS_DIRS = (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrations'),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations_sqlite'),
+)
+
+# 读写订单和用户时的列，与内存记录的字段一致
+ORDER_COLUMNS = OrderRecord.FIELDS
+USER_COLUMNS = UserRecord.FIELDS
+
+
+class SQLiteDatabase:
+    """本地数据库文件和按线程分配的连接
+
+    连接以自动提交模式打开，需要原子执行的多条语句放在 transaction() 中（BEGIN IMMEDIATE，
+    写锁在事务开始时取得，并发写入在 busy_timeout 内排队而不是中途失败）。
+    """
+
+    def __init__(self, path, migrations_dirs=MIGRATIONS_DIRS, busy_timeout=5.0, cached_statements=256):
+        self.path = path
+        self.migrations_dirs = migrations_dirs
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inherited = []  # fork前打开的连接，子进程中不再使用也不关闭
+        self._stats = {'connections_opened': 0, 'migrations_applied': 0}
+
+    def connection(self):
+        """当前线程的连接（首次使用时打开，fork出的子进程重新打开）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid != os.getpid():
+            self._inherited.append(conn)
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None,
+                cached_statements=self.cached_statements,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._stats['connections_opened'] += 1
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def fetchone(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def migrate(self):
+        """按目录、目录内按文件名顺序应用尚未应用的迁移，返回自身
+
+        全部迁移在一个写事务中检查和执行，多个工作进程同时启动时依次进行，迁移只会应用一次。
+        """
+        applied_now = 0
+        with self.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TEXT DEFAULT (datetime('now')))"
+            )
+            applied = {row['name'] for row in conn.execute('SELECT name FROM schema_migrations')}
+            for directory in self.migrations_dirs:
+                for name in sorted(os.listdir(directory)):
+                    if not name.endswith('.sql') or name in applied:
+                        continue
+                    with open(os.path.join(directory, name), encoding='utf-8') as f:
+                        script = f.read()
+                    try:
+                        for statement in split_statements(script):
+                            for sqlite_statement in adapt_statement(statement):
+                                conn.execute(sqlite_statement)
+                    except sqlite3.Error as e:
+                        raise sqlite3.DatabaseError(f'迁移 {name} 执行失败: {e}') from e
+                    conn.execute('INSERT INTO schema_migrations (name) VALUES (?)', (name,))
+                    applied.add(name)
+                    applied_now += 1
+        with self._lock:
+            self._stats['migrations_applied'] += applied_now
+        return self
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'sqlite', 'path': self.path, **self._stats}
+
+
+def split_statements(script):
+    """把迁移脚本拆成单条语句（触发器内的分号不会拆开），以便在同一个事务中逐条执行"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
+    if statement.strip() and sqlite3.complete_statement(statement + ';'):
+        yield statement
+
+
+# ALTER TABLE t ADD COLUMN c ... UNIQUE（SQLite 不支持添加带 UNIQUE 约束的列）
+_ADD_UNIQUE_COLUMN = re.compile(r'ALTER\s+TABLE\s+(\w+)\s+ADD\s+COLUMN\s+(\w+)\s+([^;]*?\bUNIQUE\b[^;]*?)\s*;?\s*$',
+                                re.IGNORECASE)
+
+
+def adapt_statement(statement):
+    """把迁移语句改写为SQLite支持的语句，返回要执行的语句列表
+
+    已发布的迁移文件不再修改：ADD COLUMN ... UNIQUE 拆成添加普通列和一个唯一索引
+    （索引名与 PostgreSQL 自动生成的约束名 <表>_<列>_key 一致），其他语句原样执行。
+    """
+    match = _ADD_UNIQUE_COLUMN.search(statement)
+    if match is None:
+        return [statement]
+    table, column, definition = match.groups()
+    definition = re.sub(r'\s*\bUNIQUE\b', '', definition, flags=re.IGNORECASE)
+    return [
+        f'{statement[:match.start()]}ALTER TABLE {table} ADD COLUMN {column} {definition}',
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {table}_{column}_key ON {table} ({column})',
+    ]
+
+
+class SQLiteVerificationCodeStore:
+    """验证码存储（verification_codes 表），每个手机号只保留最新的验证码"""
+
+    def __init__(self, db, ttl_seconds=600):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._evictions = {'used': 0, 'expired': 0}
+
+    def put(self, phone_number, code):
+        self.db.execute(
+            'INSERT INTO verification_codes (phone_number, code, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (phone_number) DO UPDATE SET code = excluded.code, expires_at = excluded.expires_at',
+            (phone_number, code, time.time() + self.ttl_seconds)
+        )
+
+    def consume(self, phone_number, input_code):
+        """校验验证码并删除，返回 'ok' | 'not_found' | 'expired' | 'mismatch'
+
+        验证成功时只有一条 DELETE ... RETURNING；失败时再读取一次判断原因。
+        """
+        now = time.time()
+        deleted = self.db.fetchone(
+            'DELETE FROM verification_codes WHERE phone_number = ? AND code = ? AND expires_at >= ? RETURNING 1',
+            (phone_number, input_code, now)
+        )
+        if deleted is not None:
+            with self._lock:
+                self._evictions['used'] += 1
+            return 'ok'
+        row = self.db.fetchone('SELECT code, expires_at FROM verification_codes WHERE phone_number = ?', (phone_number,))
+        if row is None:
+            return 'not_found'
+        if now > row['expires_at']:
+            return 'expired'
+        return 'mismatch'
+
+    def purge_expired(self, batch_size=1000):
+        purged = self.db.execute(
+            'DELETE FROM verification_codes WHERE phone_number IN '
+            '(SELECT phone_number FROM verification_codes WHERE expires_at <= ? LIMIT ?)',
+            (time.time(), batch_size)
+        ).rowcount
+        with self._lock:
+            self._evictions['expired'] += purged
+        return purged
+
+    def stats(self):
+        size = self.db.fetchone('SELECT COUNT(*) FROM verification_codes')[0]
+        with self._lock:
+            return {'backend': 'sqlite', 'size': size, 'evictions': dict(self._evictions)}
+
+
+def order_from_row(row):
+    """订单行 -> 与 OrderRecord.to_dict() 相同结构的dict"""
+    order = {}
+    for field in ORDER_COLUMNS:
+        value = row[field]
+        if value is not None or field not in OrderRecord.OPTIONAL:
+            order[field] = value
+    order['is_deleted'] = bool(order['is_deleted'])
+    return order
+
+
+class SQLiteOrderStore:
+    """订单仓库（orders 表），接口与内存订单仓库 OrderStore 一致
+
+    按日订单计数和用户订单序号各用一张计数器表，单条 upsert ... RETURNING 分配；
+    用户订单分页走 (user_id, created_at, id) 索引。
+    """
+
+    _SELECT = f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders"
+    _INSERT = f"INSERT INTO orders ({', '.join(ORDER_COLUMNS)}) VALUES ({', '.join('?' * len(ORDER_COLUMNS))})"
+
+    def __init__(self, db):
+        self.db = db
+
+    def next_daily_count(self, day, count=1):
+        return self.db.fetchone(
+            'INSERT INTO order_number_counters (order_day, last_value) VALUES (?, ?) '
+            'ON CONFLICT (order_day) DO UPDATE SET last_value = last_value + excluded.last_value '
+            'RETURNING last_value',
+            (day, count)
+        )[0] - count + 1
+
+    def next_user_sequence(self, user_id, count=1):
+        return self.db.fetchone(
+            'INSERT INTO user_order_counters (user_id, last_value) VALUES (?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET last_value = last_value + excluded.last_value '
+            'RETURNING last_value',
+            (user_id, count)
+        )[0] - count + 1
+
+    def add(self, order):
+        self.db.execute(self._INSERT, self._values(order))
+
+    def add_many(self, orders):
+        """一个事务写入多个订单"""
+        with self.db.transaction() as conn:
+            conn.executemany(self._INSERT, [self._values(order) for order in orders])
+
+    def get(self, order_id):
+        row = self.db.fetchone(f'{self._SELECT} WHERE id = ?', (order_id,))
+        return order_from_row(row) if row is not None else None
+
+    def update(self, order_id, fields):
+        """更新订单字段，返回更新后的订单，订单不存在时返回None"""
+        row = self.db.fetchone(f'{self._update_sql(fields)} WHERE id = ? RETURNING {", ".join(ORDER_COLUMNS)}',
+                               (*fields.values(), order_id))
+        return order_from_row(row) if row is not None else None
+
+    def update_many(self, order_ids, fields):
+        """一个事务更新多个订单，返回 订单ID -> 更新后的订单（不存在的订单不在结果中）"""
+        sql = f'{self._update_sql(fields)} WHERE id = ? RETURNING {", ".join(ORDER_COLUMNS)}'
+        updated = {}
+        with self.db.transaction() as conn:
+            for order_id in order_ids:
+                row = conn.execute(sql, (*fields.values(), order_id)).fetchone()
+                if row is not None:
+                    updated[order_id] = order_from_row(row)
+        return updated
+
+    def apply_updates(self, updates):
+        """一个事务按订单更新不同的字段，updates 为 订单ID -> 字段，返回 订单ID -> 更新后的订单"""
+        updated = {}
+        with self.db.transaction() as conn:
+            for order_id, fields in updates.items():
+                row = conn.execute(f'{self._update_sql(fields)} WHERE id = ? RETURNING {", ".join(ORDER_COLUMNS)}',
+                                   (*fields.values(), order_id)).fetchone()
+                if row is not None:
+                    updated[order_id] = order_from_row(row)
+        return updated
+
+    def page_by_user(self, user_id, limit, before=None):
+        """按(created_at, id)倒序分页返回用户的订单，返回(订单列表, 是否还有更多)"""
+        if before:
+            rows = self.db.fetchall(
+                f'{self._SELECT} WHERE user_id = ? AND is_deleted = 0 AND (created_at, id) < (?, ?) '
+                'ORDER BY created_at DESC, id DESC LIMIT ?',
+                (user_id, *before, limit + 1)
+            )
+        else:
+            rows = self.db.fetchall(
+                f'{self._SELECT} WHERE user_id = ? AND is_deleted = 0 ORDER BY created_at DESC, id DESC LIMIT ?',
+                (user_id, limit + 1)
+            )
+        return [order_from_row(row) for row in rows[:limit]], len(rows) > limit
+
+    def __contains__(self, order_id):
+        return self.db.fetchone('SELECT 1 FROM orders WHERE id = ?', (order_id,)) is not None
+
+    def __getitem__(self, order_id):
+        order = self.get(order_id)
+        if order is None:
+            raise KeyError(order_id)
+        return order
+
+    def __len__(self):
+        return self.db.fetchone('SELECT COUNT(*) FROM orders')[0]
+
+    @staticmethod
+    def _values(order):
+        return tuple(order.get(field) for field in ORDER_COLUMNS)
+
+    @staticmethod
+    def _update_sql(fields):
+        unknown = set(fields) - set(ORDER_COLUMNS)
+        if unknown:
+            raise KeyError(f'未知的订单字段: {sorted(unknown)}')
+        return f"UPDATE orders SET {', '.join(f'{field} = ?' for field in fields)}"
+
+
+class SQLiteSignupEngine:
+    """邀请码注册（users / invite_codes / invitations 表），与 signup_with_invite 相同，一个事务内完成
+
+    活动邀请码及其使用次数取自迁移写入的 invite_codes 表。
+    """
+
+    _SELECT_USER = f"SELECT {', '.join(USER_COLUMNS)} FROM users"
+
+    def __init__(self, db):
+        self.db = db
+
+    def signup(self, phone_number, invite_code):
+        """使用邀请码注册，返回 (SIGNUP_* 结果, 新用户)，失败时新用户为None"""
+        now = datetime.now(timezone.utc).isoformat()
+        with self.db.transaction() as conn:
+            if conn.execute('SELECT 1 FROM users WHERE phone_number = ?', (phone_number,)).fetchone():
+                return SIGNUP_ALREADY_REGISTERED, None
+            invite = conn.execute(
+                'UPDATE invite_codes SET current_uses = current_uses + 1, used_by = ?, used_at = ? '
+                'WHERE code = ? AND is_active = 1 AND current_uses < max_uses '
+                'RETURNING invite_type, owner_user_id',
+                (phone_number, now, invite_code)
+            ).fetchone()
+            if invite is None:
+                return SIGNUP_INVALID_CODE, None
+
+            user_id = str(uuid.uuid4())
+            user_invite_code = generate_user_invite_code()
+            while conn.execute('SELECT 1 FROM invite_codes WHERE code = ? UNION ALL SELECT 1 FROM users WHERE user_invite_code = ?',
+                               (user_invite_code, user_invite_code)).fetchone():
+                user_invite_code = generate_user_invite_code()
+            # user_sequence 由 assign_user_sequence 触发器分配
+            conn.execute(
+                'INSERT INTO users (id, phone_number, created_at, invite_code, user_invite_code) VALUES (?, ?, ?, ?, ?)',
+                (user_id, phone_number, now, invite_code, user_invite_code)
+            )
+            conn.execute(
+                "INSERT INTO invite_codes (code, invite_type, max_uses, current_uses, owner_user_id, created_by, created_at) "
+                "VALUES (?, 'user', ?, 0, ?, ?, ?)",
+                (user_invite_code, USER_INVITE_MAX_USES, user_id, user_id, now)
+            )
+            if invite['invite_type'] == 'user' and invite['owner_user_id']:
+                conn.execute(
+                    'INSERT INTO invitations (inviter_user_id, invitee_user_id, invite_code, invitee_phone, invited_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (invite['owner_user_id'], user_id, invite_code, phone_number, now)
+                )
+            user = conn.execute(f'{self._SELECT_USER} WHERE id = ?', (user_id,)).fetchone()
+        return SIGNUP_OK, dict(user)
+
+    def get_user(self, user_id):
+        row = self.db.fetchone(f'{self._SELECT_USER} WHERE id = ?', (user_id,))
+        return dict(row) if row is not None else None
+
+    def get_user_by_phone(self, phone_number):
+        row = self.db.fetchone(f'{self._SELECT_USER} WHERE phone_number = ?', (phone_number,))
+        return dict(row) if row is not None else None
+
+    def stats(self):
+        return {
+            'backend': 'sqlite',
+            'users': self.db.fetchone('SELECT COUNT(*) FROM users')[0],
+            'invite_codes': self.db.fetchone('SELECT COUNT(*) FROM invite_codes')[0],
+        }
+
+
+class SQLiteInviteSummaryStore:
+    """邀请统计，按邀请人从 invitations 表读取（idx_invitations_inviter 索引），结构与 user_invite_summaries 的一行一致"""
+
+    def __init__(self, db, max_uses=DEFAULT_MAX_USES):
+        self.db = db
+        self.max_uses = max_uses
+        self._lock = threading.Lock()
+        self._stats = {'reads': 0, 'misses': 0}
+
+    def get(self, user_id):
+        """返回汇总记录（dict），用户不存在或没有用户邀请码时返回None"""
+        user = self.db.fetchone('SELECT user_invite_code, free_drink_claimed FROM users WHERE id = ?', (user_id,))
+        with self._lock:
+            self._stats['reads'] += 1
+            if user is None or user['user_invite_code'] is None:
+                self._stats['misses'] += 1
+                return None
+        current_uses = self.db.fetchone('SELECT COUNT(*) FROM invitations WHERE inviter_user_id = ?', (user_id,))[0]
+        invitations = self.db.fetchall(
+            'SELECT invitee_phone, invited_at FROM invitations WHERE inviter_user_id = ? '
+            'ORDER BY invited_at DESC, id DESC LIMIT ?',
+            (user_id, MAX_LISTED_INVITATIONS)
+        )
+        return {
+            'user_id': user_id,
+            'user_invite_code': user['user_invite_code'],
+            'current_uses': current_uses,
+            'max_uses': self.max_uses,
+            'eligible_for_free_drink': current_uses >= self.max_uses,
+            'free_drink_claimed': bool(user['free_drink_claimed']),
+            'invitations': [
+                {'masked_phone': mask_phone(row['invitee_phone']), 'invited_at': row['invited_at']} for row in invitations
+            ],
+        }
+
+    def record_invitation(self, inviter_user_id, invitee_user_id, invitee_phone, invite_code, invited_at=None):
+        self.db.execute(
+            'INSERT INTO invitations (inviter_user_id, invitee_user_id, invite_code, invitee_phone, invited_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (inviter_user_id, invitee_user_id, invite_code, invitee_phone, invited_at or datetime.now(timezone.utc).isoformat())
+        )
+
+    def mark_claimed(self, user_id):
+        self.db.execute('UPDATE users SET free_drink_claimed = TRUE WHERE id = ?', (user_id,))
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'sqlite', **self._stats}
+
+
+class SQLiteQuota:
+    """免单名额（free_drink_config / user_free_drinks 表），扣减名额和记录领取在一个事务内完成
+
+    total 只在名额尚未初始化时写入（free_drink_quota_seed 中没有记录），之后以数据库中的总数为准。
+    """
+
+    def __init__(self, db, total=None):
+        self.db = db
+        if total is not None:
+            # 只在名额第一次初始化时写入总数，之后重启不会覆盖运营调整过的总数
+            with self.db.transaction() as conn:
+                if conn.execute('INSERT OR IGNORE INTO free_drink_quota_seed (id) VALUES (1)').rowcount:
+                    conn.execute('UPDATE free_drink_config SET total_quota = ? WHERE id = 1', (total,))
+
+    def try_claim(self, user_id):
+        """尝试为用户领取一个名额，返回 CLAIM_* 结果"""
+        with self.db.transaction() as conn:
+            if conn.execute('SELECT 1 FROM user_free_drinks WHERE user_id = ?', (user_id,)).fetchone():
+                return CLAIM_ALREADY_CLAIMED
+            granted = conn.execute(
+                'UPDATE free_drink_config SET used_quota = used_quota + 1 WHERE id = 1 AND used_quota < total_quota'
+            ).rowcount
+            if not granted:
+                return CLAIM_SOLD_OUT
+            conn.execute('INSERT INTO user_free_drinks (user_id) VALUES (?)', (user_id,))
+            conn.execute('UPDATE users SET free_drink_claimed = TRUE WHERE id = ?', (user_id,))
+        return CLAIM_OK
+
+    def has_claimed(self, user_id):
+        return self.db.fetchone('SELECT 1 FROM user_free_drinks WHERE user_id = ?', (user_id,)) is not None
+
+    def remaining(self):
+        row = self.db.fetchone('SELECT remaining_quota FROM free_drink_config WHERE id = 1')
+        return max(0, row[0]) if row is not None else 0
+
+    def stats(self):
+        row = self.db.fetchone('SELECT total_quota, used_quota FROM free_drink_config WHERE id = 1')
+        return {'backend': 'sqlite', 'total': row['total_quota'], 'granted': row['used_quota'], 'remaining': self.remaining()}
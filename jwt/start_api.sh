@@ -38,10 +38,28 @@ if [ ! -f ".env" ]; then
     echo ""
 fi
 
-# 启动Flask应用
-echo "正在启动API服务..."
+# 服务模式：flask（默认，同步多线程）或 asgi（异步，uvicorn），可通过环境变量或 .env 中的 SERVER_MODE 设置
+if [ -z "$SERVER_MODE" ] && [ -f ".env" ]; then
+    SERVER_MODE=$(grep -E '^SERVER_MODE=' .env | tail -n 1 | cut -d '=' -f 2)
+fi
+SERVER_MODE=${SERVER_MODE:-flask}
+
+# 服务进程数：大于1时以多进程启动（flask 模式使用 gunicorn），开发模式的状态保存在各进程共享的本地SQLite中
+if [ -z "$WORKERS" ] && [ -f ".env" ]; then
+    WORKERS=$(grep -E '^WORKERS=' .env | tail -n 1 | cut -d '=' -f 2)
+fi
+export WORKERS=${WORKERS:-1}
+
+# 启动API服务
+echo "正在启动API服务 (模式: $SERVER_MODE, 进程数: $WORKERS)..."
 echo "服务将运行在: http://localhost:5001"
 echo "按 Ctrl+C 停止服务"
 echo ""
 
-python app.py
\ No newline at end of file
+if [ "$SERVER_MODE" == "asgi" ]; then
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001 --workers "$WORKERS"
+elif [ "$WORKERS" -gt 1 ]; then
+    gunicorn "app:create_app()" --bind 0.0.0.0:5001 --workers "$WORKERS" --threads "${WORKER_THREADS:-8}"
+else
+    python app.py
+fi
\ No newline at end of file
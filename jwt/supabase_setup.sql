@@ -39,4 +39,57 @@ INSERT INTO invite_codes (code) VALUES
 ('WELCOME'),
 ('LANDE'),
 ('OMNILAZE'),
-('ADVX2025');
\ No newline at end of file
+('ADVX2025');
+
+-- 原子消费验证码：校验验证码、检查过期并标记为已使用，一次RPC调用完成
+-- 返回值: 'ok' | 'not_found' | 'expired' | 'mismatch'
+CREATE OR REPLACE FUNCTION consume_verification_code(p_phone_number VARCHAR, p_code VARCHAR)
+RETURNS TEXT AS $$
+DECLARE
+    v_record verification_codes%ROWTYPE;
+BEGIN
+    -- 锁定该手机号最新的未使用验证码，并发请求会在此等待，不会重复使用同一验证码
+    SELECT * INTO v_record
+    FROM verification_codes
+    WHERE phone_number = p_phone_number AND used = FALSE
+    ORDER BY created_at DESC
+    LIMIT 1
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN 'not_found';
+    END IF;
+
+    IF v_record.expires_at < NOW() THEN
+        RETURN 'expired';
+    END IF;
+
+    IF v_record.code <> p_code THEN
+        RETURN 'mismatch';
+    END IF;
+
+    UPDATE verification_codes SET used = TRUE WHERE id = v_record.id;
+    RETURN 'ok';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX idx_verification_codes_phone_unused ON verification_codes(phone_number, created_at DESC) WHERE used = FALSE;
+
+
+-- 分批清理已使用或已过期的验证码，返回删除条数（由后台清理线程周期性调用，见 verification_store.py）
+CREATE OR REPLACE FUNCTION purge_verification_codes(p_batch_size INTEGER DEFAULT 1000)
+RETURNS INTEGER AS $$
+DECLARE
+    v_deleted INTEGER;
+BEGIN
+    DELETE FROM verification_codes
+    WHERE id IN (
+        SELECT id FROM verification_codes
+        WHERE used = TRUE OR expires_at < NOW()
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    );
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+    RETURN v_deleted;
+END;
+$$ LANGUAGE plpgsql;
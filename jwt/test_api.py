@@ -5,15 +5,23 @@ API测试脚本 - 测试手机验证码API是否正常工作
 
 import requests
 import json
+import os
+import sys
 import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-API_BASE_URL = "http://localhost:5000"
+from sms_dispatch import SmsDispatcher
+from clients import create_supabase_pool
+from metrics import SUPABASE_CALL_DURATION, SMS_CALL_DURATION
 
-def test_health_check():
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:5000")
+
+def test_health_check(client=requests, base_url=API_BASE_URL):
     """测试健康检查API"""
     print("=== 测试健康检查API ===")
     try:
-        response = requests.get(f"{API_BASE_URL}/health")
+        response = client.get(f"{base_url}/health")
         print(f"状态码: {response.status_code}")
         print(f"响应: {response.json()}")
         return response.status_code == 200
@@ -21,14 +29,14 @@ def test_health_check():
         print(f"健康检查失败: {e}")
         return False
 
-def test_send_verification_code():
+def test_send_verification_code(client=requests, base_url=API_BASE_URL):
     """测试发送验证码API"""
     print("\n=== 测试发送验证码API ===")
     test_phone = "13800138000"
     
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/send-verification-code",
+        response = client.post(
+            f"{base_url}/send-verification-code",
             json={"phone_number": test_phone}
         )
         print(f"状态码: {response.status_code}")
@@ -38,15 +46,15 @@ def test_send_verification_code():
         print(f"发送验证码测试失败: {e}")
         return False
 
-def test_login_with_phone():
+def test_login_with_phone(client=requests, base_url=API_BASE_URL):
     """测试验证码登录API"""
     print("\n=== 测试验证码登录API ===")
     test_phone = "13800138000"
     test_code = "123456"
     
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/login-with-phone",
+        response = client.post(
+            f"{base_url}/login-with-phone",
             json={
                 "phone_number": test_phone,
                 "verification_code": test_code
@@ -59,6 +67,1014 @@ def test_login_with_phone():
         print(f"验证码登录测试失败: {e}")
         return False
 
+def start_stub_server(handler_class):
+    """在本地随机端口启动桩HTTP服务，返回(server, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_sms_dispatcher_with_stub_server():
+    """测试短信发送队列（本地桩短信网关，首次请求失败以触发重试）"""
+    print("\n=== 测试短信发送队列 ===")
+    received = []
+
+    class StubSpugHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            received.append(body)
+            self.send_response(500 if len(received) == 1 else 200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server, base_url = start_stub_server(StubSpugHandler)
+    dispatcher = SmsDispatcher(f"{base_url}/send/test", workers=2, max_retries=2, backoff=0.01).start()
+    try:
+        started = time.perf_counter()
+        accepted = [dispatcher.submit(f"1380013800{i}", "123456") for i in range(5)]
+        submit_ms = (time.perf_counter() - started) * 1000
+        dispatcher.join()
+        stats = dispatcher.stats()
+        print(f"入队耗时: {submit_ms:.2f}ms, 统计: {stats}")
+        timings = SMS_CALL_DURATION.snapshot()
+        assert all(accepted)
+        assert stats['sent'] == 5 and stats['retried'] == 1 and len(received) == 6
+        assert timings['500']['count'] >= 1 and timings['200']['count'] >= 5
+    finally:
+        dispatcher.stop()
+        server.shutdown()
+
+def test_supabase_pool_with_stub_postgrest():
+    """测试Supabase客户端池（本地PostgREST桩服务，验证池大小、复用率和请求超时）"""
+    print("\n=== 测试Supabase客户端池 ===")
+
+    class StubPostgrestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            # postgrest-py 的GET请求也带有JSON请求体，需要读掉才能复用长连接
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            # /rest/v1/slow 模拟慢查询，用于验证超时
+            time.sleep(0.5 if self.path.startswith('/rest/v1/slow') else 0.02)
+            body = json.dumps([{"id": 1, "order_number": "ORD20250101001"}]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server, base_url = start_stub_server(StubPostgrestHandler)
+    pool = create_supabase_pool(base_url, "stub.anon.key", size=2, timeout=0.2, acquire_timeout=2)
+    results = []
+
+    def query():
+        with pool.connection() as client:
+            results.append(client.table('orders').select('*').limit(1).execute().data)
+
+    try:
+        threads = [threading.Thread(target=query) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = pool.stats()
+        print(f"连接池统计: {stats}")
+
+        timed_out = False
+        try:
+            with pool.connection() as client:
+                client.table('slow').select('*').execute()
+        except Exception as e:
+            timed_out = True
+            print(f"慢查询按时限中断: {type(e).__name__}")
+
+        # 每次PostgREST请求都按操作记入耗时直方图，超时的请求没有响应，不计入
+        timings = SUPABASE_CALL_DURATION.snapshot()
+        print(f"Supabase调用耗时: { {op: t['count'] for op, t in timings.items()} }")
+        assert len(results) == 8
+        assert stats['created'] == 2 and stats['in_use'] == 0 and stats['reuse_ratio'] == 0.75
+        assert timed_out, "慢查询应按时限中断"
+        assert timings['GET orders 200']['count'] >= 8
+    finally:
+        server.shutdown()
+
+def test_asgi_app_scenarios():
+    """以开发模式在进程内运行ASGI入口，复用上面的接口测试并走完注册下单流程"""
+    print("\n=== 测试ASGI服务模式 ===")
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        from starlette.testclient import TestClient
+        import asgi_app
+    except ImportError as e:
+        raise AssertionError(f"ASGI依赖未安装: {e}") from e
+
+    phone = "13900139000"
+    with TestClient(asgi_app.app) as client:
+        # 基础接口测试沿用返回布尔值的写法
+        assert test_health_check(client, "")
+        assert test_send_verification_code(client, "")
+        assert test_login_with_phone(client, "")
+        code = client.post("/send-verification-code", json={"phone_number": phone}).json()["dev_code"]
+        login = client.post("/login-with-phone", json={"phone_number": phone, "verification_code": code}).json()
+        user = client.post("/verify-invite-code", json={"phone_number": phone, "invite_code": "WELCOME"}).json()
+        order = client.post("/create-order", json={
+            "user_id": user["user_id"], "phone_number": phone, "form_data": {"address": "测试地址", "budget": 30}
+        }).json()
+        submitted = client.post("/submit-order", json={"order_id": order["order_id"]}).json()
+        orders = client.get(f"/orders/{user['user_id']}?limit=1&fields=order_number,status").json()
+        remaining = client.get("/free-drinks-remaining")
+        not_modified = client.get("/free-drinks-remaining", headers={"If-None-Match": remaining.headers["ETag"]})
+        print(f"注册: {user}, 订单: {orders}")
+        assert login["is_new_user"] and submitted["success"]
+        assert orders["orders"] == [{"order_number": order["order_number"], "status": "submitted"}]
+        assert not_modified.status_code == 304
+
+def test_benchmark_funnel_in_process():
+    """测试注册下单压测脚本：进程内并发走完整个流程，每一步都应成功"""
+    print("\n=== 测试注册下单压测 ===")
+    import argparse
+    import benchmark
+    args = argparse.Namespace(threads=4, users=20, url=None, app='flask', invite_code='WELCOME')
+    results = benchmark.bench_funnel(args)
+    print(f"流程统计: {results['funnels']}")
+    assert results['ok']
+    for name, step in results['steps'].items():
+        assert step['errors'] == 0 and step['requests'] == 20, f"{name}: {step}"
+
+def test_logging_pipeline():
+    """测试结构化日志：JSON格式带 extra 字段，采样率为0时丢弃INFO，保留WARNING"""
+    print("\n=== 测试结构化日志 ===")
+    import io
+    import logs
+    logs.shutdown_logging()
+    stream = io.StringIO()
+    logs.configure_logging(level="INFO", sample_rate=0.0, fmt="json", stream=stream)
+    try:
+        logger = logs.get_logger("test")
+        for i in range(100):
+            logger.info("采样丢弃 %d", i)
+        logger.warning("保留的警告 %s", "13800138000", extra={"user_id": "dev_user_1"})
+    finally:
+        logs.shutdown_logging()
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    print(f"日志输出: {entries}")
+    assert len(entries) == 1
+    assert entries[0]["message"] == "保留的警告 13800138000"
+    assert entries[0]["user_id"] == "dev_user_1" and entries[0]["level"] == "WARNING"
+
+def test_user_cache_returning_login():
+    """测试用户资料缓存：注册时写入缓存，老用户登录命中缓存；LRU按容量淘汰、按TTL过期"""
+    print("\n=== 测试用户资料缓存 ===")
+    from cache import LRUCache
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    client = app.app.test_client()
+    phone = "13700137000"
+    code = client.post("/send-verification-code", json={"phone_number": phone}).get_json()["dev_code"]
+    client.post("/login-with-phone", json={"phone_number": phone, "verification_code": code})
+    client.post("/verify-invite-code", json={"phone_number": phone, "invite_code": "WELCOME"})
+    before = app.user_cache.stats()
+    code = client.post("/send-verification-code", json={"phone_number": phone}).get_json()["dev_code"]
+    login = client.post("/login-with-phone", json={"phone_number": phone, "verification_code": code}).get_json()
+    after = app.user_cache.stats()
+    print(f"登录结果: {login}, 缓存统计: {after}")
+
+    lru = LRUCache(max_entries=2, ttl=0.05)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    lru.get("a")
+    lru.put("c", 3)  # 淘汰最久未使用的 b
+    evicted = lru.get("b") is None and lru.get("a") == 1
+    time.sleep(0.06)
+    expired = lru.get("c") is None
+
+    assert not login["is_new_user"]
+    assert after["hits"] == before["hits"] + 1
+    assert evicted and expired and lru.stats()["evicted"] == 1
+
+def test_invite_summary_incremental_and_rebuild():
+    """测试邀请统计：记录邀请时增量更新，分批重建结果一致，新注册的用户有空的统计，两个接口只读汇总记录"""
+    print("\n=== 测试邀请统计 ===")
+    from invite_stats import MemoryInviteSummaryStore
+    from signup import MemorySignupEngine
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    store = MemoryInviteSummaryStore(max_uses=2)
+    for index in range(3):
+        store.record_invitation("u1", f"invitee_{index}", f"1380000000{index}", "USR001")
+    store.record_invitation("u2", "invitee_3", "13900000003", "USR002")
+    store.mark_claimed("u1")
+    incremental = store.get("u1")
+    print(f"增量汇总: {incremental}")
+    rebuilt = store.rebuild(batch_size=1)
+
+    # 新注册、还没有邀请任何人的用户
+    _, newcomer = MemorySignupEngine({"WELCOME": None}, store).signup("13700000000", "WELCOME")
+    empty = store.get(newcomer["id"])
+
+    client = app.app.test_client()
+    stats = client.get("/get-user-invite-stats", query_string={"user_id": "dev_user_invite"}).get_json()
+    progress = client.get("/get-invite-progress", query_string={"user_id": "dev_user_invite"}).get_json()
+    print(f"邀请统计: {stats}, 邀请进度: {progress}")
+
+    assert incremental["current_uses"] == 3 and incremental["eligible_for_free_drink"]
+    assert incremental["invitations"][0]["masked_phone"] == "138****0002"
+    assert rebuilt == 2 and store.get("u1") == incremental and store.owner_of("USR002") == "u2"
+    assert empty["user_invite_code"] == newcomer["user_invite_code"] and empty["current_uses"] == 0
+    assert empty["invitations"] == [] and not empty["eligible_for_free_drink"]
+    assert stats["current_uses"] == progress["total_invitations"] == len(progress["invitations"]) == 3
+
+def test_signup_engine_atomic_invite_usage():
+    """测试注册引擎：并发使用同一邀请码不超过 max_uses，同一手机号不能重复注册，用户邀请码记录邀请关系；
+    新用户邀请码与已有用户的邀请码冲突时重新生成"""
+    print("\n=== 测试邀请码注册 ===")
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from invite_stats import MemoryInviteSummaryStore
+    from signup import MemorySignupEngine, SIGNUP_OK, SIGNUP_ALREADY_REGISTERED, SIGNUP_INVALID_CODE
+    import sqlite_backend
+    from sqlite_backend import SQLiteDatabase, SQLiteSignupEngine
+
+    summaries = MemoryInviteSummaryStore()
+    engine = MemorySignupEngine({"LIMITED": 3, "OPEN": None}, summaries)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(lambda n: engine.signup(f"1360000{n:04d}", "LIMITED")[0], range(20)))
+    status, inviter = engine.signup("13611110000", "OPEN")
+    duplicate = engine.signup("13611110000", "OPEN")[0]
+    invited = engine.signup("13622220000", inviter["user_invite_code"])[1]
+    summary = summaries.get(inviter["id"])
+    sequences = sorted(user["user_sequence"] for user in engine.users.values())
+    print(f"注册结果: {statuses.count(SIGNUP_OK)} 成功, 邀请统计: {summary}")
+
+    assert statuses.count(SIGNUP_OK) == 3 and statuses.count(SIGNUP_INVALID_CODE) == 17
+    assert status == SIGNUP_OK and duplicate == SIGNUP_ALREADY_REGISTERED
+    assert invited is not None and summary["current_uses"] == 1
+    assert summary["invitations"][0]["masked_phone"] == "136****0000"
+    assert sequences == list(range(1, 6))
+
+    # 已有用户的邀请码不在 invite_codes 中（如早期导入的数据），生成的新邀请码与之相同时重新生成，而不是注册失败
+    original = sqlite_backend.generate_user_invite_code
+    with tempfile.TemporaryDirectory() as directory:
+        db = SQLiteDatabase(os.path.join(directory, "omnilaze.db")).migrate()
+        try:
+            existing = SQLiteSignupEngine(db).signup("13633330000", "ADVX2025")[1]
+            db.execute("DELETE FROM invite_codes WHERE code = ?", (existing["user_invite_code"],))
+            codes = iter([existing["user_invite_code"], "FRESH1"])
+            sqlite_backend.generate_user_invite_code = lambda: next(codes)
+            status, user = SQLiteSignupEngine(db).signup("13633330001", "ADVX2025")
+        finally:
+            sqlite_backend.generate_user_invite_code = original
+            db.close()
+    assert status == SIGNUP_OK and user["user_invite_code"] == "FRESH1"
+
+def test_free_drinks_etag_revalidation():
+    """测试免单名额条件请求：未变化时带 If-None-Match 返回304，跨域请求可以携带 If-None-Match、读取 ETag"""
+    print("\n=== 测试名额条件请求 ===")
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    client = app.app.test_client()
+    origin = {"Origin": "http://localhost:8081"}
+    first = client.get("/free-drinks-remaining", headers=origin)
+    etag = first.headers.get("ETag")
+    revalidated = client.get("/free-drinks-remaining", headers={**origin, "If-None-Match": etag})
+    preflight = client.options("/free-drinks-remaining", headers={**origin, "Access-Control-Request-Method": "GET",
+                                                                  "Access-Control-Request-Headers": "if-none-match"})
+    print(f"ETag: {etag}, 条件请求: {revalidated.status_code}")
+
+    assert first.status_code == 200 and etag
+    assert revalidated.status_code == 304 and revalidated.data == b""
+    assert "etag" in first.headers.get("Access-Control-Expose-Headers", "").lower()
+    assert "if-none-match" in preflight.headers.get("Access-Control-Allow-Headers", "").lower()
+
+def test_verification_code_consume():
+    """测试验证码消费：一次操作完成校验和删除，正确/过期/错误/不存在分别返回对应结果，同一验证码并发消费只有一次成功"""
+    print("\n=== 测试验证码消费 ===")
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from verification_store import MemoryVerificationCodeStore
+    from sqlite_backend import SQLiteDatabase, SQLiteVerificationCodeStore
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = SQLiteDatabase(os.path.join(directory, "omnilaze.db")).migrate()
+        results = {}
+        for name, make_store in (("memory", MemoryVerificationCodeStore),
+                                 ("sqlite", lambda ttl_seconds: SQLiteVerificationCodeStore(db, ttl_seconds=ttl_seconds))):
+            store = make_store(ttl_seconds=600)
+            store.put("13800000001", "111111")
+            outcomes = [store.consume("13800000001", "222222"), store.consume("13800000001", "111111"),
+                        store.consume("13800000001", "111111"), store.consume("13800000002", "111111")]
+            expiring = make_store(ttl_seconds=0.05)
+            expiring.put("13800000003", "333333")
+            time.sleep(0.1)
+            outcomes.append(expiring.consume("13800000003", "333333"))
+
+            # 16个线程同时用同一个验证码登录
+            store.put("13800000004", "444444")
+            barrier = threading.Barrier(16)
+
+            def consume(_):
+                barrier.wait()
+    for name, (outcomes, ok, not_found) in results.items():
+        assert outcomes == ["mismatch", "ok", "not_found", "not_found", "expired"], f"{name}: {outcomes}"
+        assert ok == 1 and not_found == 15, f"{name}: {ok} ok, {not_found} not_found"
+
+def test_verification_store_eviction():
+    """测试验证码内存存储：超过 max_entries 时淘汰最早过期的验证码，重复发送不会让堆无限增长，后台线程分批清理过期验证码"""
+    print("\n=== 测试验证码淘汰 ===")
+    from verification_store import MemoryVerificationCodeStore, VerificationCodeSweeper
+
+    store = MemoryVerificationCodeStore(ttl_seconds=600, max_entries=3)
+    for index in range(5):
+        store.put(f"1380000001{index}", "123456")
+    capped = store.stats()
+    evicted = [store.consume(f"1380000001{index}", "123456") for index in range(5)]
+
+    # 同一个手机号重复发送：旧的堆条目作废，超过阈值时重建堆
+    resent = MemoryVerificationCodeStore(ttl_seconds=600, max_entries=10)
+    for index in range(3000):
+        resent.put("13800000020", f"{index:06d}")
+    resent_stats = resent.stats()
+    latest = resent.consume("13800000020", "002999")
+
+    expiring = MemoryVerificationCodeStore(ttl_seconds=0.05)
+    for index in range(5):
+        expiring.put(f"1380000003{index}", "123456")
+    sweeper = VerificationCodeSweeper(expiring, interval=0.02, batch_size=2).start()
+    deadline = time.time() + 2
+    while expiring.stats()["size"] and time.time() < deadline:
+        time.sleep(0.01)
+    sweeper.stop()
+    swept = expiring.stats()
+    print(f"容量淘汰: {capped}, 重复发送: {resent_stats}, 清理后: {swept}")
+
+    assert capped["size"] == 3 and capped["evictions"]["capacity"] == 2
+    assert evicted == ["not_found", "not_found", "ok", "ok", "ok"]
+    assert resent_stats["size"] == 1 and resent_stats["heap_size"] <= 1024 + 3 and latest == "ok"
+    assert swept["size"] == 0 and swept["heap_size"] == 0 and swept["evictions"]["expired"] == 5
+    assert sweeper._thread is None
+
+def test_quota_counter_no_oversell():
+    """测试免单名额计数器：大量线程同时领取（包括同一用户重复领取），成功数恰好等于总名额，每个用户最多领取一次"""
+    print("\n=== 测试免单名额 ===")
+    from concurrent.futures import ThreadPoolExecutor
+    from quota import QuotaCounter, CLAIM_OK, CLAIM_ALREADY_CLAIMED, CLAIM_SOLD_OUT
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # 尽量频繁地切换线程，放大竞争
+    try:
+        counter = QuotaCounter(50)
+        # 200个用户，每个用户同时领取3次
+        users = [f"quota_user_{index % 200}" for index in range(600)]
+        start = threading.Event()
+
+        def claim(user_id):
+            start.wait()
+            return user_id, counter.try_claim(user_id)
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            futures = [pool.submit(claim, user_id) for user_id in users]
+            start.set()
+            results = [future.result() for future in futures]
+        granted = [user_id for user_id, status in results if status == CLAIM_OK]
+        statuses = {status: sum(1 for _, s in results if s == status) for status in (CLAIM_OK, CLAIM_ALREADY_CLAIMED, CLAIM_SOLD_OUT)}
+        print(f"领取结果: {statuses}, 统计: {counter.stats()}")
+
+        assert len(granted) == len(set(granted)) == 50 and sum(statuses.values()) == len(users)
+        assert counter.remaining() == 0 and counter.stats()["granted"] == 50
+        assert all(counter.has_claimed(user_id) for user_id in granted)
+        assert counter.try_claim(granted[0]) == CLAIM_ALREADY_CLAIMED
+        assert counter.try_claim("quota_user_late") == CLAIM_SOLD_OUT
+        assert counter.try_claim("quota_user_late") == CLAIM_SOLD_OUT
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+def test_batch_create_and_submit_orders():
+    """测试批量下单：逐个返回校验结果，订单号和用户序号连续分配，批量提交返回每个订单的结果"""
+    print("\n=== 测试批量下单 ===")
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    client = app.app.test_client()
+    forms = [{"address": f"团队地址{n}", "budget": 30} for n in range(4)]
+    forms.insert(2, {"address": "", "budget": 30})
+    created = client.post("/create-orders", json={
+        "user_id": "batch_user", "phone_number": "13500135000", "orders": forms
+    }).get_json()
+    order_ids = [item["order_id"] for item in created["results"] if item["success"]]
+    submitted = client.post("/submit-orders", json={"order_ids": order_ids + ["missing"]}).get_json()
+    print(f"批量创建: {created}, 批量提交: {submitted}")
+
+    numbers = [int(item["order_number"][11:]) for item in created["results"] if item["success"]]
+    assert created["created"] == 4 and created["failed"] == 1
+    assert created["results"][2] == {"index": 2, "success": False, "message": "配送地址不能为空"}
+    assert [item["user_sequence_number"] for item in created["results"] if item["success"]] == [1, 2, 3, 4]
+    assert numbers == list(range(numbers[0], numbers[0] + 4))
+    assert submitted["submitted"] == 4 and not submitted["results"][-1]["success"]
+    assert all(app.dev_orders[order_id]["status"] == "submitted" for order_id in order_ids)
+
+def test_orders_cursor_pagination():
+    """测试订单分页：游标逐页遍历（包括 created_at 相同的订单）不重不漏，无效游标返回400，生产模式的整数订单ID游标可以解析"""
+    print("\n=== 测试订单分页 ===")
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import base64
+    import uuid
+    from datetime import datetime, timedelta, timezone
+    import app
+
+    client = app.app.test_client()
+    user_id = f"page_user_{uuid.uuid4().hex[:8]}"
+    now = datetime.now(timezone.utc)
+    # 5个订单，其中3个的 created_at 相同
+    times = [now, now, now, now - timedelta(seconds=1), now - timedelta(seconds=2)]
+    orders = [dict(app.build_order_data(user_id, "13700137000", {"address": "分页地址", "budget": 30}, f"ORD{n}", n + 1, t),
+                   id=str(uuid.uuid4())) for n, t in enumerate(times)]
+    for order in orders:
+        app.dev_orders.add(order)
+    expected = [order["id"] for order in sorted(orders, key=lambda o: (o["created_at"], o["id"]), reverse=True)]
+
+    def cursor(created_at, order_id):
+        return base64.urlsafe_b64encode(json.dumps([created_at, order_id]).encode()).decode()
+
+    seen, pages, next_cursor = [], [], None
+    while True:
+        query = f"/orders/{user_id}?limit=2&fields=id" + (f"&cursor={next_cursor}" if next_cursor else "")
+        page = client.get(query).get_json()
+        seen += [order["id"] for order in page["orders"]]
+        pages.append((page["count"], page["has_more"]))
+        next_cursor = page["next_cursor"]
+        if not page["has_more"] or len(pages) > 5:
+            break
+
+    invalid = [
+        cursor(orders[0]["created_at"], 42),
+        cursor(orders[0]["created_at"], '1),id.gt.0'),
+        cursor('2025-01-01",created_at.gt."2000-01-01', orders[0]["id"]),
+        cursor("昨天", orders[0]["id"]),
+        "不是游标",
+    ]
+    statuses = [client.get(f"/orders/{user_id}", query_string={"cursor": c}).status_code for c in invalid]
+    print(f"分页: {pages}, 无效游标状态码: {statuses}")
+
+    assert seen == expected
+    assert pages == [(2, True), (2, True), (1, False)] and next_cursor is None
+    assert statuses == [400] * len(invalid)
+
+    # 生产模式 orders.id 为 SERIAL：整数ID的游标能原样解析，UUID和其他值被拒绝
+    app.DEVELOPMENT_MODE = False
+    try:
+        production_cursor = app.encode_orders_cursor({"created_at": orders[0]["created_at"], "id": 42})
+        assert app.decode_orders_cursor(production_cursor) == (orders[0]["created_at"], 42)
+        assert app.decode_orders_cursor(cursor(orders[0]["created_at"], "42")) == (orders[0]["created_at"], 42)
+        for order_id in (orders[0]["id"], 0, -1, True, "4 2", '1),id.gt.0'):
+            try:
+                app.decode_orders_cursor(cursor(orders[0]["created_at"], order_id))
+            except ValueError:
+                continue
+            raise AssertionError(f"生产模式接受了无效的订单ID: {order_id!r}")
+    finally:
+        app.DEVELOPMENT_MODE = True
+
+def test_event_hub_delivery():
+    """测试实时推送：缓冲区满时丢弃最旧的事件，订阅数有上限，提交订单、反馈和领取免单时推送事件，
+    flask 模式的SSE连接数受线程数限制"""
+    print("\n=== 测试实时推送 ===")
+    import random
+    from events import EventHub
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    client = app.app.test_client()
+    hub = EventHub(buffer_size=2, max_subscribers=1)
+    subscription = hub.subscribe(["quota"])
+    delivered = [hub.publish("quota", "free_drinks_remaining", {"free_drinks_remaining": n}) for n in range(3)]
+    buffered = [subscription.get(timeout=0) for _ in range(3)]
+    rejected = hub.subscribe(["quota"])
+    hub.unsubscribe(subscription)
+    resubscribed = hub.subscribe(["quota"]) is not None
+    assert delivered == [1, 1, 1] and subscription.dropped == 1 and buffered[2] is None
+    assert [event["data"]["free_drinks_remaining"] for event in buffered[:2]] == [1, 2]
+    assert rejected is None and resubscribed
+
+    # 邀请3个用户后领取免单，期间下单、提交、反馈
+    prefix = f"131{random.randrange(10 ** 6):06d}"
+    inviter = client.post("/verify-invite-code", json={"phone_number": f"{prefix}00", "invite_code": "1234"}).get_json()
+    for n in range(1, 4):
+        client.post("/verify-invite-code", json={"phone_number": f"{prefix}0{n}", "invite_code": inviter["user_invite_code"]})
+    listener = app.event_hub.subscribe(["quota", f"user:{inviter['user_id']}"])
+    order_id = client.post("/create-order", json={"user_id": inviter["user_id"], "phone_number": f"{prefix}00",
+                                                   "form_data": {"address": "推送地址", "budget": 30}}).get_json()["order_id"]
+    client.post("/submit-order", json={"order_id": order_id})
+    client.post("/order-feedback", json={"order_id": order_id, "rating": 5, "feedback": "很好"})
+    if app.order_update_buffer is not None:
+        app.order_update_buffer.flush_pending()
+    claimed = client.post("/claim-free-drink", json={"user_id": inviter["user_id"]}).get_json()
+    events = []
+    while True:
+        event = listener.get(timeout=0.5)
+        if event is None:
+            break
+        events.append((event["event"], event["data"]))
+    app.event_hub.unsubscribe(listener)
+
+    # flask 模式：超过线程预算的SSE连接返回503，断开后释放
+    slots, app.sse_thread_slots = app.sse_thread_slots, threading.BoundedSemaphore(1)
+    subscribers = app.event_hub.stats()["subscribers"]
+    try:
+        first = client.get("/events", buffered=False)
+        second = client.get("/events", buffered=False)
+        first.close()
+        third = client.get("/events", buffered=False)
+        third.close()
+    finally:
+        app.sse_thread_slots = slots
+    statuses = [first.status_code, second.status_code, third.status_code]
+    print(f"缓冲区: {buffered}, 推送事件: {events}, 连接状态: {statuses}")
+    assert statuses == [200, 503, 200]
+    assert app.event_hub.stats()["subscribers"] == subscribers
+
+    assert claimed["success"]
+    assert [event_type for event_type, _ in events] == ["order_status", "order_feedback", "free_drinks_remaining"]
+    assert events[0][1]["order_id"] == order_id and events[0][1]["status"] == "submitted"
+    assert events[1][1]["user_rating"] == 5
+    assert events[2][1] == {"free_drinks_remaining": claimed["free_drinks_remaining"]}
+
+def test_order_number_allocator_blocks():
+    """测试订单号分配：多个分配器（模拟多个进程）共用一个计数器并发分配，订单号不重复且每段只预留一次"""
+    print("\n=== 测试订单号分配 ===")
+    import re
+    from concurrent.futures import ThreadPoolExecutor
+    from order_numbers import OrderNumberAllocator
+    from order_store import OrderStore
+
+    counter = OrderStore()
+    allocators = [OrderNumberAllocator(counter.next_daily_count, block_size=10) for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        batches = list(pool.map(lambda n: allocators[n % 4].allocate(1 + n % 3), range(200)))
+    numbers = [number for batch in batches for number in batch]
+    blocks = sum(allocator.stats()["blocks"] for allocator in allocators)
+    print(f"分配 {len(numbers)} 个订单号，预留 {blocks} 段，示例: {numbers[:3]}")
+
+    assert len(numbers) == len(set(numbers)) == 399
+    assert all(re.fullmatch(r"ORD\d{8}\d{3,}", number) for number in numbers)
+    assert blocks <= 399 // 10 + 4
+
+def test_compact_records_memory():
+    """测试紧凑记录：转换回的JSON结构与原来的dict一致（包括数字用户ID和无法编码的忌口/偏好），且内存占用更小"""
+    print("\n=== 测试紧凑记录 ===")
+    import argparse
+    import benchmark
+    from datetime import datetime, timezone
+    from records import OrderRecord
+
+    app = benchmark.load_dev_app()
+    now = datetime.now(timezone.utc)
+    form_data = {"address": "测试地址", "budget": 30, "allergies": ["无辣"], "preferences": ["川菜", "清淡"]}
+    expected = dict(app.build_order_data("u1", "13800138000", form_data, "ORD20250101001", 1, now), id="o1")
+    record = OrderRecord.from_form("o1", "u1", "13800138000", form_data, "ORD20250101001", 1, now)
+    # 数字用户ID、字符串或包含不可哈希项的忌口/偏好按原值保存
+    odd_forms = [
+        (42, {"address": "测试地址", "budget": 30, "allergies": "花生", "preferences": [{"菜系": "川菜"}, ["辣"]]}),
+        ("u2", {"address": "测试地址", "budget": 30, "allergies": [1, True, "1"], "preferences": {"辣度": 2}}),
+    ]
+    odd_matches = [
+        OrderRecord.from_form("o2", user_id, "13800138000", form, "ORD20250101002", 1, now).to_dict()
+        == dict(app.build_order_data(user_id, "13800138000", form, "ORD20250101002", 1, now), id="o2")
+        for user_id, form in odd_forms
+    ]
+    results = benchmark.bench_memory(argparse.Namespace(orders=2000, users=200))
+    print(f"订单内存占比: {results['order_memory_ratio']}, 用户内存占比: {results['user_memory_ratio']}, 特殊取值: {odd_matches}")
+    assert record.to_dict() == expected
+    assert all(odd_matches)
+    assert results['ok']
+
+def test_sqlite_backend_survives_restart():
+    """测试本地SQLite存储：应用迁移，注册、验证码、订单和免单数据在重新打开数据库后仍然存在；
+    只用于本地存储的迁移不放在 D1 的迁移目录中"""
+    print("\n=== 测试本地SQLite存储 ===")
+    import sqlite3
+    import tempfile
+    from datetime import datetime, timezone
+    from records import OrderRecord
+    from sqlite_backend import (MIGRATIONS_DIRS, SQLiteDatabase, SQLiteVerificationCodeStore, SQLiteOrderStore,
+                                SQLiteSignupEngine, SQLiteInviteSummaryStore, SQLiteQuota)
+
+    # wrangler 和 deploy.sh 使用的 D1 迁移目录中不能有本地存储的补充迁移，两个目录的文件名不重复
+    d1_migrations, sqlite_migrations = (set(os.listdir(directory)) for directory in MIGRATIONS_DIRS)
+    assert "007_local_storage.sql" in sqlite_migrations and not d1_migrations & sqlite_migrations
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "omnilaze.db")
+        db = SQLiteDatabase(path).migrate()
+        status, inviter = SQLiteSignupEngine(db).signup("13900000000", "ADVX2025")
+        assert status == "ok"
+        for index in range(3):
+            SQLiteSignupEngine(db).signup(f"1390000000{index + 1}", inviter["user_invite_code"])
+        SQLiteVerificationCodeStore(db).put("13900000009", "123456")
+        orders = SQLiteOrderStore(db)
+        order = OrderRecord.from_form("o1", inviter["id"], "13900000000", {"address": "测试地址", "budget": 20},
+                                      f"ORD{orders.next_daily_count('20250101'):011d}", orders.next_user_sequence(inviter["id"]),
+                                      datetime.now(timezone.utc))
+        orders.add(order)
+        assert SQLiteQuota(db, total=1).try_claim(inviter["id"]) == "ok"
+        db.close()
+
+        # 重新打开同一个数据库文件，模拟服务重启；迁移不再重复应用，重启时的名额总数不覆盖已初始化的总数
+        db = SQLiteDatabase(path).migrate()
+        assert db.stats()["migrations_applied"] == 0
+        SQLiteQuota(db, total=100)
+        summary = SQLiteInviteSummaryStore(db).get(inviter["id"])
+        print(f"重启后: 邀请 {summary['current_uses']} 人, 订单 {len(SQLiteOrderStore(db))} 个, 数据库 {db.stats()}")
+        assert SQLiteSignupEngine(db).get_user_by_phone("13900000000") == inviter
+        assert SQLiteSignupEngine(db).signup("13900000000", "ADVX2025")[0] == "already_registered"
+        assert SQLiteVerificationCodeStore(db).consume("13900000009", "123456") == "ok"
+        assert SQLiteOrderStore(db)["o1"] == order.to_dict()
+        assert SQLiteOrderStore(db).next_user_sequence(inviter["id"]) == 2
+        assert summary["eligible_for_free_drink"] and summary["free_drink_claimed"]
+        assert SQLiteQuota(db).try_claim(inviter["id"]) == "already_claimed"
+        assert SQLiteQuota(db).remaining() == 0
+
+        # 002 迁移中的 ADD COLUMN ... UNIQUE 改写为唯一索引
+        unique_indexes = [row["name"] for row in db.fetchall("PRAGMA index_list(users)") if row["unique"]]
+        assert "users_user_invite_code_key" in unique_indexes
+        try:
+            db.execute("UPDATE users SET user_invite_code = ? WHERE phone_number = ?",
+                       (inviter["user_invite_code"], "13900000001"))
+            assert False, "重复的用户邀请码应被唯一索引拒绝"
+        except sqlite3.IntegrityError:
+            pass
+        db.close()
+
+def test_rate_limiter_rejects_before_sms():
+    """测试请求限流：超出规则的发送验证码和登录请求返回429，被拒绝的请求不生成验证码；SQLite存储在多个实例间共享；
+    被IP规则拒绝的请求不消耗手机号额度；按受信任代理追加的 X-Forwarded-For 地址限流"""
+    print("\n=== 测试请求限流 ===")
+    import tempfile
+    from rate_limit import RateLimit, RateLimiter, MemoryRateLimitStore, SQLiteRateLimitStore, client_address
+    from sqlite_backend import SQLiteDatabase
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    original = app.rate_limiter
+    app.rate_limiter = RateLimiter(MemoryRateLimitStore(), [
+        RateLimit("sms_phone", 2, 60), RateLimit("sms_ip", 100, 60), RateLimit("login_phone", 3, 60), RateLimit("login_ip", 100, 60),
+    ])
+    client = app.app.test_client()
+    phone = "13600136000"
+    try:
+        codes = [client.post("/send-verification-code", json={"phone_number": phone}).get_json()["dev_code"] for _ in range(2)]
+        limited = client.post("/send-verification-code", json={"phone_number": phone}, headers={"Origin": "http://localhost:8081"})
+        wrong = [client.post("/login-with-phone", json={"phone_number": phone, "verification_code": "000000"}).status_code for _ in range(2)]
+        login = client.post("/login-with-phone", json={"phone_number": phone, "verification_code": codes[1]})
+        blocked = client.post("/login-with-phone", json={"phone_number": phone, "verification_code": codes[1]})
+        print(f"第3次发送: {limited.status_code} {limited.get_json()}, 登录: {wrong} {login.status_code} {blocked.status_code}")
+
+        assert limited.status_code == 429 and int(limited.headers["Retry-After"]) == 30
+        assert limited.get_json()["success"] is False
+        # 跨域的浏览器客户端可以读取 Retry-After
+        assert "retry-after" in limited.headers.get("Access-Control-Expose-Headers", "").lower()
+        assert wrong == [400, 400] and login.status_code == 200 and blocked.status_code == 429
+
+        started = time.perf_counter()
+        for _ in range(1000):
+            app.rate_limiter.check(("sms_phone", phone))
+        print(f"拒绝耗时: {(time.perf_counter() - started) * 1000:.3f} 微秒/次")
+        assert app.rate_limiter.stats()["rejected"] >= 1002
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "omnilaze.db")
+            workers = [RateLimiter(SQLiteRateLimitStore(SQLiteDatabase(path).migrate()), [RateLimit("sms_phone", 3, 60)]) for _ in range(2)]
+            shared = [workers[n % 2].check(("sms_phone", phone)) for n in range(4)]
+            all_or_nothing = []
+            for store in (MemoryRateLimitStore(), SQLiteRateLimitStore(SQLiteDatabase(path).migrate())):
+                limiter = RateLimiter(store, [RateLimit("sms_phone", 1, 60), RateLimit("sms_ip", 1, 60)])
+                checks = [limiter.check(("sms_phone", "a"), ("sms_ip", "1.1.1.1")),
+                          limiter.check(("sms_phone", "b"), ("sms_ip", "1.1.1.1")),
+                          limiter.check(("sms_phone", "b"), ("sms_ip", "2.2.2.2"))]
+                all_or_nothing.append([check and check.rule for check in checks])
+
+        addresses = [client_address("10.0.0.1", "6.6.6.6, 1.2.3.4", 1), client_address("10.0.0.1", "6.6.6.6, 1.2.3.4", 2),
+                     client_address("10.0.0.1", "1.2.3.4", 2), client_address("10.0.0.1", "6.6.6.6", 0)]
+        print(f"IP被限流时手机号计数: {all_or_nothing}, 客户端地址: {addresses}")
+
+        assert shared[:3] == [None, None, None] and shared[3].rule == "sms_phone"
+        assert all_or_nothing == [[None, "sms_ip", None]] * 2
+        assert addresses == ["1.2.3.4", "6.6.6.6", "10.0.0.1", "10.0.0.1"]
+    finally:
+        app.rate_limiter = original
+
+def run_state_worker(env, tasks, results):
+    """多进程一致性测试的工作进程：以给定环境变量导入应用，依次执行任务队列中的每批请求"""
+    os.environ.update(env)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    client = app.app.test_client()
+    for batch in iter(tasks.get, None):
+        results.put((os.getpid(), [client.open(path, method=method, json=body).get_json() for method, path, body in batch]))
+
+def test_multi_worker_shared_state():
+    """测试多进程部署：两个工作进程共享验证码、注册、免单名额和订单，并发时不超发、不重号"""
+    print("\n=== 测试多进程共享状态 ===")
+    import multiprocessing
+    import tempfile
+
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            env = {"FORCE_DEV_MODE": "true", "WORKERS": "2", "SQLITE_PATH": os.path.join(directory, "omnilaze.db"), "LOG_LEVEL": "WARNING"}
+            for _ in range(2):
+                tasks, results = context.Queue(), context.Queue()
+                process = context.Process(target=run_state_worker, args=(env, tasks, results), daemon=True)
+                process.start()
+                workers.append((tasks, results, process))
+
+            def run(*batches):
+                """每个工作进程执行一批请求（同时进行），返回各自的 (进程ID, 响应列表)"""
+                for (tasks, _, _), batch in zip(workers, batches):
+                    tasks.put(batch)
+                return [results.get(timeout=60) for (_, results, _), _ in zip(workers, batches)]
+
+            def run_on(index, *requests):
+                tasks, results, _ = workers[index]
+                tasks.put(list(requests))
+                return results.get(timeout=60)
+
+            def signup(phone, code):
+                return ("POST", "/verify-invite-code", {"phone_number": phone, "invite_code": code})
+
+            # 进程0发送的验证码由进程1验证，验证后进程0不能再用
+            pid0, [sent] = run_on(0, ("POST", "/send-verification-code", {"phone_number": "13500135000"}))
+            login = ("POST", "/login-with-phone", {"phone_number": "13500135000", "verification_code": sent["dev_code"]})
+            pid1, [verified] = run_on(1, login)
+            _, [reused] = run_on(0, login)
+
+            # 两个进程同时用只能使用10次的 ADVX2025 各注册8个用户
+            signups = run([signup(f"135001350{n:02d}", "ADVX2025") for n in range(8)],
+                          [signup(f"135001351{n:02d}", "ADVX2025") for n in range(8)])
+            users = [user for _, responses in signups for user in responses if user["success"]]
+            inviter = users[0]
+            run([signup(f"1350013520{n}", inviter["user_invite_code"]) for n in range(2)],
+                [signup("13500135202", inviter["user_invite_code"])])
+
+            # 同一用户在两个进程同时领取免单、同时批量下单
+            claims = run([("POST", "/claim-free-drink", {"user_id": inviter["user_id"]})],
+                         [("POST", "/claim-free-drink", {"user_id": inviter["user_id"]})])
+            forms = [{"address": "测试地址", "budget": 20}] * 10
+            batch = ("POST", "/create-orders", {"user_id": inviter["user_id"], "phone_number": inviter["phone_number"], "orders": forms})
+            created = [result for _, [response] in run([batch], [batch]) for result in response["results"]]
+            _, [listed] = run_on(1, ("GET", f"/orders/{inviter['user_id']}?limit=100", None))
+
+        claimed = [response["success"] for _, [response] in claims]
+        order_numbers = {result["order_number"] for result in created}
+        sequences = sorted(result["user_sequence_number"] for result in created)
+        print(f"进程: {pid0}, {pid1}, 注册成功 {len(users)} 个, 领取 {claimed}, 订单号 {len(order_numbers)} 个")
+        assert pid0 != pid1
+        assert verified["success"] and not reused["success"]
+        assert len(users) == 10 and sorted(claimed) == [False, True]
+        assert len(order_numbers) == 20 and sequences == list(range(1, 21)) and listed["count"] == 20
+    finally:
+        for tasks, _, process in workers:
+            tasks.put(None)
+            process.join(timeout=10)
+
+def test_idempotent_order_retries():
+    """测试幂等请求：同一个 Idempotency-Key 的重试重放第一次的响应，不再重复下单；不同请求内容拒绝，5xx不保存，
+    处理中的租约到期后可重试，跨域请求可以携带 Idempotency-Key"""
+    print("\n=== 测试幂等请求 ===")
+    import tempfile
+    from idempotency import MemoryIdempotencyStore, SQLiteIdempotencyStore, IDEMPOTENCY_NEW, IDEMPOTENCY_REPLAY, IDEMPOTENCY_IN_PROGRESS, IDEMPOTENCY_MISMATCH
+    from sqlite_backend import SQLiteDatabase
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    client = app.app.test_client()
+    body = {"user_id": "idempotent_user", "phone_number": "13400134000", "form_data": {"address": "测试地址", "budget": 30}}
+    orders_before = len(app.dev_orders)
+    first = client.post("/create-order", json=body, headers={"Idempotency-Key": "create-1"})
+    retry = client.post("/create-order", json=body, headers={"Idempotency-Key": "create-1"})
+    other = client.post("/create-order", json=dict(body, form_data={"address": "另一个地址"}), headers={"Idempotency-Key": "create-1"})
+    created = len(app.dev_orders) - orders_before
+    order_id = first.get_json()["order_id"]
+    submits = [client.post("/submit-order", json={"order_id": order_id}, headers={"Idempotency-Key": "submit-1"}) for _ in range(2)]
+    missing = [client.post("/submit-order", json={"order_id": "missing"}, headers={"Idempotency-Key": "submit-2"}) for _ in range(2)]
+    print(f"重试: {retry.get_json()}, 新建订单 {created} 个, 不同内容: {other.status_code}, 统计: {app.idempotency_store.stats()}")
+
+    assert first.status_code == retry.status_code == 200 and retry.get_json() == first.get_json()
+    assert retry.headers.get("Idempotent-Replayed") == "true" and "Idempotent-Replayed" not in first.headers
+    assert other.status_code == 422 and created == 1
+    assert submits[1].get_json() == submits[0].get_json() and submits[1].headers.get("Idempotent-Replayed") == "true"
+    assert [response.status_code for response in missing] == [500, 500] and "Idempotent-Replayed" not in missing[1].headers
+
+    # 跨域的浏览器客户端（Expo Web）：预检请求允许 Idempotency-Key，重放的响应可以读取 Idempotent-Replayed
+    origin = {"Origin": "http://localhost:19006"}
+    preflight = client.options("/create-order", headers={**origin, "Access-Control-Request-Method": "POST",
+                                                         "Access-Control-Request-Headers": "content-type,idempotency-key"})
+    replayed = client.post("/create-order", json=body, headers={**origin, "Idempotency-Key": "create-1"})
+    assert "idempotency-key" in preflight.headers.get("Access-Control-Allow-Headers", "").lower()
+    assert "idempotent-replayed" in replayed.headers.get("Access-Control-Expose-Headers", "").lower()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteIdempotencyStore(SQLiteDatabase(os.path.join(directory, "omnilaze.db")).migrate())
+        states = [store.begin("/create-order:k", "a")[0], store.begin("/create-order:k", "a")[0]]
+        store.complete("/create-order:k", "a", 200, b'{"success": true}')
+        states += [store.begin("/create-order:k", "a"), store.begin("/create-order:k", "b")[0]]
+
+        # 处理请求的进程崩溃（没有 complete/release）：租约到期后可以重试，已保存的响应仍然保留
+        leased = []
+        for lease_store in (MemoryIdempotencyStore(lease=0.05), SQLiteIdempotencyStore(SQLiteDatabase(os.path.join(directory, "lease.db")).migrate(), lease=0.05)):
+            lease_store.begin("/submit-order:crashed", "a")
+            lease_store.begin("/submit-order:done", "a")
+            lease_store.complete("/submit-order:done", "a", 200, b'{}')
+            time.sleep(0.1)
+            leased.append([lease_store.begin("/submit-order:crashed", "a")[0], lease_store.begin("/submit-order:done", "a")[0]])
+
+    assert states == [IDEMPOTENCY_NEW, IDEMPOTENCY_IN_PROGRESS, (IDEMPOTENCY_REPLAY, (200, b'{"success": true}')), IDEMPOTENCY_MISMATCH]
+    assert leased == [[IDEMPOTENCY_NEW, IDEMPOTENCY_REPLAY]] * 2
+
+def test_write_behind_feedback_journal():
+    """测试写后缓冲：反馈先写入本地日志后立即返回，同一订单的多次更新合并后批量写库，写库失败保留重试，
+    一个坏键不挡住其他键，删除日志失败不影响后台线程，重启后重放日志"""
+    print("\n=== 测试写后缓冲 ===")
+    import sqlite3
+    import tempfile
+    from sqlite_backend import SQLiteDatabase
+    from write_behind import WriteBehindBuffer, SQLiteJournal
+    os.environ["FORCE_DEV_MODE"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    batches = []
+    failing = [True]
+
+    def flush(updates):
+        if failing[0]:
+            raise ConnectionError("数据库不可用")
+        batches.append(dict(updates))
+
+    client = app.app.test_client()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "write_behind.db")
+            crashed = WriteBehindBuffer(flush, SQLiteJournal(SQLiteDatabase(path)))
+            started = time.perf_counter()
+            for rating in range(1, 101):
+                crashed.submit(f"order-{rating % 10}", {"user_rating": rating % 5 + 1, "user_feedback": str(rating)})
+            per_submit_ms = (time.perf_counter() - started) * 1000 / 100
+            failed = crashed.flush_pending()
+
+            # 模拟进程崩溃：新的缓冲打开同一个日志，重放未写库的更新
+            failing[0] = False
+            journal = SQLiteJournal(SQLiteDatabase(path))
+            recovered = WriteBehindBuffer(flush, journal, max_batch=10, interval=60)
+            flushed = recovered.flush_pending()
+            recovered.start()
+            recovered.submit("order-1", {"user_rating": 5})
+            deadline = time.time() + 2
+            for index in range(2, 11):
+                recovered.submit(f"order-{index}", {"user_rating": 4})
+            while recovered.stats()["batches"] < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            recovered.stop()
+            left = journal.db.fetchone("SELECT COUNT(*) FROM write_behind_journal")[0]
+            tables = [row[0] for row in journal.db.fetchall("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            print(f"每次提交 {per_submit_ms:.3f}ms, 写库 {len(batches)} 批, 统计: {recovered.stats()}")
+
+            assert failed is None and per_submit_ms < 1
+            assert flushed == 10 and len(batches) == 2
+            assert batches[0]["order-0"] == {"user_rating": 1, "user_feedback": "100"}
+            assert batches[1] == {**{f"order-{index}": {"user_rating": 4} for index in range(2, 11)}, "order-1": {"user_rating": 5}}
+            assert left == 0 and recovered.stats()["recovered"] == 100
+            assert tables[0] == "write_behind_journal" and "orders" not in tables
+
+            # 一个坏键（如数据库拒绝的订单ID）让整批写库失败：拆分后其他键照常写库，坏键失败 max_attempts 次后丢弃
+            written, calls = {}, []
+
+            def reject_bad(updates):
+                calls.append(len(updates))
+                if "bad" in updates:
+                    raise ValueError("invalid input syntax for type integer")
+                written.update(updates)
+
+            poisoned_journal = SQLiteJournal(SQLiteDatabase(os.path.join(directory, "poisoned.db")))
+            poisoned = WriteBehindBuffer(reject_bad, poisoned_journal, max_attempts=2)
+            for index in range(7):
+                poisoned.submit(f"good-{index}", {"user_rating": 5})
+                if index == 3:
+                    poisoned.submit("bad", {"user_rating": 1})
+            first = poisoned.flush_pending()
+            first_stats = poisoned.stats()
+            poisoned.submit("good-7", {"user_rating": 4})
+            second = poisoned.flush_pending()
+            poisoned_left = poisoned_journal.db.fetchone("SELECT COUNT(*) FROM write_behind_journal")[0]
+            print(f"坏键: 写出 {first}/{second} 个, 调用 {calls}, 统计: {poisoned.stats()}")
+
+            assert first == 7 and sorted(written) == sorted(f"good-{index}" for index in range(8))
+            assert first_stats["pending"] == 1 and first_stats["dropped"] == 0
+            assert second == 1 and poisoned.stats()["dropped"] == 1 and poisoned.stats()["pending"] == 0
+            assert poisoned_left == 0
+
+            # 数据库不可用：整批失败时不会逐个键重试，也不丢弃任何更新
+            outage_calls = []
+
+            def outage(updates):
+                outage_calls.append(len(updates))
+                raise ConnectionError("数据库不可用")
+
+            down = WriteBehindBuffer(outage, SQLiteJournal(SQLiteDatabase(os.path.join(directory, "outage.db"))), max_attempts=1)
+            for index in range(100):
+                down.submit(f"order-{index}", {"user_rating": 3})
+            assert down.flush_pending() is None and down.flush_pending() is None
+            assert len(outage_calls) <= 2 * (1 + 2 * 7)
+            assert down.stats()["pending"] == 100 and down.stats()["dropped"] == 0
+
+            # 删除日志时数据库被锁：已写库的结果不受影响，后台线程继续运行，下次写库时重试删除
+            locked = SQLiteJournal(SQLiteDatabase(os.path.join(directory, "locked.db")))
+            remove = locked.remove
+            remove_calls = []
+
+            def flaky_remove(entry_ids):
+                remove_calls.append(list(entry_ids))
+                if len(remove_calls) == 1:
+                    raise sqlite3.OperationalError("database is locked")
+                remove(entry_ids)
+
+            locked.remove = flaky_remove
+            resilient = WriteBehindBuffer(lambda updates: None, locked, interval=0.01).start()
+            resilient.submit("order-a", {"user_rating": 3})
+            while len(remove_calls) < 1 and time.time() < deadline + 2:
+                time.sleep(0.01)
+            resilient.submit("order-b", {"user_rating": 2})
+            while len(remove_calls) < 2 and time.time() < deadline + 2:
+                time.sleep(0.01)
+            alive = resilient._thread.is_alive()
+            resilient.stop()
+            locked_left = locked.db.fetchone("SELECT COUNT(*) FROM write_behind_journal")[0]
+            assert alive and remove_calls[1] == [1, 2] and locked_left == 0
+
+        order_id = client.post("/create-order", json={"user_id": "write_behind_user", "phone_number": "13300133000",
+                                                      "form_data": {"address": "测试地址", "budget": 30}}).get_json()["order_id"]
+        with tempfile.TemporaryDirectory() as directory:
+            app.order_update_buffer = WriteBehindBuffer(app.flush_order_updates, SQLiteJournal(SQLiteDatabase(os.path.join(directory, "write_behind.db"))))
+            accepted = client.post("/order-feedback", json={"order_id": order_id, "rating": 4, "feedback": "不错"})
+            missing = client.post("/order-feedback", json={"order_id": "missing", "rating": 4})
+            pending = app.dev_orders.get(order_id).get("user_rating")
+            app.order_update_buffer.stop()
+            stored = app.dev_orders.get(order_id)
+
+            # 生产模式：格式错误的订单ID不进入缓冲
+            app.DEVELOPMENT_MODE = False
+            try:
+                app.order_update_buffer = WriteBehindBuffer(lambda updates: None, SQLiteJournal(SQLiteDatabase(os.path.join(directory, "production.db"))))
+                rejected = [app.update_order_feedback(order_id, 4, "")["success"] for order_id in ("abc", "1;drop", 0)]
+                queued = app.update_order_feedback("42", 4, "")["success"]
+                production_pending = app.order_update_buffer.stats()["pending"]
+                app.order_update_buffer.stop()
+            finally:
+                app.DEVELOPMENT_MODE = True
+
+        assert accepted.status_code == 200 and missing.status_code == 500 and pending is None
+        assert stored["user_rating"] == 4 and stored["user_feedback"] == "不错"
+        assert rejected == [False, False, False] and queued and production_pending == 1
+    finally:
+        app.order_update_buffer = None
+
+def test_lazy_startup_and_prewarm():
+    """测试冷启动：生产模式导入应用时不加载 supabase/requests 等依赖、不启动后台线程、不创建写后日志文件，
+    服务启动后能正常响应；客户端池预热只创建缺少的客户端"""
+    print("\n=== 测试冷启动 ===")
+    import argparse
+    import benchmark
+    from clients import ClientPool
+    args = argparse.Namespace(runs=1, mode='production', prewarm=False, timeout=30, verbose=False)
+    results = benchmark.bench_startup(args)
+    pool = ClientPool(object, size=2)
+    prewarmed = [pool.prewarm(1), pool.prewarm(1), pool.prewarm(5)]
+    with pool.connection():
+        pass
+    print(f"导入: {results['import_ms']}ms, 第一个响应: {results['first_response_ms']}ms, 客户端池: {pool.stats()}")
+    assert results['ok']
+    assert results['deferred_modules_loaded'] == [] and results['threads_after_import'] == []
+    assert not results['journal_created_on_import']
+    assert prewarmed == [1, 0, 1] and pool.stats()['created'] == 2
+
 def main():
     print("手机验证码API测试开始...")
     print("请确保API服务正在运行 (python3 app.py)")
@@ -72,11 +1088,39 @@ def main():
         ("健康检查", test_health_check),
         ("发送验证码", test_send_verification_code),
         ("验证码登录", test_login_with_phone),
+        ("短信发送队列", test_sms_dispatcher_with_stub_server),
+        ("Supabase客户端池", test_supabase_pool_with_stub_postgrest),
+        ("ASGI服务模式", test_asgi_app_scenarios),
+        ("注册下单压测", test_benchmark_funnel_in_process),
+        ("结构化日志", test_logging_pipeline),
+        ("用户资料缓存", test_user_cache_returning_login),
+        ("邀请统计", test_invite_summary_incremental_and_rebuild),
+        ("邀请码注册", test_signup_engine_atomic_invite_usage),
+        ("名额条件请求", test_free_drinks_etag_revalidation),
+        ("验证码消费", test_verification_code_consume),
+        ("验证码淘汰", test_verification_store_eviction),
+        ("免单名额", test_quota_counter_no_oversell),
+        ("批量下单", test_batch_create_and_submit_orders),
+        ("订单分页", test_orders_cursor_pagination),
+        ("实时推送", test_event_hub_delivery),
+        ("订单号分配", test_order_number_allocator_blocks),
+        ("紧凑记录", test_compact_records_memory),
+        ("本地SQLite存储", test_sqlite_backend_survives_restart),
+        ("请求限流", test_rate_limiter_rejects_before_sms),
+        ("多进程共享状态", test_multi_worker_shared_state),
+        ("幂等请求", test_idempotent_order_retries),
+        ("写后缓冲", test_write_behind_feedback_journal),
+        ("冷启动", test_lazy_startup_and_prewarm),
     ]
     
     results = []
     for test_name, test_func in tests:
-        result = test_func()
+        # 新的测试用 assert 检查，失败时抛出 AssertionError；原有的测试返回 True/False
+        try:
+            result = test_func() is not False
+        except AssertionError as e:
+            print(f"{test_name}断言失败: {e}")
+            result = False
         results.append((test_name, result))
         time.sleep(1)  # 短暂延迟
     
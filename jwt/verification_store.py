@@ -0,0 +1,164 @@
+"""
+验证码存储 - 按过期时间淘汰的内存存储、数据库存储和后台清理线程
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from logs import get_logger
+
+logger = get_logger('verification')
+
+
+class MemoryVerificationCodeStore:
+    """开发模式的验证码存储
+
+    每个手机号只保留最新的验证码，验证成功后立即删除；
+    过期时间放在小顶堆里，清理时只弹出已过期的堆顶，不需要遍历全部验证码。
+    超过 max_entries 时提前淘汰最早过期的验证码，内存占用有上限。
+    """
+
+    def __init__(self, ttl_seconds=600, max_entries=100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._codes = {}   # 手机号 -> (验证码, 过期时间戳)
+        self._expiry_heap = []  # (过期时间戳, 手机号)，手机号重新发送后旧条目作废
+        self._evictions = {'used': 0, 'expired': 0, 'capacity': 0}
+
+    def put(self, phone_number, code):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._codes[phone_number] = (code, expires_at)
+            heapq.heappush(self._expiry_heap, (expires_at, phone_number))
+            while len(self._codes) > self.max_entries:
+                self._pop_earliest('capacity')
+            # 重复发送会留下作废的堆条目，数量过多时重建堆
+            if len(self._expiry_heap) > 2 * len(self._codes) + 1024:
+                self._expiry_heap = [(expires_at, phone) for phone, (_, expires_at) in self._codes.items()]
+                heapq.heapify(self._expiry_heap)
+
+    def consume(self, phone_number, input_code):
+        """校验验证码并标记为已使用，返回 'ok' | 'not_found' | 'expired' | 'mismatch'"""
+        with self._lock:
+            record = self._codes.get(phone_number)
+            if record is None:
+                return 'not_found'
+            code, expires_at = record
+            if time.time() > expires_at:
+                return 'expired'
+            if code != input_code:
+                return 'mismatch'
+            del self._codes[phone_number]
+            self._evictions['used'] += 1
+            return 'ok'
+
+    def purge_expired(self, batch_size=1000):
+        """清理最多 batch_size 个已过期的验证码，返回清理数量"""
+        now = time.time()
+        purged = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now and purged < batch_size:
+                if self._pop_earliest('expired'):
+                    purged += 1
+        return purged
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'size': len(self._codes),
+                'heap_size': len(self._expiry_heap),
+                'evictions': dict(self._evictions),
+            }
+
+    def _pop_earliest(self, reason):
+        """弹出堆顶，仅当它仍是该手机号的当前验证码时才删除，返回是否删除"""
+        expires_at, phone_number = heapq.heappop(self._expiry_heap)
+        record = self._codes.get(phone_number)
+        if record is None or record[1] != expires_at:
+            return False
+        del self._codes[phone_number]
+        self._evictions[reason] += 1
+        return True
+
+
+class SupabaseVerificationCodeStore:
+    """生产模式的验证码存储，消费和清理都通过数据库函数一次完成"""
+
+    def __init__(self, pool, ttl_seconds=600):
+        self.pool = pool
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._evictions = {'purged': 0}
+
+    def put(self, phone_number, code):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        with self.pool.connection() as supabase:
+            return supabase.table('verification_codes').insert({
+                'phone_number': phone_number,
+                'code': code,
+                'expires_at': expires_at.isoformat(),
+                'used': False
+            }).execute()
+
+    def consume(self, phone_number, input_code):
+        with self.pool.connection() as supabase:
+            result = supabase.rpc('consume_verification_code', {
+                'p_phone_number': phone_number,
+                'p_code': input_code
+            }).execute()
+        return result.data
+
+    def purge_expired(self, batch_size=1000):
+        """删除最多 batch_size 条已使用或已过期的验证码"""
+        with self.pool.connection() as supabase:
+            result = supabase.rpc('purge_verification_codes', {'p_batch_size': batch_size}).execute()
+        purged = result.data or 0
+        with self._lock:
+            self._evictions['purged'] += purged
+        return purged
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'supabase', 'evictions': dict(self._evictions)}
+
+
+class VerificationCodeSweeper:
+    """后台清理线程，每隔 interval 秒分批清理过期验证码，直到一批不满为止"""
+
+    def __init__(self, store, interval=60, batch_size=1000):
+        self.store = store
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="verification-sweeper", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sweep(self):
+        total = 0
+        while True:
+            purged = self.store.purge_expired(self.batch_size)
+            total += purged
+            if purged < self.batch_size:
+                return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("⚠️  验证码清理失败: %s", e)
@@ -0,0 +1,249 @@
+"""
+写后缓冲 - 订单反馈等对延迟不敏感的更新先写入本地日志，后台按订单合并后批量写库
+
+请求线程只把更新追加到本地SQLite日志（write_behind_journal 表）并合并到待写队列，立即返回；
+后台线程在待写订单数达到 max_batch 或每隔 interval 秒时把同一订单的多次更新合并成一次，
+整批交给写库函数，成功后才从日志中删除。写库失败的更新留在队列中下次重试；
+进程崩溃后，新进程打开同一个日志时会重放其中未写库的更新。
+
+日志使用单独的数据库文件（只有 write_behind_journal 一张表），不应用 migrations/ 和 migrations_sqlite/ 下的迁移。
+只有日志文件放在持久化存储上（如挂载的数据卷）时更新才不会丢失：容器的临时文件系统随容器一起销毁。
+"""
+
+import json
+import os
+import threading
+
+from logs import get_logger
+
+logger = get_logger('write_behind')
+
+
+# 每次提交的更新一行（key 为订单ID，fields 为JSON格式的字段，owner 为写入进程的pid），写库成功后删除
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS write_behind_journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+class SQLiteJournal:
+    """本地日志：每次更新一行（记录写入进程的pid），写库成功后删除
+
+    多个工作进程可以共用同一个日志：启动时只认领已退出的进程留下的更新，不会重放仍在运行的进程的更新。
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.db.execute(JOURNAL_SCHEMA)
+
+    def append(self, key, fields):
+        """追加一条更新，返回日志ID"""
+        return self.db.execute('INSERT INTO write_behind_journal (owner, key, fields) VALUES (?, ?, ?)',
+                               (os.getpid(), key, json.dumps(fields, ensure_ascii=False))).lastrowid
+
+    def claim(self):
+        """认领已退出的进程（包括本进程号的上一次运行）留下的更新，按写入顺序返回 (日志ID, 键, 字段)"""
+        pid = os.getpid()
+        rows = []
+        with self.db.transaction() as conn:
+            for (owner,) in conn.execute('SELECT DISTINCT owner FROM write_behind_journal').fetchall():
+                if owner == pid or not _process_alive(owner):
+                    rows += conn.execute('UPDATE write_behind_journal SET owner = ? WHERE owner = ? RETURNING id, key, fields',
+                                         (pid, owner)).fetchall()
+        return sorted((row['id'], row['key'], json.loads(row['fields'])) for row in rows)
+
+    def remove(self, entry_ids):
+        with self.db.transaction() as conn:
+            conn.executemany('DELETE FROM write_behind_journal WHERE id = ?', [(entry_id,) for entry_id in entry_ids])
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriteBehindBuffer:
+    """按键合并更新、批量写库的写后缓冲
+
+    flush(updates) 接收 {键: 合并后的字段}，在后台线程中调用；抛出异常时对半拆分重试，写出能写的部分，
+    其余保留到下次重试。在同一次写出中其他键写库成功（数据库可用）而某个键单独失败 max_attempts 次后，
+    丢弃该键的更新并删除其日志，一条坏数据不会一直挡住其他更新，日志也不会无限增长。
+    同一个键的多次更新按提交顺序合并，后提交的字段覆盖先提交的。
+    """
+
+    def __init__(self, flush, journal, max_batch=100, interval=1.0, max_attempts=3):
+        self.flush = flush
+        self.journal = journal
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_attempts = max_attempts
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # 键 -> (合并后的字段, [日志ID])
+        self._written = []  # 已写库但删除失败的日志ID，下次写库时重试删除
+        self._attempts = {}  # 键 -> 单独写库失败的次数
+        self._stop = False
+        self._thread = None
+        self._stats = {'submitted': 0, 'recovered': 0, 'flushed': 0, 'batches': 0, 'failures': 0, 'dropped': 0}
+
+        for entry_id, key, fields in journal.claim():
+            self._merge(key, fields, [entry_id])
+            self._stats['recovered'] += 1
+        if self._stats['recovered']:
+            logger.warning("♻️  写后缓冲从日志恢复 %s 条未写库的更新", self._stats['recovered'])
+
+    def start(self):
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """停止后台线程并写出剩余的更新（写库失败的仍保留在日志中）"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush_pending()
+
+    def submit(self, key, fields):
+        """记录一次更新：写入本地日志后返回，由后台线程批量写库"""
+        entry_id = self.journal.append(key, fields)
+        with self._cond:
+            self._merge(key, fields, [entry_id])
+            self._stats['submitted'] += 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def flush_pending(self):
+        """立即写出当前所有待写的更新，返回写库的键数，没有任何键写库成功时返回None"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                if self._written:
+                    self._remove_written([])
+                return 0
+            written, retry, failing, error = self._write(batch)
+
+            dropped = None
+            if failing is not None:
+                # 只有本次有其他键写库成功时才计数：整批失败可能只是数据库暂时不可用
+                attempts = self._attempts.get(failing, 0) + (1 if written else 0)
+                if written and attempts >= self.max_attempts:
+                    dropped = failing
+                    self._attempts.pop(failing, None)
+                    logger.error("❌ 写后缓冲丢弃键 %s 的更新：单独写库失败 %s 次: %s", failing, attempts, error)
+                else:
+                    self._attempts[failing] = attempts
+                    retry.append(failing)
+            for key in written:
+                self._attempts.pop(key, None)
+
+            removed = [entry_id for key in written for entry_id in batch[key][1]]
+            if dropped is not None:
+                removed += batch[dropped][1]
+            if removed:
+                self._remove_written(removed)
+            if retry:
+                logger.warning("⚠️  写后缓冲写库失败，%s 条更新稍后重试: %s", len(retry), error)
+            with self._cond:
+                if retry:
+                    # 放回队列，期间新提交的更新排在后面，合并时覆盖旧的字段
+                    newer, self._pending = self._pending, {}
+                    for key in retry:
+                        fields, entry_ids = batch[key]
+                        self._merge(key, fields, entry_ids)
+                    for key, (fields, entry_ids) in newer.items():
+                        self._merge(key, fields, entry_ids)
+                    self._stats['failures'] += 1
+                if dropped is not None:
+                    self._stats['dropped'] += 1
+                if written:
+                    self._stats['flushed'] += len(written)
+                    self._stats['batches'] += 1
+            return len(written) if written else None
+
+    def _write(self, batch):
+        """写出一批更新，返回 (已写库的键, 放回重试的键, 导致失败的单个键, 异常)
+
+        整批失败时逐层对半拆分：前一半写库成功则继续在后一半中查找，否则试后一半；两半都失败时
+        后一半放回重试，继续在前一半中查找。数据库不可用时每次写出最多调用 1 + 2*log2(批大小) 次。
+        """
+        keys = list(batch)
+        try:
+            self.flush({key: batch[key][0] for key in keys})
+            return keys, [], None, None
+        except Exception as e:
+            error = e
+        written, retry = [], []
+        candidate = keys
+        while len(candidate) > 1:
+            half = len(candidate) // 2
+            left, right = candidate[:half], candidate[half:]
+            if self._try_flush(batch, left):
+                written += left
+                candidate = right
+            elif self._try_flush(batch, right):
+                written += right
+                candidate = left
+            else:
+                retry += right
+                candidate = left
+        return written, retry, candidate[0], error
+
+    def _try_flush(self, batch, keys):
+        try:
+            self.flush({key: batch[key][0] for key in keys})
+            return True
+        except Exception:
+            return False
+
+    def stats(self):
+        with self._cond:
+            return {'pending': len(self._pending), 'max_batch': self.max_batch, 'interval': self.interval, **self._stats}
+
+    def _remove_written(self, entry_ids):
+        # 删除失败（如数据库被锁）时不影响已写库的结果，保留ID下次重试；重启前仍未删除的会被重放一次
+        entry_ids = self._written + entry_ids
+        try:
+            self.journal.remove(entry_ids)
+            self._written = []
+        except Exception as e:
+            logger.warning("⚠️  写后缓冲删除日志失败，%s 条稍后重试: %s", len(entry_ids), e)
+            self._written = entry_ids
+
+    def _merge(self, key, fields, entry_ids):
+        merged, ids = self._pending.setdefault(key, ({}, []))
+        merged.update(fields)
+        ids.extend(entry_ids)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop or len(self._pending) >= self.max_batch, timeout=self.interval)
+                if self._stop:
+                    return
+            try:
+                flushed = self.flush_pending()
+            except Exception as e:
+                logger.error("❌ 写后缓冲后台写出失败: %s", e)
+                flushed = None
+            if flushed is None:
+                # 写库失败时等待一个间隔再重试，避免积压的更新不停地重试
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stop, timeout=self.interval)